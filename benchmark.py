@@ -0,0 +1,637 @@
+"""
+募集フローのオフラインベンチマーク。
+
+Discordのゲートウェイ/REST APIの代わりにプロセス内の模擬サーバー (FakeDiscord) を使い、
+N人の模擬ユーザーに次の流れを通しで実行させる。
+
+    RecruitButtonView.start → ModeSelect → PeopleSelect → RankSelect → TitleModal
+    → create_vc_and_post_embed → 参加/離脱の連打 → 募集停止 (end_recruit_flow)
+
+スループット、インタラクションのレイテンシ (p50/p99)、募集1件あたりのREST呼び出し数、
+募集中の募集1件あたりのメモリを計測し、保存済みのベースラインと比較する。
+悪化が許容範囲を超えた指標があれば終了コード1で終わる。
+
+使い方:
+    python benchmark.py                      # 計測してベースラインと比較する
+    python benchmark.py --users 500          # 模擬ユーザー数を変える
+    python benchmark.py --update-baseline    # 計測結果をベースラインとして保存する
+
+ベースラインは改善を取り込むときだけ、理由を書いた専用のコミットで更新する
+(変更と同じコミットで更新すると、その変更による悪化がベースラインに吸収されて検出できない)。
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+# main の読み込み前に、状態DBと設定ファイルをベンチマーク用の一時ディレクトリに向ける
+BENCH_DIR = tempfile.mkdtemp(prefix="recruit-bench-")
+os.environ.setdefault("DISCORD_BOT_TOKEN", "benchmark")
+os.environ["RECRUIT_STATE_DB"] = os.path.join(BENCH_DIR, "recruit_state.db")
+os.environ["GUILD_CONFIG_PATH"] = os.path.join(BENCH_DIR, "guild_config.json")
+os.environ["RECRUIT_JOURNAL_PATH"] = os.path.join(BENCH_DIR, "recruit_journal.bin")
+os.environ.pop("TRACE_EXPORT_PATH", None)
+os.environ.pop("SHARD_COUNT", None)
+os.environ.pop("CLUSTER_COUNT", None)
+
+import discord
+
+import main
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# ベースラインと比較する指標
+# キー: 指標名, 値: (大きいほど良いか, 許容する悪化の割合, 許容する悪化の絶対値)
+REGRESSION_RULES = {
+    "throughput_recruits_per_sec": (True, 0.20, 0.0),
+    "interaction_p50_ms": (False, 0.25, 2.0),
+    "interaction_p99_ms": (False, 0.25, 20.0),
+    "rest_calls_per_recruit": (False, 0.0, 0.5),
+    "memory_per_flow_kib": (False, 0.25, 2.0),
+}
+
+# ステップ (join / leave / stop_recruit など) ごとの p99 の許容範囲 (割合, ミリ秒)
+# 全体の p99 は件数の多い参加に引っ張られ、1つのステップの悪化が埋もれるため、ステップごとにも比較する
+STEP_P99_RULE = (0.5, 50.0)
+
+
+# --- Discordの模擬サーバー ---
+
+class FakeDiscord:
+    """REST呼び出しの回数を数え、呼び出しごとに一定の遅延を入れる模擬Discord"""
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        self.interaction_calls = Counter()
+        self.channels = {}
+        self.guilds = {}
+        self._ids = itertools.count()
+
+    def next_id(self) -> int:
+        # 作成時刻を含むスノーフレークにする (interaction.created_at の計算に使われる)
+        return discord.utils.time_snowflake(datetime.datetime.now(datetime.timezone.utc)) + next(self._ids) % 4096
+
+    async def rest(self, kind: str):
+        self.calls[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def interaction_call(self, kind: str):
+        self.interaction_calls[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+
+class FakeRole:
+    def __init__(self, role_id: int, name: str):
+        self.id = role_id
+        self.name = name
+        self.mention = f"<@&{role_id}>"
+
+
+class FakeMember:
+    def __init__(self, member_id: int, name: str, guild):
+        self.id = member_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{member_id}>"
+        self.guild = guild
+        self.bot = False
+        self.voice = None
+
+
+class FakeGuild:
+    def __init__(self, fake: FakeDiscord, guild_id: int):
+        self.fake = fake
+        self.id = guild_id
+        self.name = "benchmark"
+        self.default_role = FakeRole(guild_id, "@everyone")
+        self.me = FakeMember(fake.next_id(), "bot", self)
+        self.members = {}
+        self.roles = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_channel(self, channel_id):
+        channel = self.fake.channels.get(channel_id)
+        return channel if channel is not None and channel.guild is self else None
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    async def create_voice_channel(self, name: str, overwrites=None, category=None):
+        await self.fake.rest("create_channel")
+        return FakeVoiceChannel(self.fake, self, name, category, overwrites)
+
+
+class FakeCategory:
+    def __init__(self, fake: FakeDiscord, guild: FakeGuild):
+        self.fake = fake
+        self.id = fake.next_id()
+        self.name = "募集VC"
+        self.guild = guild
+        fake.channels[self.id] = self
+
+    @property
+    def voice_channels(self):
+        return [c for c in self.fake.channels.values() if isinstance(c, FakeVoiceChannel) and c.category_id == self.id]
+
+    async def create_voice_channel(self, name: str, overwrites=None):
+        return await self.guild.create_voice_channel(name, overwrites=overwrites, category=self)
+
+
+class FakeVoiceChannel:
+    def __init__(self, fake: FakeDiscord, guild: FakeGuild, name: str, category, overwrites):
+        self.fake = fake
+        self.id = fake.next_id()
+        self.name = name
+        self.guild = guild
+        self.category = category
+        self.category_id = category.id if category else None
+        self.overwrites = dict(overwrites or {})
+        self.voice_states = {}
+        self.members = []
+        self.mention = f"<#{self.id}>"
+        fake.channels[self.id] = self
+
+    def overwrites_for(self, target):
+        return self.overwrites.get(target, discord.PermissionOverwrite())
+
+    async def set_permissions(self, target, *, overwrite=None, **permissions):
+        await self.fake.rest("set_permissions")
+        self.overwrites[target] = overwrite if overwrite is not None else discord.PermissionOverwrite(**permissions)
+
+    async def edit(self, **fields):
+        await self.fake.rest("edit_channel")
+        if "name" in fields:
+            self.name = fields["name"]
+        if "overwrites" in fields:
+            self.overwrites = dict(fields["overwrites"])
+        return self
+
+    async def delete(self, reason=None):
+        await self.fake.rest("delete_channel")
+        self.fake.channels.pop(self.id, None)
+
+
+class FakeMessage:
+    def __init__(self, fake: FakeDiscord, channel, content, embed, view):
+        self.fake = fake
+        self.id = fake.next_id()
+        self.channel = channel
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.view = view
+
+    async def edit(self, **fields):
+        await self.fake.rest("edit_message")
+        if "content" in fields:
+            self.content = fields["content"]
+        if "embed" in fields:
+            self.embeds = [fields["embed"]] if fields["embed"] else []
+        if "view" in fields:
+            self.view = fields["view"]
+        return self
+
+    async def delete(self):
+        await self.fake.rest("delete_message")
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeTextChannel:
+    def __init__(self, fake: FakeDiscord, guild: FakeGuild, name: str):
+        self.fake = fake
+        self.id = fake.next_id()
+        self.name = name
+        self.guild = guild
+        self.mention = f"<#{self.id}>"
+        self.messages = {}
+        fake.channels[self.id] = self
+
+    async def send(self, content=None, *, embed=None, view=None):
+        await self.fake.rest("send_message")
+        message = FakeMessage(self.fake, self, content, embed, view)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.fake.rest("fetch_message")
+        message = self.messages.get(message_id)
+        if message is None:
+            raise discord.NotFound(FakeHTTPResponse(404), "Unknown Message")
+        return message
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id)
+
+
+class FakeHTTPResponse:
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = "benchmark"
+        self.headers = {}
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+        self.content = None
+        self.view = None
+        self.modal = None
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self, kind: str):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        await self._interaction.fake.interaction_call(kind)
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False):
+        await self._respond("send_message")
+        self.content = content
+        self.view = view
+
+    async def edit_message(self, *, content=None, embed=None, view=None):
+        await self._respond("edit_message")
+        self.content = content
+        self.view = view
+
+    async def send_modal(self, modal):
+        await self._respond("send_modal")
+        self.modal = modal
+
+    async def defer(self, *, ephemeral=False, thinking=False):
+        await self._respond("defer")
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self.messages = []
+        self.sent = asyncio.Event()
+
+    async def send(self, content=None, *, embed=None, view=None, ephemeral=False):
+        await self._interaction.fake.interaction_call("followup")
+        self.messages.append(content)
+        self.sent.set()
+
+
+class FakeInteraction(discord.Interaction):
+    """isinstance(..., discord.Interaction) を満たすように、スロットを上書きした模擬インタラクション"""
+    id = None
+    user = None
+    guild = None
+    guild_id = None
+    channel = None
+    message = None
+    response = None
+    followup = None
+
+    def __init__(self, fake: FakeDiscord, user: FakeMember):
+        self.fake = fake
+        self.id = fake.next_id()
+        self.user = user
+        self.guild = user.guild
+        self.guild_id = user.guild.id
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, *, content=None, embed=None, view=None):
+        await self.fake.interaction_call("edit_original_response")
+
+
+# --- 計測 ---
+
+class FlowBenchmark:
+    """模擬サーバー上で募集フローを N 人分並行に実行し、指標を集計する"""
+    def __init__(self, users: int, guilds: int, joiners: int, latency: float, seed: int):
+        self.users = users
+        self.guild_count = max(1, min(guilds, users))
+        self.joiners = joiners
+        self.fake = FakeDiscord(latency)
+        self.random = random.Random(seed)
+        self.latencies = {}
+        self.post_latencies = []
+        self.completed = 0
+        self.failures = Counter()
+        self.memory_per_flow = None
+        self._memory_peak = 0
+        self._posted = 0
+        self._all_posted = None
+
+    def _build_world(self):
+        """
+        ギルドを guilds 個作り、募集主を順番に割り当てる。
+        募集投稿チャンネルへの書き込みはルートごとのレート制限 (5回/5秒) で律速されるため、
+        ギルド数を変えると1チャンネルあたりの負荷を調整できる。
+        """
+        fake = self.fake
+        configs = {}
+        self.guilds = []
+        for _ in range(self.guild_count):
+            guild = FakeGuild(fake, fake.next_id())
+            fake.guilds[guild.id] = guild
+            category = FakeCategory(fake, guild)
+            button_channel = FakeTextChannel(fake, guild, "募集開始")
+            post_channel = FakeTextChannel(fake, guild, "募集一覧")
+            for name in ("アイアン", "ブロンズ", "シルバー", "ゴールド", "プラチナ", "ダイヤ"):
+                role = FakeRole(fake.next_id(), name)
+                guild.roles[role.id] = role
+
+            config = main.GuildConfig(guild.id, category.id, list(guild.roles), button_channel.id, post_channel.id)
+            config.category = category
+            config.button_channel = button_channel
+            config.post_channel = post_channel
+            config.rank_roles = list(guild.roles.values())
+            configs[guild.id] = config
+            self.guilds.append(guild)
+        main.guild_configs._configs = configs
+
+        self.recruiters = [self._member(f"recruiter{i}", self.guilds[i % self.guild_count]) for i in range(self.users)]
+        self.joiner_groups = [
+            [self._member(f"joiner{i}-{j}", self.guilds[i % self.guild_count]) for j in range(self.joiners)]
+            for i in range(self.users)
+        ]
+
+    def _member(self, name: str, guild: FakeGuild) -> FakeMember:
+        member = FakeMember(self.fake.next_id(), name, guild)
+        guild.members[member.id] = member
+        return member
+
+    @staticmethod
+    def _button(action: str, recruiter: FakeMember):
+        """募集メッセージのボタンを、Botが custom_id から組み立てるのと同じように組み立ててコールバックを返す"""
+        return main.RecruitPostButton(action, recruiter.id).callback
+
+    async def _click(self, step: str, callback, interaction):
+        started = time.perf_counter()
+        await callback(interaction)
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    async def _run_user(self, index: int, start_view):
+        fake = self.fake
+        recruiter = self.recruiters[index]
+
+        interaction = FakeInteraction(fake, recruiter)
+        await self._click("start", start_view.start.callback, interaction)
+
+        select = interaction.response.view.children[0]
+        select.item._values = [self.random.choice(list(main.MATCH_MODES))]
+        interaction = FakeInteraction(fake, recruiter)
+        await self._click("mode_select", select.callback, interaction)
+
+        select = interaction.response.view.children[0]
+        select.item._values = [self.random.choice(["1", "2", "4"])]
+        interaction = FakeInteraction(fake, recruiter)
+        await self._click("people_select", select.callback, interaction)
+
+        select = interaction.response.view.children[0]
+        select.item._values = self.random.sample([option.value for option in select.item.options], self.random.randint(1, 3))
+        interaction = FakeInteraction(fake, recruiter)
+        await self._click("rank_select", select.callback, interaction)
+
+        title_interaction = FakeInteraction(fake, recruiter)
+        await self._click("title_button", interaction.response.view.children[0].callback, title_interaction)
+
+        modal = title_interaction.response.modal
+        modal.title_input._value = f"ベンチマーク募集 {index}"
+        posted_at = time.perf_counter()
+        await self._click("title_modal", modal.on_submit, FakeInteraction(fake, recruiter))
+
+        # create_vc_and_post_embed は別タスクで動くため、募集主への完了通知を待つ
+        await title_interaction.followup.sent.wait()
+        self.post_latencies.append(time.perf_counter() - posted_at)
+        flow = main.active_recruit_flows.get(recruiter.id)
+        if flow is None or flow.message_id is None:
+            self.failures["post"] += 1
+            return
+
+        # 参加の連打: 空き枠より多い人数が同時に参加ボタンを押す
+        joiners = self.joiner_groups[index]
+        await asyncio.gather(*(self._click("join", self._button("join", recruiter), FakeInteraction(fake, member)) for member in joiners))
+        if flow.participant_count > flow.total_party_size:
+            self.failures["overfilled"] += 1
+
+        self._posted += 1
+        if self._posted == self.users:
+            self._all_posted.set()
+        await self._all_posted.wait()
+
+        # 離脱の連打: 参加できた人の半分が離脱し、その直後に残りが参加し直そうとする
+        joined = [member for member in joiners if flow.has_participant(member.id)]
+        leavers = joined[: len(joined) // 2]
+        await asyncio.gather(*(self._click("leave", self._button("leave", recruiter), FakeInteraction(fake, member)) for member in leavers))
+        await asyncio.gather(*(self._click("join", self._button("join", recruiter), FakeInteraction(fake, member)) for member in joiners if not flow.has_participant(member.id)))
+
+        await self._click("stop_recruit", self._button("stop", recruiter), FakeInteraction(fake, recruiter))
+        if recruiter.id in main.active_recruit_flows:
+            self.failures["not_ended"] += 1
+            return
+        self.completed += 1
+
+    @staticmethod
+    def _traced_bytes() -> int:
+        """main.py から確保されたメモリの合計 (模擬サーバー側のオブジェクトは除く)"""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(True, main.__file__, all_frames=True),
+            tracemalloc.Filter(False, __file__),
+        ])
+        return sum(stat.size for stat in snapshot.statistics("filename"))
+
+    async def _measure_memory(self):
+        """全員の募集が投稿された時点の確保量を記録する"""
+        await self._all_posted.wait()
+        self._memory_peak = self._traced_bytes()
+
+    async def run(self, measure_memory: bool) -> float:
+        main.bot.get_channel = self.fake.get_channel
+        main.bot.get_guild = self.fake.get_guild
+        self._build_world()
+        self._all_posted = asyncio.Event()
+
+        if main.VC_POOL_SIZE > 0:
+            for config in main.guild_configs.all():
+                main.get_vc_pool(config.category.id).start(config.category)
+
+        memory_task = None
+        if measure_memory:
+            tracemalloc.start(25)
+            memory_task = asyncio.create_task(self._measure_memory())
+
+        start_view = main.RecruitButtonView()
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_user(i, start_view) for i in range(self.users)))
+        elapsed = time.perf_counter() - started
+
+        if memory_task is not None:
+            # 募集が全て終わった後も残る分 (トレースのリングバッファやメトリクスなど) を差し引き、
+            # 募集中の募集が保持していたメモリだけを1件あたりに換算する
+            await memory_task
+            await asyncio.sleep(main.EMBED_UPDATE_INTERVAL)
+            self.memory_per_flow = max(0, self._memory_peak - self._traced_bytes()) / self.users
+            tracemalloc.stop()
+
+        for pool in main.vc_pools.values():
+            await pool.stop()
+        return elapsed
+
+
+def percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def run_passes(args):
+    """Botの常駐タスクを起動し、時間の計測とメモリの計測を順に実行する"""
+    await main.bot._async_setup_hook()
+    main.recruit_store.start()
+    main.empty_vc_scheduler.start()
+    main.wizard_scheduler.start()
+    try:
+        timing = FlowBenchmark(args.users, args.guilds, args.joiners, args.rest_latency, args.seed)
+        elapsed = await timing.run(measure_memory=False)
+        # メモリの計測は tracemalloc の負荷が時間の計測に乗らないように別に実行する
+        memory = FlowBenchmark(args.users, args.guilds, args.joiners, args.rest_latency, args.seed)
+        await memory.run(measure_memory=True)
+    finally:
+        await main.empty_vc_scheduler.stop()
+        await main.wizard_scheduler.stop()
+        await main.rest_scheduler.stop()
+        await main.recruit_store.close()
+        await main.recruit_journal.close()
+    return timing, memory, elapsed
+
+
+def run_benchmark(args) -> dict:
+    timing, memory, elapsed = asyncio.run(run_passes(args))
+
+    samples = [value for values in timing.latencies.values() for value in values]
+    recruits = max(1, timing.completed)
+    return {
+        "users": args.users,
+        "guilds": args.guilds,
+        "joiners_per_recruit": args.joiners,
+        "rest_latency_ms": args.rest_latency * 1000,
+        "completed": timing.completed,
+        "failures": dict(timing.failures),
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_recruits_per_sec": round(timing.completed / elapsed, 2),
+        "interaction_p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+        "interaction_p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        "post_p50_ms": round(percentile(timing.post_latencies, 0.50) * 1000, 2),
+        "post_p99_ms": round(percentile(timing.post_latencies, 0.99) * 1000, 2),
+        "steps": {
+            step: {"p50_ms": round(percentile(values, 0.50) * 1000, 2), "p99_ms": round(percentile(values, 0.99) * 1000, 2), "count": len(values)}
+            for step, values in timing.latencies.items()
+        },
+        "rest_calls_per_recruit": round(sum(timing.fake.calls.values()) / recruits, 2),
+        "rest_calls": dict(timing.fake.calls),
+        "interaction_responses_per_recruit": round(sum(timing.fake.interaction_calls.values()) / recruits, 2),
+        "memory_per_flow_kib": round((memory.memory_per_flow or 0) / 1024, 2),
+    }
+
+
+def compare(result: dict, baseline: dict) -> list:
+    """ベースラインより許容範囲を超えて悪化した指標のメッセージを返す"""
+    regressions = []
+    for name, (higher_is_better, ratio, slack) in REGRESSION_RULES.items():
+        if name not in baseline:
+            continue
+        current, reference = result[name], baseline[name]
+        if higher_is_better:
+            limit = reference * (1 - ratio) - slack
+            if current < limit:
+                regressions.append(f"{name}: {current} (ベースライン {reference}, 下限 {limit:.2f})")
+        else:
+            limit = reference * (1 + ratio) + slack
+            if current > limit:
+                regressions.append(f"{name}: {current} (ベースライン {reference}, 上限 {limit:.2f})")
+
+    ratio, slack = STEP_P99_RULE
+    for step, reference in baseline.get("step_p99_ms", {}).items():
+        if step not in result["steps"]:
+            regressions.append(f"steps.{step}: 計測されませんでした")
+            continue
+        current = result["steps"][step]["p99_ms"]
+        limit = reference * (1 + ratio) + slack
+        if current > limit:
+            regressions.append(f"steps.{step}.p99_ms: {current} (ベースライン {reference}, 上限 {limit:.2f})")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="募集フローのオフラインベンチマーク")
+    parser.add_argument("--users", type=int, default=100, help="同時に募集を作成する模擬ユーザー数")
+    parser.add_argument("--guilds", type=int, default=50, help="模擬ユーザーを振り分けるギルドの数")
+    parser.add_argument("--joiners", type=int, default=8, help="募集1件あたりに参加ボタンを押す人数")
+    parser.add_argument("--rest-latency", type=float, default=0.005, help="模擬REST呼び出し1回あたりの遅延 (秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="比較するベースラインのJSONファイル")
+    parser.add_argument("--update-baseline", action="store_true", help="計測結果をベースラインとして保存する")
+    parser.add_argument("--log", action="store_true", help="Botのログ (INFO) を出力する")
+    args = parser.parse_args()
+
+    if not args.log:
+        logging.disable(logging.INFO)
+
+    result = run_benchmark(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if result["failures"]:
+        print(f"募集フローの失敗: {result['failures']}", file=sys.stderr)
+        return 1
+
+    if args.update_baseline:
+        saved = {name: result[name] for name in ("users", "guilds", "joiners_per_recruit", "rest_latency_ms", *REGRESSION_RULES)}
+        saved["step_p99_ms"] = {step: values["p99_ms"] for step, values in result["steps"].items()}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"ベースラインを {args.baseline} に保存しました。")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"ベースライン {args.baseline} がありません。--update-baseline で作成してください。", file=sys.stderr)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    conditions = ("users", "guilds", "joiners_per_recruit", "rest_latency_ms")
+    if any(baseline.get(name) != result[name] for name in conditions):
+        print("ベースラインと計測条件が異なるため比較しません。", file=sys.stderr)
+        return 0
+    if "step_p99_ms" not in baseline:
+        print("ベースラインにステップごとの p99 が無いため、ステップごとの比較は行いません。", file=sys.stderr)
+    regressions = compare(result, baseline)
+    if regressions:
+        print("ベースラインより悪化した指標:", file=sys.stderr)
+        for line in regressions:
+            print(f" - {line}", file=sys.stderr)
+        return 1
+    print("ベースラインとの比較: 問題なし")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -2,15 +2,188 @@ import discord
 from discord.ext import commands, tasks
 from discord.ui import View, Button, Select, TextInput, Modal
 import asyncio
+import atexit
+import bisect
+import contextvars
+import hashlib
+import heapq
+import functools
+import itertools
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
 import threading
-from flask import Flask
+import time
+try:
+    import resource  # 起動レポートのメモリ使用量 (Windows には無い)
+except ImportError:
+    resource = None
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import numpy as np
+from aiohttp import web
 from datetime import datetime
 from discord import app_commands
 
 # ロギング設定
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# ログは呼び出し元では整形せず上限付きのキューに積み、書き出しスレッドが整形して出力する (イベントループをI/Oで止めない)
+# 既定 (LOG_FORMAT=text) は従来の1行形式で出力し、LOG_FORMAT=json を指定した場合だけ1行1レコードのJSONで出力する
+# 既存の運用 (ログの目視やテキスト前提の集計) を壊さないよう既定はテキストのままにし、構造化フィールドが必要な環境で json を選ぶ
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+# extra={"rate_limit": True} を付けた WARNING 未満のログは、呼び出し箇所ごとに LOG_RATE_LIMIT_PERIOD 秒あたり LOG_RATE_LIMIT 件まで出力する (0なら無制限)
+# 募集の作成・参加・離脱・終了などの記録は抑制しないよう、頻繁に出る監視系のログにだけ付ける
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "20"))
+LOG_RATE_LIMIT_PERIOD = 10.0
+
+# JSONのレコードに載せる構造化フィールド (extra= か bind_log_context() で渡す)
+LOG_FIELDS = ("guild_id", "recruiter_id", "vc_id", "user_id", "trace_id", "suppressed")
+
+# 実行中のスパン (トレースIDの受け渡しに使い、ログのレコードにもトレースIDとして載せる)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+# 処理中の募集・VCなどのログ用フィールド。create_task で派生したタスクにも引き継がれる
+log_context = contextvars.ContextVar("log_context", default=None)
+
+
+def bind_log_context(**fields):
+    """現在のコンテキストのログにフィールドを追加する。戻り値は log_context.reset() に渡すトークン"""
+    return log_context.set({**(log_context.get() or {}), **fields})
+
+
+class LogRateLimiter(logging.Filter):
+    """
+    rate_limit を指定した WARNING 未満のログを呼び出し箇所 (ファイルと行) ごとに制限するフィルター。
+    期間内に捨てた件数は、次の期間の最初のレコードの suppressed フィールドで出力する。
+    """
+    def __init__(self, pipeline: "LogPipeline", limit: int, period: float):
+        super().__init__()
+        self.pipeline = pipeline
+        self.limit = limit
+        self.period = period
+        # キー: (ファイル, 行), 値: [期間の開始時刻, 出力した件数, 捨てた件数]
+        self._windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.limit <= 0 or not getattr(record, "rate_limit", False):
+            return True
+        key = (record.pathname, record.lineno)
+        with self.pipeline.lock:
+            window = self._windows.get(key)
+            if window is None or record.created - window[0] >= self.period:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                self._windows[key] = [record.created, 1, 0]
+                return True
+            if window[1] < self.limit:
+                window[1] += 1
+                return True
+            window[2] += 1
+        self.pipeline.count_dropped("rate_limited")
+        return False
+
+
+class LogContextFilter(logging.Filter):
+    """呼び出し元のコンテキストのフィールドと現在のトレースIDをレコードに写す (extra= で渡した値を優先する)"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in (log_context.get() or {}).items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        span = current_span.get()
+        if span is not None and not hasattr(record, "trace_id"):
+            record.trace_id = span.trace_id
+        return True
+
+
+class JsonLogFormatter(logging.Formatter):
+    """レコードを1行のJSONに整形する"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in LOG_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """キューが一杯なら待たずにレコードを捨てて数えるキューハンドラー"""
+    def __init__(self, pipeline: "LogPipeline"):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # メッセージの整形は書き出しスレッドで行う (同じプロセス内のスレッドなのでレコードはそのまま渡せる)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.count_dropped("queue_full")
+
+
+class BlockingSentinelListener(logging.handlers.QueueListener):
+    """停止の合図はキューが一杯でも必ず積む (書き出しスレッドが空けるのを待つ)"""
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """ルートロガーの出力を、上限付きのキューと書き出しスレッドに置き換える"""
+    def __init__(self, queue_size: int, log_format: str):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        # キー: 捨てた理由 (queue_full / rate_limited), 値: 件数
+        self.dropped = {"queue_full": 0, "rate_limited": 0}
+        output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonLogFormatter() if log_format == "json" else logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        self.handler = DroppingQueueHandler(self)
+        self.handler.addFilter(LogRateLimiter(self, LOG_RATE_LIMIT, LOG_RATE_LIMIT_PERIOD))
+        self.handler.addFilter(LogContextFilter())
+        self.listener = BlockingSentinelListener(self.queue, output)
+
+    def count_dropped(self, reason: str):
+        with self.lock:
+            self.dropped[reason] += 1
+
+    def start(self):
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(self.handler)
+        self.listener.start()
+        atexit.register(self.stop)  # logging 自身の終了処理より先に、キューに残ったレコードを書き出す
+
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+
+# ログの出力パイプライン
+log_pipeline = LogPipeline(LOG_QUEUE_SIZE, LOG_FORMAT)
+log_pipeline.start()
+
+# 起動にかかった時間の計測用
+PROCESS_STARTED_AT = time.monotonic()
 
 
 
@@ -20,7 +193,62 @@ intents.guilds = True
 intents.members = True          # メンバー情報取得に必要
 intents.message_content = True  # コマンドやテキスト内容に必要
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# 1の場合、起動時に全メンバーを取得 (チャンク) せず、メンバーキャッシュをVCに接続中のメンバーに絞る
+# 募集に必要なメンバーはその都度取得し、MEMBER_LRU_SIZE 件までLRUで保持する (大規模サーバー向け)
+LEAN_MEMBER_CACHE = os.environ.get("LEAN_MEMBER_CACHE", "0") == "1"
+MEMBER_LRU_SIZE = int(os.environ.get("MEMBER_LRU_SIZE", "5000"))
+
+# Botの生成オプション (メンバーキャッシュの設定)
+if LEAN_MEMBER_CACHE:
+    member_cache_flags = discord.MemberCacheFlags.none()
+    member_cache_flags.voice = True  # 募集VCの在室人数の把握に使う
+    bot_cache_options = {"chunk_guilds_at_startup": False, "member_cache_flags": member_cache_flags}
+else:
+    bot_cache_options = {}
+
+# discord.py 内部でのレート制限待ちの上限 (秒)。これを超える待ちは RateLimited として rest_scheduler に返し、ワーカーを塞がずに再スケジュールする
+# discord.py は30秒未満の値を30秒に切り上げるため、それより短い待ちの間はワーカーが塞がる (REST_RESERVED_INTERACTIVE_WORKERS を参照)
+REST_MAX_RATELIMIT_WAIT = 30.0
+
+# シャード構成 (環境変数 SHARD_COUNT を指定すると AutoShardedBot で起動する)
+# SHARD_IDS: このプロセスが担当するシャードIDのカンマ区切り (省略時は全シャード)
+# CLUSTER_COUNT: 1より大きい場合、起動時にシャードをこの数のプロセスに分けて起動する
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(i) for i in os.environ["SHARD_IDS"].split(",")] if os.environ.get("SHARD_IDS") else None
+CLUSTER_COUNT = int(os.environ.get("CLUSTER_COUNT", "1"))
+CLUSTER_ID = os.environ.get("CLUSTER_ID")
+IS_SHARDED = SHARD_COUNT is not None
+
+# 共有バックエンド上でこのプロセスを識別するID
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# rest_scheduler が実行中のジョブのルートのバケット (RouteBucket)。HTTPのレスポンスからレート制限を学習するのに使う
+current_rest_bucket = contextvars.ContextVar("current_rest_bucket", default=None)
+
+
+async def learn_rate_limit_headers(session, trace_ctx, params):
+    """成功・失敗を問わず、すべてのレスポンスの X-RateLimit-* ヘッダーを実行中のジョブのバケットに反映する"""
+    bucket = current_rest_bucket.get()
+    if bucket is not None:
+        bucket.learn(params.response.headers)
+
+
+# discord.py のHTTPセッションに付けるトレース設定
+rest_http_trace = aiohttp.TraceConfig()
+rest_http_trace.on_request_end.append(learn_rate_limit_headers)
+
+if IS_SHARDED:
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS,
+        max_ratelimit_timeout=REST_MAX_RATELIMIT_WAIT,
+        http_trace=rest_http_trace,
+        **bot_cache_options
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, max_ratelimit_timeout=REST_MAX_RATELIMIT_WAIT, http_trace=rest_http_trace, **bot_cache_options)
 
 # VCを作成するカテゴリID（あなたのサーバーに合わせて設定してください）
 VC_CATEGORY_ID = 1369086223049687070 
@@ -45,6 +273,18 @@ RECRUIT_BUTTON_CHANNEL_ID = 1377062614231810199
 # 募集内容のEmbedを投稿するチャンネルID
 RECRUIT_POST_CHANNEL_ID = 1380821926913769543
 
+# ギルドごとの設定ファイル (JSON) のパス
+# 形式: {"<ギルドID>": {"vc_category_id": ..., "rank_role_ids": [...], "recruit_button_channel_id": ..., "recruit_post_channel_id": ...}}
+# ファイルが無い場合は、上の定数を VC_CATEGORY_ID があるギルドの設定として使う
+GUILD_CONFIG_PATH = os.environ.get("GUILD_CONFIG_PATH", "guild_config.json")
+
+# 最後に同期したスラッシュコマンドのフィンガープリントを保存するファイルのパス
+# 形式: {"<アプリケーションID>:<global またはギルドID>": "<sha256>"}
+COMMAND_SYNC_STATE_PATH = os.environ.get("COMMAND_SYNC_STATE_PATH", "command_sync_state.json")
+
+# 開発用: 指定するとスラッシュコマンドをこのギルドだけに同期する (ギルドへの同期はすぐに反映される)
+DEV_GUILD_ID = int(os.environ["DEV_GUILD_ID"]) if os.environ.get("DEV_GUILD_ID") else None
+
 # グローバル変数
 # キー: discord.Member.id (募集主のID)
 # 値: RecruitFlow インスタンス
@@ -55,142 +295,2289 @@ active_recruit_flows = {}
 # 値: discord.Message.id (そのチャンネル内の募集開始ボタンメッセージID)
 start_button_message_info = {}
 
-# 募集開始ボタンのメッセージを定期的に確認・更新する間隔 (秒)
-START_BUTTON_UPDATE_INTERVAL = 60 * 5 # 5分ごとに確認
+# 募集開始ボタンのメッセージ本文
+START_BUTTON_CONTENT = "募集を開始するには以下のボタンを押してください："
+
+# 募集開始ボタンのメッセージが削除されてから再投稿するまでの待ち時間 (秒)
+START_BUTTON_REPOST_DELAY = 2
+
+# 削除イベントを取りこぼした場合に備え、募集開始ボタンのメッセージを確認する間隔 (秒)
+START_BUTTON_FALLBACK_INTERVAL = 60 * 30 # 30分ごとに確認
+
+# 最後に反映した募集開始ボタンの内容のハッシュ
+# キー: discord.TextChannel.id
+# 値: 本文とボタンから計算したハッシュ
+start_button_hashes = {}
+
+# 削除された募集開始ボタンの再投稿タスク
+# キー: discord.TextChannel.id
+# 値: asyncio.Task
+start_button_repost_tasks = {}
+
+# VCが空になってから募集を終了するまでの猶予時間 (秒)
+EMPTY_VC_GRACE_PERIOD = 300
+
+# 募集の入力 (モード・人数・ランク・タイトル) が途中で放置された募集フローを破棄するまでの時間 (秒)
+# 入力用のViewは操作が無いと180秒でタイムアウトするため、それにタイトル入力の時間を見込んだ長さにする
+WIZARD_IDLE_TTL = 600
+
+# 運用向けHTTPサーバー (/healthz, /readyz, /metrics) の待ち受けアドレスとポート (クラスタ構成ではポートにクラスタIDを足す)
+OPS_HTTP_HOST = os.environ.get("OPS_HTTP_HOST", "0.0.0.0")
+OPS_HTTP_PORT = int(os.environ.get("PORT", "8080"))
+
+# /readyz で準備完了とみなすゲートウェイのレイテンシの上限 (秒)
+READY_MAX_LATENCY = 5.0
+
+# トレースのリングバッファに保持するスパンの数と、JSON Lines で書き出す先 (未設定なら書き出さない)
+TRACE_BUFFER_SIZE = 2000
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH")
+
+# インタラクションの作成からこの秒数が経っても応答していなければ警告する (Discordの応答期限は3秒)
+TRACE_ACK_WARN_AFTER = 2.5
+
+# 募集Embedの編集を1メッセージあたり何秒に1回までにまとめるか (秒)
+EMBED_UPDATE_INTERVAL = 1.0
+
+# VCの権限の変更をまとめて1回の書き込みにするまでに待つ時間 (秒)
+VC_PERMISSION_BATCH_WINDOW = 0.3
+
+# REST呼び出しの優先度 (小さいほど優先)
+PRIORITY_INTERACTIVE = 0  # VC作成・参加権限の付与など、ユーザーが結果を待っている処理
+PRIORITY_NORMAL = 1       # 募集Embedの更新など
+PRIORITY_BACKGROUND = 2   # VC削除・終了表示・募集開始ボタンの管理などの後片付け
+
+# REST呼び出しを同時に実行する共有のワーカーの数 (対話専用のワーカー REST_RESERVED_INTERACTIVE_WORKERS 個は別に起動する)
+REST_MAX_CONCURRENCY = 4
+
+# REST_MAX_CONCURRENCY 個の共有のワーカーとは別に、PRIORITY_INTERACTIVE の呼び出し専用に起動するワーカーの数
+# 後片付けの呼び出しがレート制限待ちで共有のワーカーを塞いでいても、VC作成や参加権限の付与は待たされない
+# (共有のワーカーから割くと後片付けの処理能力が下がるため、上乗せで起動する)
+REST_RESERVED_INTERACTIVE_WORKERS = 1
+
+# 失敗したREST呼び出しのリトライ回数と、バックオフの基準時間 (秒)
+REST_MAX_RETRIES = 3
+REST_RETRY_BASE_DELAY = 0.5
+
+# 同じ種類のルートでこの回数連続して失敗したら回路を開き、REST_CIRCUIT_COOLDOWN 秒間は即座に失敗させる
+REST_CIRCUIT_FAILURE_THRESHOLD = 5
+REST_CIRCUIT_COOLDOWN = 30
+
+# レート制限ヘッダーを学習するまでの、ルートごとの既定のバケット (REST_DEFAULT_BUCKET_LIMIT 回 / REST_DEFAULT_BUCKET_PERIOD 秒)
+REST_DEFAULT_BUCKET_LIMIT = 5
+REST_DEFAULT_BUCKET_PERIOD = 5.0
+
+# 各ギルドのVCカテゴリでプールが管理するVCの数 (待機中と募集に貸し出し中の合計、0で無効)
+VC_POOL_SIZE = 3
+
+# 待機VCの名前 (起動時、カテゴリ内にあるこの名前か、ボット自身の権限の上書きがある空きVCは待機VCとして再利用する)
+VC_POOL_CHANNEL_NAME = "┣🔉・待機中"
+
+# 待機VCの補充に失敗したときに再試行するまでの時間 (秒)
+VC_POOL_REFILL_RETRY_DELAY = 30
+
+# Discordのチャンネル名変更の制限 (VC_RENAME_LIMIT 回 / VC_RENAME_WINDOW 秒)
+VC_RENAME_LIMIT = 2
+VC_RENAME_WINDOW = 600
+
+# マッチングを実行する間隔 (秒)
+MATCHMAKING_INTERVAL = 5
+
+# マッチング待ちの最大時間 (秒)。インタラクションの後続メッセージが送れる15分より短くする
+MATCHMAKING_TIMEOUT = 60 * 14
+
+# マッチングで扱うゲームモード (SelectOption の value と同じ値) とその番号
+MATCH_MODES = {"コンペ": 0, "アンレート": 1}
+
+# /募集一覧 の1ページあたりの件数
+RECRUIT_LIST_PAGE_SIZE = 10
+
+# 募集状態を保存するSQLiteデータベースのパス
+STATE_DB_PATH = os.environ.get("RECRUIT_STATE_DB", "recruit_state.db")
+
+# 募集状態の変更をまとめてデータベースに書き込む間隔 (秒)
+STATE_FLUSH_INTERVAL = 1.0
+
+# 募集のイベント (作成・参加・離脱・満員・空室・終了) を追記するジャーナルファイルのパス
+RECRUIT_JOURNAL_PATH = os.environ.get("RECRUIT_JOURNAL_PATH", "recruit_journal.bin")
+
+# /募集統計 の時間帯の集計と募集通知の「通知しない時間帯」に使うUTCからの時差 (時間)
+LOCAL_UTC_OFFSET_HOURS = int(os.environ.get("LOCAL_UTC_OFFSET_HOURS", "9"))
+
+# 0の場合、募集の投稿で対象ランクのロールをメンションしない (/募集通知 の登録者だけに知らせる)
+RANK_ROLE_MENTIONS = os.environ.get("RANK_ROLE_MENTIONS", "1") == "1"
+
+# 募集通知の配信ワーカーの数と、配信待ちにできる募集の数 (超えた分は配信せずに捨てる)
+FANOUT_WORKERS = 2
+FANOUT_QUEUE_SIZE = 200
+
+# DMは FANOUT_BATCH_SIZE 件ずつ並行して送り、バッチの間は FANOUT_BATCH_INTERVAL 秒空ける
+FANOUT_BATCH_SIZE = 10
+FANOUT_BATCH_INTERVAL = 1.0
+
+# スレッドでの通知で1メッセージにまとめるメンションの数
+FANOUT_THREAD_MENTIONS = 50
+
+# 同じ募集を同じユーザーに2回通知しないために覚えておく (ユーザー, 募集) の数
+FANOUT_DEDUP_SIZE = 10000
+
+# 募集状態を共有するバックエンドの種類 (SHARED_STATE_BACKENDS のキー)
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "sqlite")
+
+# 複数プロセスのうち1つだけが行う処理 (募集開始ボタンの管理など) のリースの有効期間 (秒)
+LEASE_TTL = 120
+
+# 停止時 (停止コマンド・SIGTERM) に並行して終了させる募集の数の上限
+DRAIN_CONCURRENCY = int(os.environ.get("DRAIN_CONCURRENCY", "16"))
+
+# 停止時に募集の終了を待つ最大時間 (秒)。オーケストレーターの猶予期間より短くする
+# 時間内に終わらなかった募集は保存されたまま残り、次回起動時に復元または片付けられる
+DRAIN_DEADLINE = float(os.environ.get("DRAIN_DEADLINE", "20"))
+
+# 1の場合、停止時に募集を終了させずに保存だけして、次に起動するプロセスへ引き継ぐ
+DRAIN_HANDOFF = os.environ.get("DRAIN_HANDOFF", "0") == "1"
+
+# 停止処理の進捗を報告する間隔 (秒)
+DRAIN_PROGRESS_INTERVAL = 2.0
+
+# 募集VCごとの在室人数
+# キー: discord.VoiceChannel.id
+# 値: 現在VCに接続しているメンバー数
+vc_occupancy = {}
+
+# 募集VCと募集主の対応
+# キー: discord.VoiceChannel.id
+# 値: 募集主のID (active_recruit_flows のキー)
+vc_recruiters = {}
 
 class RecruitFlow:
-    """募集フローの状態を保持するクラス"""
+    """
+    募集フローの状態を保持するクラス。
+    Discordのオブジェクトは持たずにIDだけを保持し、VCと募集メッセージは必要になったときにキャッシュから解決する。
+    参加者は参加順を保つ辞書 (キー: ユーザーID, 先頭が募集主) で持つため、参加しているかの判定は定数時間で済む。
+    """
+    __slots__ = (
+        "mode", "people_to_recruit", "total_party_size", "roles", "title",
+        "guild_id", "vc_channel_id", "message_channel_id", "message_id", "participant_ids",
+    )
+
     def __init__(self):
         self.mode = None
         self.people_to_recruit = None
         self.total_party_size = None
-        self.roles = []
+        self.roles = ()  # 対象ランクロールIDのタプル
         self.title = ""
-        self.vc_channel = None
-        self.message = None 
-        self.participants = [] 
-        self.vc_check_task = None 
-
-class ModeSelect(discord.ui.Select):
-    """ゲームモード選択用ドロップダウン"""
-    def __init__(self, flow: RecruitFlow):
-        self.flow = flow
-        options = [
-            discord.SelectOption(label="コンペティティブ", value="コンペ"),
-            discord.SelectOption(label="アンレート", value="アンレート")
-        ]
-        super().__init__(placeholder="ゲームモードを選択", options=options)
+        self.guild_id = None
+        self.vc_channel_id = None
+        self.message_channel_id = None
+        self.message_id = None
+        self.participant_ids = {}
+
+    @property
+    def recruiter_id(self):
+        return next(iter(self.participant_ids), None)
+
+    @property
+    def participant_count(self) -> int:
+        return len(self.participant_ids)
+
+    def has_participant(self, user_id: int) -> bool:
+        return user_id in self.participant_ids
+
+    def add_participant(self, user_id: int):
+        self.participant_ids[user_id] = None
+
+    def remove_participant(self, user_id: int):
+        self.participant_ids.pop(user_id, None)
+
+    @property
+    def vc_channel(self):
+        """募集VCをキャッシュから解決する (見つからなければ None)"""
+        return bot.get_channel(self.vc_channel_id) if self.vc_channel_id else None
+
+    @property
+    def message(self):
+        """募集メッセージをREST呼び出し無しの部分メッセージとして組み立てる (チャンネルが見つからなければ None)"""
+        if not self.message_id:
+            return None
+        channel = bot.get_channel(self.message_channel_id)
+        return channel.get_partial_message(self.message_id) if channel else None
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.guild_id}/{self.message_channel_id}/{self.message_id}"
+
+class Counter:
+    """Prometheus形式で出力するカウンター"""
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """
+    呼び出し時に値を計算してPrometheus形式で出力するゲージ。callback は数値か {ラベルのタプル: 数値} を返す。
+    別の場所で数えている累計値は metric_type="counter" でカウンターとして出力する。
+    """
+    def __init__(self, name: str, documentation: str, callback, labelnames=(), metric_type: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = labelnames
+        self.metric_type = metric_type
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        value = self.callback()
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, v in values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {v}")
+        return lines
+
+
+class Histogram:
+    """Prometheus形式で出力するヒストグラム"""
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # キー: ラベルのタプル, 値: [バケットごとの件数, 合計, 件数]
+        self.values = {}
+
+    def observe(self, value: float, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames + ('le',), labels + (bound,))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames + ('le',), labels + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+# /metrics で出力するメトリクス (Gauge はファイル末尾でまとめて登録する)
+metrics_registry = []
+
+
+def register_metric(metric):
+    metrics_registry.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in metrics_registry:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logging.error("メトリクス '%s' の出力中にエラー: %s", metric.name, e)
+    return "\n".join(lines) + "\n"
+
+
+rest_call_seconds = register_metric(Histogram("valorant_rest_call_seconds", "Discord REST呼び出しの所要時間", ("route", "outcome")))
+rest_wait_seconds = register_metric(Histogram("valorant_rest_queue_wait_seconds", "RESTジョブがキューで待った時間", ("priority",)))
+interaction_seconds = register_metric(Histogram("valorant_interaction_seconds", "インタラクションの処理時間", ("handler",)))
+interactions_total = register_metric(Counter("valorant_interactions_total", "処理したインタラクションの数", ("handler", "outcome")))
+recruits_created_total = register_metric(Counter("valorant_recruits_created_total", "投稿した募集の数"))
+recruits_ended_total = register_metric(Counter("valorant_recruits_ended_total", "終了した募集の数"))
+wizard_evictions_total = register_metric(Counter("valorant_wizard_evictions_total", "入力途中で放置されて破棄した募集フローの数"))
+vc_permission_writes_total = register_metric(Counter("valorant_vc_permission_writes_total", "VC権限の書き込み回数 (まとめた書き込み / 1件ずつの書き込み)", ("mode",)))
+recruit_teardown_failures_total = register_metric(Counter("valorant_recruit_teardown_failures_total", "募集の終了処理で失敗した手順の数", ("step",)))
+notifications_total = register_metric(Counter("valorant_notifications_total", "募集通知の配信結果ごとの通知先の数", ("channel", "outcome")))
+notifications_dropped_total = register_metric(Counter("valorant_notifications_dropped_total", "配信せずに捨てた募集通知の通知先の数", ("reason",)))
+
+
+class Span:
+    """トレース内の1区間 (コールバックやREST呼び出し) の計測結果"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "started_at", "duration", "attrs", "error")
+
+    def __init__(self, trace_id: str, parent_id, name: str, attrs: dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(4).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.started_at = time.time()
+        self.duration = None
+        self.attrs = attrs
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class Tracer:
+    """
+    終了したスパンをリングバッファに保持し、export_path が指定されていれば JSON Lines で追記するトレーサー。
+    現在のスパンは contextvars で受け渡すため、create_task で派生したタスクにも同じトレースIDが引き継がれる。
+    """
+    def __init__(self, buffer_size: int, export_path=None):
+        self.spans = deque(maxlen=buffer_size)
+        self.export_path = export_path
+        self._export_buffer = []
+        self._export_scheduled = False
+
+    def start(self, name: str, **attrs) -> Span:
+        parent = current_span.get()
+        if parent is None:
+            return Span(os.urandom(8).hex(), None, name, attrs)
+        return Span(parent.trace_id, parent.span_id, name, attrs)
+
+    def finish(self, span: Span):
+        self.spans.append(span)
+        if self.export_path:
+            self._export_buffer.append(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+            if not self._export_scheduled:
+                # 1スパンごとにファイルを開かず、同じループ周回で終わったスパンをまとめて書き出す
+                self._export_scheduled = True
+                asyncio.get_running_loop().call_soon(self._export)
+
+    def _export(self):
+        lines, self._export_buffer = self._export_buffer, []
+        self._export_scheduled = False
+        asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+
+    def _write(self, lines: list):
+        try:
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logging.error("トレースの書き出しに失敗しました: %s", e)
+
+    def recent(self, trace_id=None, limit: int = 200) -> list:
+        spans = [span for span in self.spans if trace_id is None or span.trace_id == trace_id]
+        return [span.to_dict() for span in spans[-limit:]]
+
+
+# トレーサー (実行中のスパンは current_span で受け渡す)
+tracer = Tracer(TRACE_BUFFER_SIZE, TRACE_EXPORT_PATH)
+
+
+class trace_span:
+    """with で囲んだ区間を現在のトレースの子スパンとして記録する"""
+    def __init__(self, name: str, **attrs):
+        self.span = tracer.start(name, **attrs)
+        self._token = None
+        self._started = None
+
+    def __enter__(self) -> Span:
+        self._token = current_span.set(self.span)
+        self._started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration = time.perf_counter() - self._started
+        if exc_type is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        current_span.reset(self._token)
+        tracer.finish(self.span)
+        return False
+
+
+def traced(name: str):
+    """コルーチン関数の実行をスパンとして記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def warn_if_unacknowledged(interaction: discord.Interaction, span: Span):
+    if interaction.response.is_done():
+        return
+    age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    finished = [f"{s.name}={s.duration * 1000:.0f}ms" for s in tracer.spans if s.trace_id == span.trace_id]
+    logging.warning("インタラクション '%s' (trace: %s) が作成から%.2f秒経っても応答していません。完了済みの区間: %s", span.name, span.trace_id, age, finished)
+
+
+def instrument_interaction(handler: str):
+    """インタラクションのコールバックをトレースし、処理時間と結果をメトリクスに記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            interaction = next((arg for arg in args if isinstance(arg, discord.Interaction)), None)
+            started = time.perf_counter()
+            outcome = "ok"
+            watchdog = None
+            log_token = bind_log_context(guild_id=interaction.guild_id, user_id=interaction.user.id) if interaction is not None else None
+            with trace_span(handler) as span:
+                if interaction is not None:
+                    # ゲートウェイから届くまでにかかった時間も応答期限に含まれる
+                    age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+                    span.attrs.update(interaction_id=interaction.id, user_id=interaction.user.id, age_at_start_ms=round(age * 1000, 1))
+                    if LEAN_MEMBER_CACHE and isinstance(interaction.user, discord.Member):
+                        member_resolver.remember(interaction.user)
+                    watchdog = asyncio.get_running_loop().call_later(max(0.0, TRACE_ACK_WARN_AFTER - age), warn_if_unacknowledged, interaction, span)
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    outcome = "error"
+                    raise
+                finally:
+                    if watchdog is not None:
+                        watchdog.cancel()
+                    interaction_seconds.observe(time.perf_counter() - started, handler)
+                    interactions_total.inc(handler, outcome)
+                    if log_token is not None:
+                        log_context.reset(log_token)
+        return wrapper
+    return decorator
+
+
+class CircuitOpenError(Exception):
+    """回路が開いているため、REST呼び出しを実行せずに失敗させたことを表す例外"""
+    pass
+
+
+class RouteBucket:
+    """ルートごとのトークンバケット。レート制限ヘッダーを受け取ると上限と補充速度を学習する"""
+    def __init__(self, limit: int = REST_DEFAULT_BUCKET_LIMIT, period: float = REST_DEFAULT_BUCKET_PERIOD):
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """トークンを1つ取得する。取得できた場合は0、できない場合は待つべき秒数を返す"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        self.tokens = min(self.limit, self.tokens + (now - self.updated_at) * self.limit / self.period)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.period / self.limit
+
+    def block(self, retry_after: float):
+        """retry_after 秒間、このルートへの呼び出しを止める"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        self.tokens = 0.0
+
+    def learn(self, headers):
+        """Discordのレート制限ヘッダー (X-RateLimit-*) からバケットの状態を更新する"""
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset_after = float(headers["X-RateLimit-Reset-After"])
+        except (KeyError, TypeError, ValueError):
+            return
 
-    async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id not in active_recruit_flows:
-            await interaction.response.send_message("募集フローが見つかりませんでした。再度`!募集開始`コマンドを実行するか、募集開始ボタンを押してください。", ephemeral=True)
+        if limit > 0 and reset_after > 0:
+            # 一度長い窓を学習しても戻れるよう、常に最新のヘッダーの値を採用する
+            self.limit = limit
+            self.period = reset_after
+        self.tokens = float(remaining)
+        self.updated_at = time.monotonic()
+        if remaining == 0:
+            self.block(reset_after)
+
+
+class CircuitBreaker:
+    """連続した失敗を数え、しきい値を超えたら一定時間呼び出しを遮断するサーキットブレーカー"""
+    def __init__(self, threshold: int = REST_CIRCUIT_FAILURE_THRESHOLD, cooldown: float = REST_CIRCUIT_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold or self.state == "half-open":
+            self.opened_at = time.monotonic()
+
+
+class RestJob:
+    """rest_scheduler に投入された1件のREST呼び出し"""
+    __slots__ = ("route", "factory", "priority", "idempotent", "seq", "future", "enqueued_at", "attempts", "generation")
+
+    def __init__(self, route, factory, priority, idempotent, seq, future):
+        self.route = route
+        self.factory = factory
+        self.priority = priority
+        self.idempotent = idempotent
+        self.seq = seq
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        # キューに積み直すたびに増やす。古いエントリーや、もう一方のキューで取り出し済みのエントリーを読み飛ばすのに使う
+        self.generation = 0
+
+
+class RestScheduler:
+    """
+    Discord REST呼び出しを一元的に実行するスケジューラ。
+    ルートごとのトークンバケット、優先度付きキュー、同時実行数の上限、ジッター付きリトライ、
+    ルートの種類ごとのサーキットブレーカーを備え、キューの深さと待ち時間を stats() で確認できる。
+    PRIORITY_INTERACTIVE の呼び出しは共有のキューと専用のキューの両方に積み、先に空いたワーカーが実行する。
+    専用のキューは REST_RESERVED_INTERACTIVE_WORKERS 個のワーカーだけが読むため、他のワーカーがすべて塞がっていても対話の呼び出しは進む。
+    """
+    def __init__(self, concurrency: int = REST_MAX_CONCURRENCY, reserved: int = REST_RESERVED_INTERACTIVE_WORKERS):
+        self.concurrency = concurrency
+        self.reserved = reserved
+        self._queue = None
+        self._interactive_queue = None
+        self._workers = []
+        # PRIORITY_INTERACTIVE 専用のワーカー (self._workers の一部)
+        self._reserved_workers = []
+        self._counter = itertools.count()
+        self._buckets = {}
+        self._breakers = {}
+        self._queued = {PRIORITY_INTERACTIVE: 0, PRIORITY_NORMAL: 0, PRIORITY_BACKGROUND: 0}
+        # 優先度ごとの待ち時間の統計 [件数, 合計秒数, 最大秒数]
+        self._wait_stats = {priority: [0, 0.0, 0.0] for priority in self._queued}
+        self._recent_waits = {priority: deque(maxlen=100) for priority in self._queued}
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    @staticmethod
+    def route_kind(route: str) -> str:
+        """'channel:123' のようなルートから種類 ('channel') を取り出す"""
+        return route.split(":", 1)[0]
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._interactive_queue = asyncio.PriorityQueue()
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        self._reserved_workers = [worker for worker in self._reserved_workers if not worker.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._reserved_workers) < self.reserved:
+            worker = loop.create_task(self._worker(self._interactive_queue))
+            self._reserved_workers.append(worker)
+            self._workers.append(worker)
+        while len(self._workers) < self.concurrency + self.reserved:
+            self._workers.append(loop.create_task(self._worker(self._queue)))
+
+    def start(self):
+        """ワーカーを起動する (起動済みなら何もしない)。ジョブが無い間もワーカーは待機して稼働中として扱う"""
+        self._ensure_workers()
+
+    def is_running(self):
+        return any(not worker.done() for worker in self._workers)
+
+    async def submit(self, route: str, factory, *, priority: int = PRIORITY_NORMAL, idempotent: bool = True):
+        """
+        factory (引数なしでコルーチンを返す関数) をルート route のREST呼び出しとして実行し、その結果を返す。
+        リトライのたびに factory が呼び直される。
+        VCの作成やメッセージの送信など、やり直すと重複する呼び出しは idempotent=False にする。
+        その場合は確実に実行されていない 429 だけをリトライし、最初の呼び出しが成功したかもしれない
+        ネットワークエラー・タイムアウトはそのまま呼び出し元に返す (呼び出し元で状態を確かめて片付ける)。
+        """
+        self._ensure_workers()
+        job = RestJob(route, factory, priority, idempotent, next(self._counter), asyncio.get_running_loop().create_future())
+        with trace_span(f"rest {self.route_kind(route)}", route=route, priority=priority) as span:
+            self._enqueue(job)
+            try:
+                return await job.future
+            finally:
+                span.attrs["attempts"] = job.attempts
+
+    def _enqueue(self, job: RestJob):
+        if job.future.done():
             return
-        self.flow = active_recruit_flows[interaction.user.id]
+        self._queued[job.priority] += 1
+        job.generation += 1
+        entry = (job.priority, job.seq, job.generation, job)
+        self._queue.put_nowait(entry)
+        if job.priority == PRIORITY_INTERACTIVE and self.reserved > 0:
+            self._interactive_queue.put_nowait(entry)
+
+    def _enqueue_later(self, job: RestJob, delay: float):
+        asyncio.get_running_loop().call_later(delay, self._enqueue, job)
+
+    async def _worker(self, queue: asyncio.PriorityQueue):
+        while True:
+            _, _, generation, job = await queue.get()
+            try:
+                if generation != job.generation:
+                    continue  # もう一方のキューで取り出し済み
+                job.generation += 1
+                self._queued[job.priority] -= 1
+                await self._run_job(job)
+            except Exception as e:
+                logging.error("RESTジョブ (%s) の処理中に予期せぬエラー: %s", job.route, e)
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                queue.task_done()
+
+    async def _run_job(self, job: RestJob):
+        if job.future.done():
+            return  # 呼び出し元がキャンセル済み
+
+        breaker = self._breakers.setdefault(self.route_kind(job.route), CircuitBreaker())
+        if not breaker.allow():
+            self.failed += 1
+            job.future.set_exception(CircuitOpenError(f"ルート '{self.route_kind(job.route)}' の回路が開いています。"))
+            return
+
+        bucket = self._buckets.setdefault(job.route, RouteBucket())
+        delay = bucket.reserve()
+        if delay > 0:
+            self._enqueue_later(job, delay)
+            return
+
+        if job.attempts == 0:
+            self._record_wait(job.priority, time.monotonic() - job.enqueued_at)
+        job.attempts += 1
+
+        started = time.perf_counter()
+        outcome = "ok"
+        bucket_token = current_rest_bucket.set(bucket)
+        try:
+            result = await job.factory()
+        except discord.RateLimited as e:
+            outcome = "ratelimited"
+            bucket.block(e.retry_after)
+            self._retry_or_fail(job, breaker, e, e.retry_after, count_failure=False)
+        except discord.HTTPException as e:
+            outcome = str(e.status)
+            if e.response is not None:
+                bucket.learn(e.response.headers)  # http_trace を通らないレスポンス (テスト用の模擬など) のため
+            if e.status == 429:
+                self._retry_or_fail(job, breaker, e, self._backoff(job.attempts), count_failure=False)
+            elif e.status >= 500:
+                # discord.py が5xxを内部で数回リトライした後なので、ここでは重ねてリトライしない
+                breaker.record_failure()
+                self.failed += 1
+                job.future.set_exception(e)
+            else:
+                # 4xx (NotFound, Forbidden など) はリトライしても結果が変わらないので即座に返す
+                self.failed += 1
+                job.future.set_exception(e)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            outcome = "network"
+            if job.idempotent:
+                self._retry_or_fail(job, breaker, e, self._backoff(job.attempts), count_failure=True)
+            else:
+                breaker.record_failure()
+                self.failed += 1
+                job.future.set_exception(e)
+        else:
+            breaker.record_success()
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            current_rest_bucket.reset(bucket_token)
+            rest_call_seconds.observe(time.perf_counter() - started, self.route_kind(job.route), outcome)
+
+    @staticmethod
+    def _backoff(attempts: int) -> float:
+        """ジッター付きの指数バックオフ時間を返す"""
+        return REST_RETRY_BASE_DELAY * (2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+
+    def _retry_or_fail(self, job: RestJob, breaker: CircuitBreaker, error: Exception, delay: float, count_failure: bool):
+        if count_failure:
+            breaker.record_failure()
+        if job.attempts <= REST_MAX_RETRIES and breaker.allow():
+            self.retried += 1
+            logging.warning("REST呼び出し (%s) に失敗しました。%.2f秒後にリトライします (%s/%s): %s", job.route, delay, job.attempts, REST_MAX_RETRIES, error)
+            self._enqueue_later(job, delay)
+            return
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _record_wait(self, priority: int, wait: float):
+        stats = self._wait_stats[priority]
+        stats[0] += 1
+        stats[1] += wait
+        stats[2] = max(stats[2], wait)
+        self._recent_waits[priority].append(wait)
+        rest_wait_seconds.observe(wait, priority)
+
+    def stats(self) -> dict:
+        """キューの深さ・待ち時間・回路の状態をまとめて返す"""
+        waits = {}
+        for priority, (count, total, maximum) in self._wait_stats.items():
+            recent = sorted(self._recent_waits[priority])
+            waits[priority] = {
+                "count": count,
+                "avg": total / count if count else 0.0,
+                "max": maximum,
+                "p50_recent": recent[len(recent) // 2] if recent else 0.0,
+            }
+        return {
+            "queued": dict(self._queued),
+            "waits": waits,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "open_circuits": [kind for kind, breaker in self._breakers.items() if breaker.state != "closed"],
+        }
+
+    async def stop(self):
+        """ワーカーを停止する"""
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        self._reserved_workers = []
+        logging.info("RESTスケジューラを停止しました。")
+
+
+# Discord REST呼び出しを一元的に実行するスケジューラ
+rest_scheduler = RestScheduler()
+
+
+class VoiceChannelPool:
+    """
+    カテゴリ内に非表示の待機VCを事前に作成しておき、募集開始時に名前と権限を付け替えて貸し出すプール。
+    終了した募集のVCは削除せずに権限を戻してプールに返却する。
+    貸し出し中のVCも size に数えるため、補充するのは削除などで失われた分だけで、返却されたVCがそのまま再利用される。
+    """
+    def __init__(self, category_id: int, size: int):
+        self.category_id = category_id
+        self.size = size
+        self._channel_ids = deque()
+        # 貸し出し中のVC ID
+        self._leased = set()
+        self._refill_event = asyncio.Event()
+        self._task = None
+        # キー: VC ID, 値: 直近の名前変更時刻 (Discordの名前変更制限を超えないように管理する)
+        self._renames = {}
+
+    def __len__(self):
+        return len(self._channel_ids)
+
+    def managed_count(self) -> int:
+        """待機中と貸し出し中のVCの合計"""
+        return len(self._channel_ids) + len(self._leased)
+
+    @staticmethod
+    def hidden_overwrites(guild: discord.Guild) -> dict:
+        # ボット自身の上書きは待機VCの目印 (名前を待機VCに戻せなかったVCも、再起動後に待機VCとして取り込める)
+        return {
+            guild.default_role: discord.PermissionOverwrite(connect=False, view_channel=False),
+            guild.me: discord.PermissionOverwrite(connect=True, view_channel=True),
+        }
+
+    @staticmethod
+    def is_pool_channel(channel: discord.VoiceChannel) -> bool:
+        """待機VCの名前か、待機VCの目印の権限の上書きを持つVCなら True"""
+        if channel.name == VC_POOL_CHANNEL_NAME:
+            return True
+        return channel.guild.me is not None and not channel.overwrites_for(channel.guild.me).is_empty()
+
+    def _can_rename(self, channel_id: int) -> bool:
+        history = self._renames.get(channel_id)
+        return not history or len(history) < VC_RENAME_LIMIT or time.monotonic() - history[0] >= VC_RENAME_WINDOW
+
+    def _record_rename(self, channel_id: int):
+        self._renames.setdefault(channel_id, deque(maxlen=VC_RENAME_LIMIT)).append(time.monotonic())
+
+    def start(self, category: discord.CategoryChannel):
+        """カテゴリ内の既存の待機VCを取り込み、補充タスクを起動する (起動済みなら何もしない)"""
+        if self._task is not None and not self._task.done():
+            return
+        for channel in category.voice_channels:
+            if (self.is_pool_channel(channel) and not channel.voice_states
+                    and channel.id not in vc_recruiters and channel.id not in self._channel_ids):
+                self._channel_ids.append(channel.id)
+        logging.info("VCプール (カテゴリID: %s) を開始しました。既存の待機VC: %s件", self.category_id, len(self._channel_ids))
+        self._task = asyncio.get_running_loop().create_task(self._refill_loop())
+        self._refill_event.set()
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    async def stop(self):
+        if self.is_running():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill_event.wait()
+            self._refill_event.clear()
+            while self.managed_count() < self.size:
+                category = bot.get_channel(self.category_id)
+                if not category:
+                    logging.error("VCプールのカテゴリID %s が見つかりません。", self.category_id)
+                    break
+                try:
+                    channel = await rest_scheduler.submit(
+                        f"guild_channels:{category.guild.id}",
+                        lambda: category.create_voice_channel(
+                            name=VC_POOL_CHANNEL_NAME,
+                            overwrites=self.hidden_overwrites(category.guild)
+                        ),
+                        priority=PRIORITY_BACKGROUND,
+                        idempotent=False
+                    )
+                except Exception as e:
+                    logging.error("待機VCの作成に失敗しました。%s秒後に再試行します: %s", VC_POOL_REFILL_RETRY_DELAY, e)
+                    await asyncio.sleep(VC_POOL_REFILL_RETRY_DELAY)
+                    continue
+                self._record_rename(channel.id)
+                self._channel_ids.append(channel.id)
+                logging.info("待機VC (ID: %s) を補充しました。(待機 %s / 貸出 %s / %s)", channel.id, len(self._channel_ids), len(self._leased), self.size, extra={"rate_limit": True})
+
+    async def acquire(self, name: str, overwrites: dict):
+        """
+        待機VCを1つ取り出し、名前と権限を付け替えて返す。
+        貸し出せるVCが無い、または付け替えに失敗した場合は None を返す (呼び出し元で新規作成する)。
+        """
+        for _ in range(len(self._channel_ids)):
+            channel_id = self._channel_ids.popleft()
+            channel = bot.get_channel(channel_id)
+            if not channel or channel.voice_states:
+                self._renames.pop(channel_id, None)
+                continue  # 削除された、または誰かが入っている待機VCは使わない
+            if not self._can_rename(channel_id):
+                self._channel_ids.append(channel_id)
+                continue
+
+            self._leased.add(channel_id)
+            try:
+                await rest_scheduler.submit(
+                    f"channel:{channel.id}",
+                    lambda: channel.edit(name=name, overwrites=overwrites),
+                    priority=PRIORITY_INTERACTIVE
+                )
+            except Exception as e:
+                logging.error("待機VC (ID: %s) の付け替えに失敗しました: %s", channel_id, e, extra={"vc_id": channel_id})
+                self._leased.discard(channel_id)
+                self._channel_ids.append(channel_id)
+                return None
+            self._record_rename(channel_id)
+            return channel
+
+        self._refill_event.set()
+        return None
+
+    def lease_created(self, channel_id: int):
+        """
+        待機VCが無くて新規作成した募集VCを、管理数に空きがあれば貸し出し中として数える。
+        補充中に作成された分だけ補充を減らし、募集が終わればそのまま待機VCになる。
+        """
+        if self.managed_count() < self.size:
+            self._leased.add(channel_id)
+
+    def forget(self, channel_id: int):
+        """削除されたVCをプールの管理から外し、減った分を補充する"""
+        if channel_id in self._leased or channel_id in self._channel_ids:
+            self._leased.discard(channel_id)
+            if channel_id in self._channel_ids:
+                self._channel_ids.remove(channel_id)
+            self._renames.pop(channel_id, None)
+            self._refill_event.set()
+
+    async def release(self, channel: discord.VoiceChannel) -> bool:
+        """
+        募集が終わったVCの権限を非表示に戻してプールに返却する。
+        貸し出したVCは管理数に含まれているのでそのまま戻り、それ以外のVCは管理数が size に満たないときだけ受け入れる。
+        管理数が size を超える、VCに誰かいる、などで返却できなかった場合は False を返す (呼び出し元で削除する)。
+        """
+        leased = channel.id in self._leased
+        self._leased.discard(channel.id)
+        if self.managed_count() >= self.size or channel.voice_states or channel.category_id != self.category_id:
+            if leased:
+                self._refill_event.set()  # 貸し出したVCが減った分を補充する
+            return False
+
+        # 書き込みの間も管理数に数えて、同時に返却されたVCで size を超えないようにする
+        self._leased.add(channel.id)
+        # 名前の変更は制限が厳しいため、余裕があるときだけ待機VCの名前に戻す (戻せなくても権限の上書きで待機VCと分かる)
+        rename = self._can_rename(channel.id)
+        fields = {"overwrites": self.hidden_overwrites(channel.guild)}
+        if rename:
+            fields["name"] = VC_POOL_CHANNEL_NAME
+        try:
+            await rest_scheduler.submit(f"channel:{channel.id}", lambda: channel.edit(**fields), priority=PRIORITY_BACKGROUND)
+        except Exception as e:
+            logging.error("VC (ID: %s) のプールへの返却に失敗しました: %s", channel.id, e, extra={"vc_id": channel.id})
+            self._leased.discard(channel.id)
+            self._refill_event.set()
+            return False
+        if rename:
+            self._record_rename(channel.id)
+        self._leased.discard(channel.id)
+        self._channel_ids.append(channel.id)
+        return True
+
+
+# 待機VCのプール
+# キー: discord.CategoryChannel.id
+# 値: VoiceChannelPool インスタンス
+vc_pools = {}
+
+
+def get_vc_pool(category_id: int) -> VoiceChannelPool:
+    """カテゴリの待機VCプールを取得する (無ければ作成する)"""
+    if category_id not in vc_pools:
+        vc_pools[category_id] = VoiceChannelPool(category_id, VC_POOL_SIZE)
+    return vc_pools[category_id]
+
+
+async def release_or_delete_vc(vc_channel: discord.VoiceChannel):
+    """募集VCを待機プールに返却する。返却できない場合は削除する"""
+    pool = vc_pools.get(vc_channel.category_id)
+    # 待機VCが空のプールも len() が0で偽になるため、None と比較する
+    if pool is not None and await pool.release(vc_channel):
+        logging.info("VC %s (ID: %s) を待機プールに返却しました。", vc_channel.name, vc_channel.id, extra={"vc_id": vc_channel.id})
+        return
+    await rest_scheduler.submit(f"channel:{vc_channel.id}", vc_channel.delete, priority=PRIORITY_BACKGROUND)
+    logging.info("VC %s (ID: %s) を削除しました。", vc_channel.name, vc_channel.id, extra={"vc_id": vc_channel.id})
+
+
+class SharedStateBackend(ABC):
+    """
+    募集状態をプロセス間で共有するバックエンドのインターフェース。
+    save_* / delete_* は書き込み待ちにするだけで、実際の書き込みは flush() でまとめて行う。
+    load_* と acquire_lease はブロッキングするため asyncio.to_thread から呼び出す。
+    メソッドが欠けたバックエンドは、インスタンスを作る時点 (起動時) で TypeError になる。
+    """
+    @abstractmethod
+    def open(self):
+        """接続を開く (開いていれば何もしない)"""
+
+    @abstractmethod
+    def save_flow(self, recruiter_id: int, flow: RecruitFlow):
+        """募集フローの現在の状態を書き込み待ちにする"""
+
+    @abstractmethod
+    def delete_flow(self, recruiter_id: int):
+        """募集フローの削除を書き込み待ちにする"""
+
+    @abstractmethod
+    def save_start_button(self, channel_id: int, message_id):
+        """募集開始ボタンのメッセージIDを書き込み待ちにする (None なら削除)"""
+
+    @abstractmethod
+    def save_subscription(self, subscription: "Subscription"):
+        """募集通知の登録を書き込み待ちにする"""
+
+    @abstractmethod
+    def delete_subscription(self, guild_id: int, user_id: int):
+        """募集通知の登録の削除を書き込み待ちにする"""
+
+    @abstractmethod
+    def pending_count(self) -> int:
+        """書き込み待ちの変更の数を返す"""
+
+    @abstractmethod
+    def load_all(self):
+        """(募集フローの行のリスト, (チャンネルID, メッセージID) のリスト) を返す"""
 
-        self.flow.mode = self.values[0]
-        await interaction.response.edit_message(
-            content="次に募集人数を選んでください：",
-            view=PeopleSelectView(self.flow)
+    @abstractmethod
+    def load_flow(self, recruiter_id: int):
+        """募集フローの行を1件返す (無ければ None)"""
+
+    @abstractmethod
+    def load_subscriptions(self):
+        """募集通知の登録の行のリストを返す"""
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """name のリースを取得・更新する。他のプロセスが有効なリースを持っていれば False を返す"""
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        """owner が持っている name のリースを手放す"""
+
+    @abstractmethod
+    async def flush(self):
+        """書き込み待ちの変更をまとめて書き込む"""
+
+    @abstractmethod
+    def start(self):
+        """定期的な書き込みタスクを起動する"""
+
+    @abstractmethod
+    def is_running(self) -> bool:
+        """定期的な書き込みタスクが動いているかを返す"""
+
+    @abstractmethod
+    async def close(self):
+        """残りの変更を書き込んで接続を閉じる"""
+
+
+class RecruitStateStore(SharedStateBackend):
+    """
+    投稿済みの募集フローと募集開始ボタンの情報を SQLite (WALモード) に保存するストア。
+    変更はメモリ上に溜めておき、STATE_FLUSH_INTERVAL 秒ごとに1トランザクションでまとめて書き込む。
+    同じホスト上の複数プロセスから同じファイルを開くことで、シャード間の共有バックエンドとしても使える。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        # キー: 募集主のID, 値: 保存する行 (None なら削除)
+        self._dirty_flows = {}
+        # キー: チャンネルID, 値: メッセージID (None なら削除)
+        self._dirty_buttons = {}
+        # キー: (ギルドID, ユーザーID), 値: 保存する行 (None なら削除)
+        self._dirty_subscriptions = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def open(self):
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS recruit_flows (
+                recruiter_id INTEGER PRIMARY KEY,
+                guild_id INTEGER,
+                mode TEXT,
+                people_to_recruit INTEGER,
+                total_party_size INTEGER,
+                roles TEXT,
+                title TEXT,
+                vc_channel_id INTEGER,
+                message_channel_id INTEGER,
+                message_id INTEGER,
+                participants TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS start_buttons (
+                channel_id INTEGER PRIMARY KEY,
+                message_id INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                guild_id INTEGER,
+                user_id INTEGER,
+                mode_mask INTEGER,
+                rank_mask INTEGER,
+                delivery TEXT,
+                quiet_start INTEGER,
+                quiet_end INTEGER,
+                PRIMARY KEY (guild_id, user_id)
+            );
+        """)
+        self._conn.commit()
+        logging.info("募集状態データベース '%s' を開きました。", self.path)
+
+    @staticmethod
+    def flow_row(recruiter_id: int, flow: RecruitFlow) -> tuple:
+        return (
+            recruiter_id,
+            flow.guild_id,
+            flow.mode,
+            flow.people_to_recruit,
+            flow.total_party_size,
+            json.dumps(list(flow.roles)),
+            flow.title,
+            flow.vc_channel_id,
+            flow.message_channel_id,
+            flow.message_id,
+            json.dumps(list(flow.participant_ids)),
+            time.time(),
         )
 
-class ModeSelectView(View):
-    """ゲームモード選択を含むView"""
-    def __init__(self, flow):
-        super().__init__()
-        self.flow = flow
-        self.add_item(ModeSelect(flow))
+    def save_flow(self, recruiter_id: int, flow: RecruitFlow):
+        """募集フローの現在の状態を書き込み待ちにする"""
+        self._dirty_flows[recruiter_id] = self.flow_row(recruiter_id, flow)
 
+    def delete_flow(self, recruiter_id: int):
+        self._dirty_flows[recruiter_id] = None
 
-class PeopleSelect(discord.ui.Select):
-    """募集人数選択用ドロップダウン"""
-    def __init__(self, flow: RecruitFlow):
-        self.flow = flow
-        options = [
-            discord.SelectOption(label="デュオ（あと1人募集）", value="1"), 
-            discord.SelectOption(label="トリオ（あと2人募集）", value="2"), 
-            discord.SelectOption(label="フルパ（あと4人募集）", value="4")  
-        ]
-        super().__init__(placeholder="募集人数を選択", options=options)
+    def save_start_button(self, channel_id: int, message_id):
+        self._dirty_buttons[channel_id] = message_id
 
-    async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id not in active_recruit_flows:
-            await interaction.response.send_message("募集フローが見つかりませんでした。再度`!募集開始`コマンドを実行するか、募集開始ボタンを押してください。", ephemeral=True)
+    def save_subscription(self, subscription: "Subscription"):
+        self._dirty_subscriptions[(subscription.guild_id, subscription.user_id)] = subscription.row()
+
+    def delete_subscription(self, guild_id: int, user_id: int):
+        self._dirty_subscriptions[(guild_id, user_id)] = None
+
+    def pending_count(self):
+        return len(self._dirty_flows) + len(self._dirty_buttons) + len(self._dirty_subscriptions)
+
+    FLOW_COLUMNS = (
+        "recruiter_id, guild_id, mode, people_to_recruit, total_party_size, roles, title,"
+        " vc_channel_id, message_channel_id, message_id, participants"
+    )
+
+    def load_all(self):
+        """保存されている募集フローと募集開始ボタンを一括で読み込む"""
+        self.open()
+        flows = self._conn.execute(f"SELECT {self.FLOW_COLUMNS} FROM recruit_flows").fetchall()
+        buttons = self._conn.execute("SELECT channel_id, message_id FROM start_buttons").fetchall()
+        return flows, buttons
+
+    def load_flow(self, recruiter_id: int):
+        self.open()
+        if recruiter_id in self._dirty_flows:
+            row = self._dirty_flows[recruiter_id]
+            return row[:-1] if row is not None else None  # 書き込み待ちの最新の状態を優先する
+        return self._conn.execute(
+            f"SELECT {self.FLOW_COLUMNS} FROM recruit_flows WHERE recruiter_id = ?", (recruiter_id,)
+        ).fetchone()
+
+    def load_subscriptions(self):
+        self.open()
+        return self._conn.execute(
+            "SELECT guild_id, user_id, mode_mask, rank_mask, delivery, quiet_start, quiet_end FROM subscriptions"
+        ).fetchall()
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        self.open()
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, owner, now + ttl, now)
+            )
+            row = self._conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name: str, owner: str):
+        self.open()
+        with self._conn:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def _write(self, flows: dict, buttons: dict, subscriptions: dict):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO recruit_flows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in flows.values() if row is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM recruit_flows WHERE recruiter_id = ?",
+                [(recruiter_id,) for recruiter_id, row in flows.items() if row is None]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO start_buttons VALUES (?, ?)",
+                [(channel_id, message_id) for channel_id, message_id in buttons.items() if message_id is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM start_buttons WHERE channel_id = ?",
+                [(channel_id,) for channel_id, message_id in buttons.items() if message_id is None]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [row for row in subscriptions.values() if row is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM subscriptions WHERE guild_id = ? AND user_id = ?",
+                [key for key, row in subscriptions.items() if row is None]
+            )
+
+    async def flush(self):
+        """書き込み待ちの変更をまとめてデータベースに書き込む"""
+        async with self._lock:
+            if not self._dirty_flows and not self._dirty_buttons and not self._dirty_subscriptions:
+                return
+            flows, self._dirty_flows = self._dirty_flows, {}
+            buttons, self._dirty_buttons = self._dirty_buttons, {}
+            subscriptions, self._dirty_subscriptions = self._dirty_subscriptions, {}
+            try:
+                await asyncio.to_thread(self._write, flows, buttons, subscriptions)
+            except Exception as e:
+                logging.error("募集状態の保存中にエラーが発生しました: %s", e)
+                # 書き込めなかった変更は、その後の変更を優先して書き込み待ちに戻す
+                self._dirty_flows = {**flows, **self._dirty_flows}
+                self._dirty_buttons = {**buttons, **self._dirty_buttons}
+                self._dirty_subscriptions = {**subscriptions, **self._dirty_subscriptions}
+
+    def start(self):
+        """定期的な書き込みタスクを起動する (起動済みなら何もしない)"""
+        self.open()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(STATE_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def close(self):
+        """書き込みタスクを止め、残りの変更を書き込んでからデータベースを閉じる"""
+        if self.is_running():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._conn is not None:
+            await self.flush()
+            self._conn.close()
+            self._conn = None
+            logging.info("募集状態データベースを閉じました。")
+
+
+# 利用できる共有バックエンド
+# キー: SHARED_STATE_BACKEND に指定する名前
+# 値: SharedStateBackend を実装したクラス
+SHARED_STATE_BACKENDS = {
+    "sqlite": RecruitStateStore,
+}
+
+# 募集状態の永続化ストア (シャード間の共有バックエンドを兼ねる)
+recruit_store = SHARED_STATE_BACKENDS[SHARED_STATE_BACKEND](STATE_DB_PATH)
+
+
+# ジャーナルのイベントの種類
+JOURNAL_CREATE = 1
+JOURNAL_JOIN = 2
+JOURNAL_LEAVE = 3
+JOURNAL_FULL = 4
+JOURNAL_EMPTY_VC = 5
+JOURNAL_END = 6
+
+# ジャーナルの1レコード (32バイト固定長、リトルエンディアン)
+# 時刻 (UNIX秒), ギルドID, 募集主ID, イベント, モード番号 (MATCH_MODES, 不明は-1), 募集人数 (募集主を含む), 参加者数, 対象ランクのビット (GuildConfig.rank_index)
+JOURNAL_RECORD = struct.Struct("<dQQBbBBI")
+JOURNAL_DTYPE = np.dtype([
+    ("ts", "<f8"), ("guild_id", "<u8"), ("recruiter_id", "<u8"), ("event", "u1"),
+    ("mode", "i1"), ("party_size", "u1"), ("participants", "u1"), ("rank_mask", "<u4"),
+])
+
+
+class RecruitJournal:
+    """
+    募集のライフサイクルのイベントを固定長のバイナリレコードとして追記するジャーナル。
+    record() はメモリ上のバッファに詰めるだけで、同じループ周回で溜まったレコードを1回の追記で書き出す。
+    書き出しは1スレッドのエグゼキューターで行うため、ファイル上の順序は記録した順になる。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._buffer = bytearray()
+        self._flush_scheduled = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recruit-journal")
+        self.records = 0
+
+    def record(self, event: int, recruiter_id: int, flow: RecruitFlow):
+        self._buffer += JOURNAL_RECORD.pack(
+            time.time(), flow.guild_id or 0, recruiter_id, event, MATCH_MODES.get(flow.mode, -1),
+            min(flow.total_party_size or 0, 255), min(flow.participant_count, 255), journal_rank_mask(flow)
+        )
+        self.records += 1
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        data, self._buffer = bytes(self._buffer), bytearray()
+        self._flush_scheduled = False
+        if data:
+            asyncio.get_running_loop().run_in_executor(self._executor, self._write, data)
+
+    def _write(self, data: bytes):
+        try:
+            with open(self.path, "ab") as f:
+                f.write(data)
+        except OSError as e:
+            logging.error("募集ジャーナルの書き込みに失敗しました: %s", e)
+
+    async def close(self):
+        """残りのレコードを書き出し、書き込みが終わるのを待ってからエグゼキューターを止める"""
+        self._flush()
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+
+    def load(self) -> np.ndarray:
+        """ジャーナルをメモリマップで開く (書き込み途中の末尾のレコードは読まない)"""
+        try:
+            count = os.path.getsize(self.path) // JOURNAL_DTYPE.itemsize
+        except OSError:
+            count = 0
+        if count == 0:
+            return np.empty(0, dtype=JOURNAL_DTYPE)
+        return np.memmap(self.path, dtype=JOURNAL_DTYPE, mode="r", shape=(count,))
+
+
+def journal_rank_mask(flow: RecruitFlow) -> int:
+    """募集の対象ランクを、ギルド設定のランクの並び順のビットで表す"""
+    config = guild_configs.get(flow.guild_id) if flow.guild_id else None
+    if not config:
+        return 0
+    mask = 0
+    for role_id in flow.roles:
+        index = config.rank_index.get(role_id)
+        if index is not None and index < 32:
+            mask |= 1 << index
+    return mask
+
+
+# 募集のライフサイクルのジャーナル
+recruit_journal = RecruitJournal(RECRUIT_JOURNAL_PATH)
+
+
+class Subscription:
+    """
+    /募集通知 の登録1件。モードとランクはビットで持ち、0 ならすべてに一致する。
+    quiet_start〜quiet_end 時 (LOCAL_UTC_OFFSET_HOURS の時刻) は通知しない。
+    """
+    __slots__ = ("guild_id", "user_id", "mode_mask", "rank_mask", "delivery", "quiet_start", "quiet_end")
+
+    def __init__(self, guild_id: int, user_id: int, mode_mask: int = 0, rank_mask: int = 0, delivery: str = "dm", quiet_start=None, quiet_end=None):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.mode_mask = mode_mask
+        self.rank_mask = rank_mask
+        self.delivery = delivery
+        self.quiet_start = quiet_start
+        self.quiet_end = quiet_end
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def row(self) -> tuple:
+        return (self.guild_id, self.user_id, self.mode_mask, self.rank_mask, self.delivery, self.quiet_start, self.quiet_end)
+
+    def is_quiet(self, hour: int) -> bool:
+        if self.quiet_start is None or self.quiet_end is None or self.quiet_start == self.quiet_end:
+            return False
+        if self.quiet_start < self.quiet_end:
+            return self.quiet_start <= hour < self.quiet_end
+        return hour >= self.quiet_start or hour < self.quiet_end  # 日付をまたぐ時間帯
+
+    def keys(self):
+        """SubscriptionIndex に登録するキー (ギルドID, モード番号, ランク番号 or -1) を返す"""
+        modes = [number for number in MATCH_MODES.values() if not self.mode_mask or self.mode_mask & (1 << number)]
+        ranks = [index for index in range(32) if self.rank_mask & (1 << index)] if self.rank_mask else [-1]
+        return [(self.guild_id, mode, rank) for mode in modes for rank in ranks]
+
+
+class SubscriptionIndex:
+    """
+    募集通知の登録のインデックス。(ギルド, モード, ランク) ごとに登録者の集合を持ち、
+    募集の投稿時は該当するキーの集合の和を取るだけで通知先が決まる。
+    """
+    def __init__(self):
+        # キー: (ギルドID, ユーザーID), 値: Subscription
+        self._subscriptions = {}
+        # キー: (ギルドID, モード番号, ランク番号)、ランクを指定しない登録はランク番号 -1, 値: ユーザーIDの集合
+        self._by_key = {}
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def get(self, guild_id: int, user_id: int):
+        return self._subscriptions.get((guild_id, user_id))
+
+    def put(self, subscription: Subscription):
+        """登録を追加する (登録済みなら置き換える)"""
+        self.remove(subscription.guild_id, subscription.user_id)
+        self._subscriptions[(subscription.guild_id, subscription.user_id)] = subscription
+        for key in subscription.keys():
+            self._by_key.setdefault(key, set()).add(subscription.user_id)
+
+    def remove(self, guild_id: int, user_id: int):
+        subscription = self._subscriptions.pop((guild_id, user_id), None)
+        if subscription is None:
+            return None
+        for key in subscription.keys():
+            members = self._by_key.get(key)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._by_key[key]
+        return subscription
+
+    def match(self, guild_id: int, mode: int, rank_mask: int, rank_count: int) -> set:
+        """
+        募集のモードと対象ランクのビット (journal_rank_mask) に一致する登録者のIDの集合を返す。
+        「だれでもOK」(先頭のランク) の募集は、どのランクの登録者にも一致する。
+        """
+        if rank_mask & 1:
+            rank_mask = (1 << rank_count) - 1
+        recipients = set(self._by_key.get((guild_id, mode, -1), ()))
+        for index in range(min(rank_count, 32)):
+            if rank_mask & (1 << index):
+                recipients |= self._by_key.get((guild_id, mode, index), set())
+        return recipients
+
+
+# 募集通知の登録
+subscription_index = SubscriptionIndex()
+
+
+class NotificationFanout:
+    """
+    募集の投稿を /募集通知 の登録者に知らせる配信エンジン。
+    publish() は通知先を決めて上限付きのキューに積むだけで待たないため、募集の投稿は遅くならない。
+    キューが一杯なら新しい通知を捨てて数える。配信はワーカーが行い、DMは FANOUT_BATCH_SIZE 件ずつ
+    RESTスケジューラの低優先度で送ってバッチの間隔を空け、スレッドでの通知はメンションをまとめて送る。
+    バッチのたびに募集が締め切られていないか確かめ、終了・満員になったら残りは送らない。
+    """
+    def __init__(self, workers: int = FANOUT_WORKERS, queue_size: int = FANOUT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue = None
+        self._workers = []
+        # 通知済みの (ユーザーID, 募集メッセージID)。古いものから忘れる
+        self._delivered = OrderedDict()
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._workers) < self.workers:
+            self._workers.append(loop.create_task(self._worker()))
+
+    def start(self):
+        """配信ワーカーを起動する (起動済みなら何もしない)。通知が無い間もワーカーは待機して稼働中として扱う"""
+        self._ensure_workers()
+
+    def is_running(self):
+        return any(not worker.done() for worker in self._workers)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def publish(self, recruiter_id: int, flow: RecruitFlow):
+        """投稿された募集に一致する登録者を求め、配信待ちにする"""
+        config = guild_configs.get(flow.guild_id) if flow.guild_id else None
+        if not config or flow.mode not in MATCH_MODES or not len(subscription_index):
             return
-        self.flow = active_recruit_flows[interaction.user.id]
+        recipients = subscription_index.match(flow.guild_id, MATCH_MODES[flow.mode], journal_rank_mask(flow), len(config.rank_role_ids))
+        recipients.difference_update(flow.participant_ids)
+        if not recipients:
+            return
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((recruiter_id, flow.message_id, recipients))
+        except asyncio.QueueFull:
+            notifications_dropped_total.inc("queue_full", amount=len(recipients))
+            logging.warning("募集通知のキューが一杯のため、募集主 %s の募集の通知 (%s人) を捨てました。", recruiter_id, len(recipients), extra={"recruiter_id": recruiter_id})
 
-        self.flow.people_to_recruit = int(self.values[0])
-        self.flow.total_party_size = self.flow.people_to_recruit + 1 
-        await interaction.response.edit_message(
-            content="次に対象ランクを選んでください：",
-            view=RankSelectView(self.flow, interaction.guild)
+    async def _worker(self):
+        while True:
+            recruiter_id, message_id, recipients = await self._queue.get()
+            try:
+                await self._deliver(recruiter_id, message_id, recipients)
+            except Exception as e:
+                logging.error("募集主 %s の募集の通知中に予期せぬエラー: %s", recruiter_id, e, extra={"recruiter_id": recruiter_id})
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def open_flow(recruiter_id: int, message_id: int):
+        """通知した募集がまだ参加を受け付けていればそのフローを返す"""
+        flow = active_recruit_flows.get(recruiter_id)
+        if recruiter_id not in recruit_index or not flow or flow.message_id != message_id or flow.participant_count >= flow.total_party_size:
+            return None
+        return flow
+
+    def _claim(self, user_id: int, message_id: int) -> bool:
+        """このユーザーにこの募集をまだ通知していなければ通知済みにして True を返す"""
+        key = (user_id, message_id)
+        if key in self._delivered:
+            return False
+        self._delivered[key] = None
+        if len(self._delivered) > FANOUT_DEDUP_SIZE:
+            self._delivered.popitem(last=False)
+        return True
+
+    async def _deliver(self, recruiter_id: int, message_id: int, recipients: set):
+        # 通知しない時間帯は、投稿時ではなく配信時の時刻で判定する
+        hour = int((time.time() + LOCAL_UTC_OFFSET_HOURS * 3600) // 3600 % 24)
+        flow = self.open_flow(recruiter_id, message_id)
+        if flow is None:
+            notifications_total.inc("any", "closed", amount=len(recipients))
+            return
+        by_delivery = {"thread": [], "dm": []}
+        for user_id in sorted(recipients):
+            subscription = subscription_index.get(flow.guild_id, user_id)
+            if subscription is None or user_id in flow.participant_ids:
+                continue
+            if subscription.is_quiet(hour):
+                notifications_total.inc(subscription.delivery, "quiet")
+                continue
+            if self._claim(user_id, message_id):
+                by_delivery[subscription.delivery].append(user_id)
+
+        if by_delivery["thread"]:
+            await self._deliver_thread(recruiter_id, message_id, by_delivery["thread"])
+        dm_user_ids = by_delivery["dm"]
+        for start in range(0, len(dm_user_ids), FANOUT_BATCH_SIZE):
+            flow = self.open_flow(recruiter_id, message_id)
+            if flow is None:
+                notifications_total.inc("dm", "closed", amount=len(dm_user_ids) - start)
+                return
+            if start:
+                await asyncio.sleep(FANOUT_BATCH_INTERVAL)
+            batch = dm_user_ids[start:start + FANOUT_BATCH_SIZE]
+            content = self.notification_text(flow)
+            await asyncio.gather(*(self._send_dm(user_id, content) for user_id in batch))
+
+    @staticmethod
+    def notification_text(flow: RecruitFlow) -> str:
+        guild = bot.get_guild(flow.guild_id)
+        slots = flow.total_party_size - flow.participant_count
+        return (
+            f"🔔 {guild.name if guild else 'サーバー'} で条件に合う募集が始まりました: **{flow.title}** "
+            f"({flow.mode} / あと{slots}人)\n{flow.jump_url}\n"
+            f"通知をやめるには `/募集通知解除` を使ってください。"
         )
 
-class PeopleSelectView(View):
-    """募集人数選択を含むView"""
-    def __init__(self, flow):
-        super().__init__()
-        self.flow = flow
-        self.add_item(PeopleSelect(flow))
+    async def _send_dm(self, user_id: int, content: str):
+        async def send():
+            channel = await bot.create_dm(discord.Object(id=user_id))
+            await channel.send(content)
+        try:
+            await rest_scheduler.submit(f"dm:{user_id}", send, priority=PRIORITY_BACKGROUND, idempotent=False)
+            notifications_total.inc("dm", "sent")
+        except discord.Forbidden:
+            notifications_total.inc("dm", "forbidden")  # DMを受け付けていないユーザー
+        except Exception as e:
+            notifications_total.inc("dm", "failed")
+            logging.error("ユーザー %s への募集通知のDM送信に失敗: %s", user_id, e, extra={"user_id": user_id})
+
+    async def _deliver_thread(self, recruiter_id: int, message_id: int, user_ids: list):
+        """募集メッセージにスレッドを作り、登録者へのメンションを FANOUT_THREAD_MENTIONS 人ずつ送る"""
+        flow = self.open_flow(recruiter_id, message_id)
+        message = flow.message if flow else None
+        if message is None:
+            notifications_total.inc("thread", "closed", amount=len(user_ids))
+            return
+        try:
+            thread = await rest_scheduler.submit(
+                f"threads:{flow.message_channel_id}",
+                lambda: message.create_thread(name=f"🔔 {flow.title}"[:100], auto_archive_duration=60),
+                priority=PRIORITY_BACKGROUND,
+                idempotent=False
+            )
+        except Exception as e:
+            notifications_total.inc("thread", "failed", amount=len(user_ids))
+            logging.error("募集メッセージ (ID: %s) への通知スレッドの作成に失敗: %s", message_id, e)
+            return
+        allowed = discord.AllowedMentions(everyone=False, roles=False, users=True)
+        for start in range(0, len(user_ids), FANOUT_THREAD_MENTIONS):
+            chunk = user_ids[start:start + FANOUT_THREAD_MENTIONS]
+            if self.open_flow(recruiter_id, message_id) is None:
+                notifications_total.inc("thread", "closed", amount=len(user_ids) - start)
+                return
+            content = " ".join(f"<@{user_id}>" for user_id in chunk)
+            try:
+                await rest_scheduler.submit(
+                    f"messages:{thread.id}",
+                    lambda: thread.send(content, allowed_mentions=allowed),
+                    priority=PRIORITY_BACKGROUND,
+                    idempotent=False
+                )
+                notifications_total.inc("thread", "sent", amount=len(chunk))
+            except Exception as e:
+                notifications_total.inc("thread", "failed", amount=len(chunk))
+                logging.error("通知スレッド (ID: %s) へのメンションの送信に失敗: %s", thread.id, e)
 
+    async def close(self):
+        """配信ワーカーを止める (配信待ちの通知は捨てる)"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._queue is not None and self._queue.qsize():
+            logging.info("配信待ちの募集通知 %s 件を破棄しました。", self._queue.qsize())
+        self._queue = None
 
-class RankSelect(discord.ui.Select):
-    """対象ランク選択用ドロップダウン"""
-    def __init__(self, flow: RecruitFlow, guild: discord.Guild):
-        self.flow = flow
-        options = []
-        for role_id in RANK_ROLE_IDS:
-            role = guild.get_role(role_id)
-            if role:
-                options.append(discord.SelectOption(label=role.name, value=str(role.id)))
-
-        super().__init__(
-            placeholder="対象ランクを選んでください（複数可）",
-            min_values=1,
-            max_values=len(options),
-            options=options
+
+# 募集通知の配信エンジン
+notification_fanout = NotificationFanout()
+
+# このプロセスが保持しているリースの期限
+# キー: リース名
+# 値: 期限 (time.time())
+held_leases = {}
+
+
+async def acquire_lease(name: str) -> bool:
+    """
+    複数プロセスのうち1つだけが行う処理のリースを取得・更新する。
+    シャード構成でない場合は常に True を返す。
+    """
+    if not IS_SHARDED:
+        return True
+    if held_leases.get(name, 0) - LEASE_TTL / 2 > time.time():
+        return True  # 期限まで十分余裕があれば更新しない
+    try:
+        acquired = await asyncio.to_thread(recruit_store.acquire_lease, name, INSTANCE_ID, LEASE_TTL)
+    except Exception as e:
+        logging.error("リース '%s' の取得中にエラーが発生しました: %s", name, e)
+        acquired = False
+    if acquired:
+        held_leases[name] = time.time() + LEASE_TTL
+    else:
+        held_leases.pop(name, None)
+    return acquired
+
+
+async def release_leases():
+    """このプロセスが保持しているリースをすべて手放す"""
+    for name in list(held_leases):
+        try:
+            await asyncio.to_thread(recruit_store.release_lease, name, INSTANCE_ID)
+        except Exception as e:
+            logging.error("リース '%s' の解放中にエラーが発生しました: %s", name, e)
+        held_leases.pop(name, None)
+
+
+def owns_guild(guild_id: int) -> bool:
+    """このプロセスがギルドを担当しているシャードに接続しているかを返す"""
+    if not IS_SHARDED:
+        return True
+    shard_id = (guild_id >> 22) % SHARD_COUNT
+    return bot.shard_ids is None or shard_id in bot.shard_ids
+
+
+class MemberResolver:
+    """
+    メンバーをギルドのキャッシュ、最近使ったメンバーのLRU、ゲートウェイへの問い合わせの順に解決する。
+    LEAN_MEMBER_CACHE ではギルドのキャッシュにほとんどメンバーが居ないため、
+    募集に関わるメンバーだけを size 件までLRUで保持する。
+    """
+    # ゲートウェイの REQUEST_GUILD_MEMBERS で一度に指定できるユーザーIDの上限
+    QUERY_BATCH_SIZE = 100
+
+    def __init__(self, size: int):
+        self.size = size
+        # キー: (ギルドID, メンバーID), 値: discord.Member
+        self._members = OrderedDict()
+
+    def __len__(self):
+        return len(self._members)
+
+    def remember(self, member: discord.Member):
+        """操作したメンバーなど、手元にあるメンバーをLRUに入れる"""
+        key = (member.guild.id, member.id)
+        self._members[key] = member
+        self._members.move_to_end(key)
+        if len(self._members) > self.size:
+            self._members.popitem(last=False)
+
+    def get(self, guild: discord.Guild, member_id: int):
+        """キャッシュとLRUだけからメンバーを返す (無ければ None)"""
+        member = guild.get_member(member_id)
+        if member is not None:
+            return member
+        key = (guild.id, member_id)
+        member = self._members.get(key)
+        if member is not None:
+            self._members.move_to_end(key)
+        return member
+
+    async def resolve_many(self, guild: discord.Guild, member_ids, failed: set = None) -> dict:
+        """
+        member_ids のメンバーを解決して {メンバーID: discord.Member} を返す。
+        キャッシュに無いメンバーは QUERY_BATCH_SIZE 件ずつゲートウェイに問い合わせ、サーバーに居ないメンバーは含めない。
+        failed を渡すと、問い合わせに失敗して居るかどうか分からなかったメンバーIDをそこに加える。
+        """
+        members = {}
+        missing = []
+        for member_id in member_ids:
+            member = self.get(guild, member_id)
+            if member is not None:
+                members[member_id] = member
+            else:
+                missing.append(member_id)
+        if guild.chunked:
+            return members  # 全メンバーを取得済みのギルドでキャッシュに無ければ、サーバーに居ない
+
+        for i in range(0, len(missing), self.QUERY_BATCH_SIZE):
+            batch = missing[i:i + self.QUERY_BATCH_SIZE]
+            try:
+                found = await guild.query_members(user_ids=batch, limit=len(batch), cache=False)
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                logging.warning("ギルド %s のメンバー %s 人の取得に失敗しました: %s", guild.id, len(batch), e, extra={"guild_id": guild.id})
+                if failed is not None:
+                    failed.update(batch)
+                continue
+            for member in found:
+                self.remember(member)
+                members[member.id] = member
+        return members
+
+
+# 募集に関わるメンバーの解決 (LEAN_MEMBER_CACHE でもメンバーを引けるようにする)
+member_resolver = MemberResolver(MEMBER_LRU_SIZE)
+
+
+async def resolve_flow_members(rows) -> set:
+    """
+    保存された募集フローの行に含まれる参加者を、ギルドごとにまとめて解決してLRUに入れる。
+    サーバーに居ないことが確かめられた (ギルドID, メンバーID) の集合を返す。
+    LRUからは溢れることがあるため、rehydrate_flow はLRUではなくこの戻り値で参加者を判定する。
+    問い合わせに失敗したメンバーは居るかどうか分からないので含めない (参加者として残す)。
+    """
+    member_ids_by_guild = {}
+    for row in rows:
+        guild_id, participants = row[1], row[10]
+        if guild_id:
+            member_ids_by_guild.setdefault(guild_id, set()).update(json.loads(participants))
+    missing = set()
+    for guild_id, member_ids in member_ids_by_guild.items():
+        guild = bot.get_guild(guild_id)
+        if guild:
+            failed = set()
+            found = await member_resolver.resolve_many(guild, member_ids, failed)
+            missing.update((guild_id, member_id) for member_id in member_ids if member_id not in found and member_id not in failed)
+    return missing
+
+
+def rehydrate_flow(row, missing_members: set):
+    """
+    保存された行から募集フローを組み立てる。
+    VC・募集メッセージのチャンネルが見つからない、または募集主がサーバーに居ない場合は None を返す。
+    missing_members は resolve_flow_members が返した、サーバーに居ないことが確かめられた (ギルドID, メンバーID) の集合。
+    """
+    (recruiter_id, guild_id, mode, people_to_recruit, total_party_size, roles, title,
+     vc_channel_id, message_channel_id, message_id, participants) = row
+
+    guild = bot.get_guild(guild_id) if guild_id else None
+    participant_ids = json.loads(participants)
+    if (not guild or not bot.get_channel(vc_channel_id) or not bot.get_channel(message_channel_id)
+            or not participant_ids or (guild_id, participant_ids[0]) in missing_members):
+        return None
+
+    flow = RecruitFlow()
+    flow.mode = mode
+    flow.people_to_recruit = people_to_recruit
+    flow.total_party_size = total_party_size
+    flow.roles = tuple(int(r) for r in json.loads(roles))
+    flow.title = title
+    flow.guild_id = guild_id
+    flow.vc_channel_id = vc_channel_id
+    flow.message_channel_id = message_channel_id
+    flow.message_id = message_id
+    flow.participant_ids = dict.fromkeys(member_id for member_id in participant_ids if (guild_id, member_id) not in missing_members)
+    return flow
+
+
+def adopt_flow(recruiter_id: int, flow: RecruitFlow):
+    """
+    組み立てた募集フローをこのプロセスの管理下に置き、VCの空室監視を登録する。
+    募集メッセージのボタンはグローバルに登録した RecruitPostButton が受け付けるため、Viewの登録は要らない。
+    """
+    active_recruit_flows[recruiter_id] = flow
+    track_recruit_vc(flow.vc_channel, recruiter_id)
+    recruit_index.add(recruiter_id, flow)
+
+
+async def get_recruit_flow(recruiter_id: int):
+    """
+    募集フローを取得する。シャード構成でこのプロセスに無い場合は共有バックエンドから読み込み、
+    担当しているギルドの募集であればこのプロセスの管理下に置く。
+    """
+    flow = active_recruit_flows.get(recruiter_id)
+    if flow is not None or not IS_SHARDED:
+        return flow
+
+    try:
+        row = await asyncio.to_thread(recruit_store.load_flow, recruiter_id)
+    except Exception as e:
+        logging.error("共有バックエンドからの募集フロー読み込み中にエラー (ID: %s): %s", recruiter_id, e, extra={"recruiter_id": recruiter_id})
+        return None
+    if row is None:
+        return None
+    missing_members = await resolve_flow_members([row])
+    flow = rehydrate_flow(row, missing_members)
+    if flow is None:
+        return None
+    if owns_guild(flow.guild_id) and recruiter_id not in active_recruit_flows:
+        adopt_flow(recruiter_id, flow)
+        logging.info("募集主 %s の募集フローを共有バックエンドから引き継ぎました。", recruiter_id, extra={"recruiter_id": recruiter_id, "guild_id": flow.guild_id})
+    # 担当外のギルドの募集は読み取り専用の写し (書き込み待ちの分だけ古いことがある) として返す。参加は join_recruit が断る
+    return active_recruit_flows.get(recruiter_id, flow)
+
+
+async def restore_subscriptions():
+    """保存されていた募集通知の登録のうち、このプロセスが担当するギルドの分をインデックスに読み込む"""
+    rows = await asyncio.to_thread(recruit_store.load_subscriptions)
+    for row in rows:
+        if owns_guild(row[0]):
+            subscription_index.put(Subscription.from_row(row))
+    logging.info("募集通知の登録 %s 件を読み込みました。", len(subscription_index))
+
+
+async def restore_recruit_state():
+    """
+    保存されていた募集フローを一括で読み込み、active_recruit_flows に復元する。
+    復元した募集は参加ボタンのViewを登録し直し、VCの空室監視も再開する。
+    シャード構成では、このプロセスが担当していないギルドの募集には手を付けない。
+    """
+    flows, buttons = await asyncio.to_thread(recruit_store.load_all)
+
+    for channel_id, message_id in buttons:
+        start_button_message_info[channel_id] = message_id
+
+    # 参加者をギルドごとにまとめて解決しておく (LEAN_MEMBER_CACHE ではギルドのキャッシュに居ないため)
+    missing_members = await resolve_flow_members([row for row in flows if row[0] not in active_recruit_flows and row[1] and owns_guild(row[1])])
+
+    restored = 0
+    for row in flows:
+        recruiter_id, guild_id = row[0], row[1]
+        if recruiter_id in active_recruit_flows or (guild_id and not owns_guild(guild_id)):
+            continue
+
+        flow = rehydrate_flow(row, missing_members)
+        if flow is None:
+            logging.warning("募集主 %s の保存された募集を復元できませんでした (VC・メッセージ・募集主のいずれかが見つかりません)。", recruiter_id, extra={"recruiter_id": recruiter_id})
+            recruit_store.delete_flow(recruiter_id)
+            vc_channel = bot.get_channel(row[7]) if row[7] else None
+            if vc_channel:
+                try:
+                    await release_or_delete_vc(vc_channel)
+                except Exception as e:
+                    logging.error("復元できなかった募集のVC削除に失敗: %s", e)
+            continue
+
+        adopt_flow(recruiter_id, flow)
+        if flow.participant_count != len(json.loads(row[10])):
+            recruit_store.save_flow(recruiter_id, flow)  # サーバーを抜けた参加者を除いて保存し直す
+        restored += 1
+
+    logging.info("保存されていた募集 %s 件と募集開始ボタン %s 件を復元しました。", restored, len(buttons))
+
+class GuildConfig:
+    """ギルドごとの設定と、設定から解決したチャンネル・ロールのキャッシュ"""
+    def __init__(self, guild_id, vc_category_id: int, rank_role_ids: list, recruit_button_channel_id: int, recruit_post_channel_id: int):
+        self.guild_id = guild_id
+        self.vc_category_id = vc_category_id
+        self.rank_role_ids = rank_role_ids
+        self.recruit_button_channel_id = recruit_button_channel_id
+        self.recruit_post_channel_id = recruit_post_channel_id
+        # キー: ランクロールID, 値: rank_role_ids 内の位置 (マッチングのビットマスクに使う)
+        self.rank_index = {role_id: i for i, role_id in enumerate(rank_role_ids)}
+        # resolve() で解決したオブジェクト
+        self.category = None
+        self.rank_roles = []
+        self.button_channel = None
+        self.post_channel = None
+
+    @classmethod
+    def from_dict(cls, guild_id, data: dict):
+        return cls(
+            guild_id,
+            int(data["vc_category_id"]),
+            [int(role_id) for role_id in data["rank_role_ids"]],
+            int(data["recruit_button_channel_id"]),
+            int(data["recruit_post_channel_id"]),
         )
 
+    def resolve(self, guild: discord.Guild):
+        """チャンネルとロールを一度だけ解決してキャッシュする"""
+        category = guild.get_channel(self.vc_category_id)
+        button_channel = guild.get_channel(self.recruit_button_channel_id)
+        post_channel = guild.get_channel(self.recruit_post_channel_id)
+        self.category = category if isinstance(category, discord.CategoryChannel) else None
+        self.button_channel = button_channel if isinstance(button_channel, discord.TextChannel) else None
+        self.post_channel = post_channel if isinstance(post_channel, discord.TextChannel) else None
+        self.rank_roles = [role for role in (guild.get_role(role_id) for role_id in self.rank_role_ids) if role]
+
+        if not self.category:
+            logging.error("ギルド %s のVCカテゴリID %s が見つからないか、カテゴリではありません。", guild.id, self.vc_category_id, extra={"guild_id": guild.id})
+        if not self.button_channel:
+            logging.error("ギルド %s の募集開始ボタンチャンネル (ID: %s) が見つからないか、テキストチャンネルではありません。", guild.id, self.recruit_button_channel_id, extra={"guild_id": guild.id})
+        if not self.post_channel:
+            logging.error("ギルド %s の募集投稿チャンネルID %s が見つからないか、テキストチャンネルではありません。", guild.id, self.recruit_post_channel_id, extra={"guild_id": guild.id})
+
+
+class GuildConfigRegistry:
+    """
+    ギルドIDをキーにした設定のレジストリ。起動時に設定ファイルを一括で読み込み、
+    チャンネルとロールは解決済みのオブジェクトをキャッシュするため、参照は辞書の引き当て1回で済む。
+    reload() で再起動せずに設定を読み直せる。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._configs = {}
+
+    def __len__(self):
+        return len(self._configs)
+
+    def get(self, guild_id: int):
+        return self._configs.get(guild_id)
+
+    def all(self):
+        return list(self._configs.values())
+
+    def _read(self) -> list:
+        if not os.path.exists(self.path):
+            # 設定ファイルが無い場合は、従来の定数を VC_CATEGORY_ID があるギルドの設定として使う
+            return [GuildConfig(None, VC_CATEGORY_ID, list(RANK_ROLE_IDS), RECRUIT_BUTTON_CHANNEL_ID, RECRUIT_POST_CHANNEL_ID)]
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        return [GuildConfig.from_dict(int(guild_id), entry) for guild_id, entry in data.items()]
+
+    def _resolve(self, config: GuildConfig):
+        """設定のギルドを特定して解決する。このプロセスから見えないギルドなら None を返す"""
+        if config.guild_id is None:
+            category = bot.get_channel(config.vc_category_id)
+            if not category:
+                logging.error("VCカテゴリID %s が見つからないため、既定の設定のギルドを特定できません。", config.vc_category_id)
+                return None
+            config.guild_id = category.guild.id
+        guild = bot.get_guild(config.guild_id)
+        if not guild:
+            return None
+        config.resolve(guild)
+        return config
+
+    def load(self):
+        """設定を一括で読み込み、見えているギルドの分を解決してから入れ替える"""
+        configs = {}
+        for config in self._read():
+            if self._resolve(config):
+                configs[config.guild_id] = config
+        self._configs = configs
+        logging.info("ギルド設定 %s 件を読み込みました。", len(configs))
+
+    def resolve_guild(self, guild: discord.Guild):
+        """参加したギルドの設定があれば解決して登録する"""
+        for config in self._read():
+            if config.guild_id == guild.id or (config.guild_id is None and guild.get_channel(config.vc_category_id)):
+                config.guild_id = guild.id
+                config.resolve(guild)
+                self._configs[guild.id] = config
+
+
+# ギルドごとの設定
+guild_configs = GuildConfigRegistry(GUILD_CONFIG_PATH)
+
+
+class RecruitIndex:
+    """
+    投稿済みで参加を受け付けている募集の二次インデックス。
+    ギルドごとのモード・対象ランクごとに募集主IDの集合を持ち、投稿・終了のたびに差分だけ更新する。
+    残り枠はエントリーにだけ持つため、参加・離脱ではエントリーを1つ書き換えるだけで済む。
+    ギルドごとの募集は (募集メッセージID, 募集主ID) の昇順のリストで持ち、新しい順のページングはリストを後ろから辿るだけで済む。
+    """
+    def __init__(self):
+        # キー: 募集主ID, 値: (ギルドID, モード, 対象ランクロールIDのタプル, 残り枠, 募集メッセージID)
+        self._entries = {}
+        # キー: ギルドID, 値: (募集メッセージID, 募集主ID) の昇順のリスト (メッセージIDは投稿順)
+        self.by_guild = {}
+        # キー: (ギルドID, モード), 値: 募集主IDの集合
+        self.by_mode = {}
+        # キー: (ギルドID, 対象ランクロールID), 値: 募集主IDの集合
+        self.by_rank = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, recruiter_id):
+        return recruiter_id in self._entries
+
+    @staticmethod
+    def _discard(index: dict, key, recruiter_id: int):
+        members = index.get(key)
+        if members is not None:
+            members.discard(recruiter_id)
+            if not members:
+                del index[key]
+
+    def add(self, recruiter_id: int, flow: RecruitFlow):
+        """募集をインデックスに登録する (登録済みなら更新する)"""
+        if not flow.message_id or not flow.vc_channel_id:
+            return
+        if recruiter_id in self._entries:
+            self.update(recruiter_id, flow)
+            return
+        guild_id = flow.guild_id
+        roles = flow.roles
+        slots = max(0, flow.total_party_size - flow.participant_count)
+        self._entries[recruiter_id] = (guild_id, flow.mode, roles, slots, flow.message_id)
+        bisect.insort(self.by_guild.setdefault(guild_id, []), (flow.message_id, recruiter_id))
+        self.by_mode.setdefault((guild_id, flow.mode), set()).add(recruiter_id)
+        for role_id in roles:
+            self.by_rank.setdefault((guild_id, role_id), set()).add(recruiter_id)
+
+    def update(self, recruiter_id: int, flow: RecruitFlow):
+        """参加・離脱で変わった残り枠だけを書き換える"""
+        entry = self._entries.get(recruiter_id)
+        if entry is None:
+            return
+        slots = max(0, flow.total_party_size - flow.participant_count)
+        if slots != entry[3]:
+            self._entries[recruiter_id] = entry[:3] + (slots,) + entry[4:]
+
+    def remove(self, recruiter_id: int):
+        entry = self._entries.pop(recruiter_id, None)
+        if entry is None:
+            return
+        guild_id, mode, roles, slots, message_id = entry
+        ordered = self.by_guild.get(guild_id)
+        if ordered is not None:
+            i = bisect.bisect_left(ordered, (message_id, recruiter_id))
+            if i < len(ordered) and ordered[i] == (message_id, recruiter_id):
+                del ordered[i]
+            if not ordered:
+                del self.by_guild[guild_id]
+        self._discard(self.by_mode, (guild_id, mode), recruiter_id)
+        for role_id in roles:
+            self._discard(self.by_rank, (guild_id, role_id), recruiter_id)
+
+    def with_free_slots(self, min_slots: int = 1) -> set:
+        """残り枠が min_slots 以上の募集主IDの集合を返す (マッチングで全募集を走査するときに使う)"""
+        return {recruiter_id for recruiter_id, entry in self._entries.items() if entry[3] >= min_slots}
+
+    def query(self, guild_id: int, mode=None, rank_role_ids=None, min_slots: int = 1, before=None, limit: int = RECRUIT_LIST_PAGE_SIZE):
+        """
+        条件に合う募集を新しい順に limit 件返す。
+        rank_role_ids はどれかに一致すればよいランクロールIDの集合、before は前のページの最後の募集メッセージID (カーソル)。
+        戻り値は (募集主IDのリスト, 次のページのカーソル or None)。
+        ギルドの募集より小さい、同じギルドのモード・ランクの集合があればそこから候補を絞り、無ければギルドの募集をカーソルから新しい順に辿る。
+        残り枠とカーソルは候補ごとにエントリーで判定するため、全募集の和集合は作らない。
+        """
+        ordered = self.by_guild.get(guild_id)
+        if not ordered:
+            return [], None
+
+        filters = []
+        if mode is not None:
+            mode_set = self.by_mode.get((guild_id, mode), set())
+            filters.append((len(mode_set), [mode_set]))
+        if rank_role_ids is not None:
+            rank_sets = [self.by_rank[(guild_id, role_id)] for role_id in rank_role_ids if (guild_id, role_id) in self.by_rank]
+            filters.append((sum(len(members) for members in rank_sets), rank_sets))
+
+        def matches(recruiter_id: int) -> bool:
+            entry_guild, entry_mode, roles, slots, message_id = self._entries[recruiter_id]
+            return (
+                entry_guild == guild_id
+                and slots >= min_slots
+                and (before is None or message_id < before)
+                and (mode is None or entry_mode == mode)
+                and (rank_role_ids is None or any(role_id in rank_role_ids for role_id in roles))
+            )
+
+        smallest = min(filters, key=lambda item: item[0], default=None)
+        if smallest is not None and smallest[0] < len(ordered):
+            # 小さい集合から候補を取り、ページ分 (+1件) だけを部分的に並べる
+            candidates = {recruiter_id for members in smallest[1] for recruiter_id in members}
+            keyed = heapq.nlargest(
+                limit + 1,
+                ((self._entries[recruiter_id][4], recruiter_id) for recruiter_id in candidates if matches(recruiter_id))
+            )
+        else:
+            # ギルドの募集をカーソルの位置から新しい順に辿り、ページ分 (+1件) 見つかったら止める
+            end = bisect.bisect_left(ordered, (before,)) if before is not None else len(ordered)
+            keyed = []
+            for i in range(end - 1, -1, -1):
+                message_id, recruiter_id = ordered[i]
+                if matches(recruiter_id):
+                    keyed.append((message_id, recruiter_id))
+                    if len(keyed) > limit:
+                        break
+
+        page = keyed[:limit]
+        next_cursor = page[-1][0] if len(keyed) > limit else None
+        return [recruiter_id for _, recruiter_id in page], next_cursor
+
+
+# 参加を受け付けている募集の二次インデックス
+recruit_index = RecruitIndex()
+
+
+# 入力の段階ごとのドロップダウンの案内
+WIZARD_PLACEHOLDERS = {
+    "mode": "ゲームモードを選択",
+    "people": "募集人数を選択",
+    "rank": "対象ランクを選んでください（複数可）",
+}
+
+
+def build_wizard_view(step: str, recruiter_id: int, guild: discord.Guild = None) -> View:
+    """
+    入力の段階 step のコンポーネントを1つだけ含むViewを組み立てる。
+    コンポーネントは custom_id に段階と募集主のIDを持つ DynamicItem なので、Viewを保持しておく必要はない。
+    """
+    view = View(timeout=None)
+    if step == "title":
+        view.add_item(WizardTitleButton(recruiter_id))
+    else:
+        view.add_item(WizardSelect(step, recruiter_id, guild))
+    return view
+
+
+async def resolve_wizard_flow(interaction: discord.Interaction, recruiter_id: int):
+    """入力中の募集フローを返す。操作したのが募集主でない、またはフローが無ければ応答して None を返す"""
+    if interaction.user.id != recruiter_id:
+        await interaction.response.send_message("この入力は募集主のみが操作できます。", ephemeral=True)
+        return None
+    flow = active_recruit_flows.get(recruiter_id)
+    if flow is None:
+        await interaction.response.send_message("募集フローが見つかりませんでした。再度`!募集開始`コマンドを実行するか、募集開始ボタンを押してください。", ephemeral=True)
+        return None
+    touch_wizard_flow(recruiter_id)
+    return flow
+
+
+class WizardSelect(discord.ui.DynamicItem[Select], template=r"wizard:(?P<step>mode|people|rank):(?P<recruiter_id>[0-9]+)"):
+    """募集の入力 (ゲームモード・募集人数・対象ランク) のドロップダウン"""
+    def __init__(self, step: str, recruiter_id: int, guild: discord.Guild = None, item: Select = None):
+        if item is None:
+            if step == "mode":
+                options = [
+                    discord.SelectOption(label="コンペティティブ", value="コンペ"),
+                    discord.SelectOption(label="アンレート", value="アンレート")
+                ]
+            elif step == "people":
+                options = [
+                    discord.SelectOption(label="デュオ（あと1人募集）", value="1"),
+                    discord.SelectOption(label="トリオ（あと2人募集）", value="2"),
+                    discord.SelectOption(label="フルパ（あと4人募集）", value="4")
+                ]
+            else:
+                config = guild_configs.get(guild.id) if guild else None
+                options = [discord.SelectOption(label=role.name, value=str(role.id)) for role in (config.rank_roles if config else [])]
+            item = Select(
+                custom_id=f"wizard:{step}:{recruiter_id}",
+                placeholder=WIZARD_PLACEHOLDERS[step],
+                min_values=1,
+                max_values=max(1, len(options)) if step == "rank" else 1,
+                options=options
+            )
+        super().__init__(item)
+        self.step = step
+        self.recruiter_id = recruiter_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Select, match):
+        # 選択肢はメッセージ上のコンポーネントのものをそのまま使う
+        return cls(match["step"], int(match["recruiter_id"]), item=item)
+
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id not in active_recruit_flows:
-            await interaction.response.send_message("募集フローが見つかりませんでした。再度`!募集開始`コマンドを実行するか、募集開始ボタンを押してください。", ephemeral=True)
+        if self.step == "mode":
+            await self.select_mode(interaction)
+        elif self.step == "people":
+            await self.select_people(interaction)
+        else:
+            await self.select_rank(interaction)
+
+    @instrument_interaction("mode_select")
+    async def select_mode(self, interaction: discord.Interaction):
+        flow = await resolve_wizard_flow(interaction, self.recruiter_id)
+        if flow is None:
             return
-        self.flow = active_recruit_flows[interaction.user.id]
 
-        self.flow.roles = self.values
-        await interaction.response.edit_message(
-            content="対象ランクを選択しました。募集タイトルを入力してください：",
-            view=TitleInputView(self.flow)
-        )
+        flow.mode = self.item.values[0]
+        with trace_span("interaction.edit_message"):
+            await interaction.response.edit_message(
+                content="次に募集人数を選んでください：",
+                view=build_wizard_view("people", self.recruiter_id)
+            )
 
+    @instrument_interaction("people_select")
+    async def select_people(self, interaction: discord.Interaction):
+        flow = await resolve_wizard_flow(interaction, self.recruiter_id)
+        if flow is None:
+            return
 
-class RankSelectView(View):
-    """対象ランク選択を含むView"""
-    def __init__(self, flow: RecruitFlow, guild: discord.Guild):
-        super().__init__()
-        self.flow = flow
-        self.add_item(RankSelect(flow, guild))
+        flow.people_to_recruit = int(self.item.values[0])
+        flow.total_party_size = flow.people_to_recruit + 1
+        with trace_span("interaction.edit_message"):
+            await interaction.response.edit_message(
+                content="次に対象ランクを選んでください：",
+                view=build_wizard_view("rank", self.recruiter_id, interaction.guild)
+            )
 
+    @instrument_interaction("rank_select")
+    async def select_rank(self, interaction: discord.Interaction):
+        flow = await resolve_wizard_flow(interaction, self.recruiter_id)
+        if flow is None:
+            return
 
-class TitleInputView(View):
-    """タイトル入力ボタンを含むView"""
-    def __init__(self, flow: RecruitFlow):
-        super().__init__()
-        self.flow = flow
-        self.add_item(TitleInputButton(self.flow))
+        flow.roles = tuple(int(value) for value in self.item.values)
+        with trace_span("interaction.edit_message"):
+            await interaction.response.edit_message(
+                content="対象ランクを選択しました。募集タイトルを入力してください：",
+                view=build_wizard_view("title", self.recruiter_id)
+            )
 
-class TitleInputButton(discord.ui.Button):
+
+class WizardTitleButton(discord.ui.DynamicItem[Button], template=r"wizard:title:(?P<recruiter_id>[0-9]+)"):
     """タイトル入力用ボタン"""
-    def __init__(self, flow: RecruitFlow):
-        super().__init__(label="タイトルを入力", style=discord.ButtonStyle.primary)
-        self.flow = flow
+    def __init__(self, recruiter_id: int):
+        super().__init__(Button(label="タイトルを入力", style=discord.ButtonStyle.primary, custom_id=f"wizard:title:{recruiter_id}"))
+        self.recruiter_id = recruiter_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(int(match["recruiter_id"]))
 
+    @instrument_interaction("title_button")
     async def callback(self, interaction: discord.Interaction):
-        if interaction.user.id not in active_recruit_flows:
-            await interaction.response.send_message("募集フローが見つかりませんでした。再度`!募集開始`コマンドを実行するか、募集開始ボタンを押してください。", ephemeral=True)
+        flow = await resolve_wizard_flow(interaction, self.recruiter_id)
+        if flow is None:
             return
-        self.flow = active_recruit_flows[interaction.user.id]
 
-        await interaction.response.send_modal(TitleModal(self.flow, interaction))
+        with trace_span("interaction.send_modal"):
+            await interaction.response.send_modal(TitleModal(flow, interaction))
 
 
 class TitleModal(discord.ui.Modal, title="募集タイトルを入力"):
@@ -202,44 +2589,60 @@ class TitleModal(discord.ui.Modal, title="募集タイトルを入力"):
         self.title_input = TextInput(label="募集タイトル", placeholder="例：気軽にどうぞ！", max_length=100)
         self.add_item(self.title_input)
 
+    @instrument_interaction("title_modal")
     async def on_submit(self, interaction: discord.Interaction):
         if interaction.user.id not in active_recruit_flows:
             await interaction.response.send_message("募集フローが見つかりませんでした。再度`!募集開始`コマンドを実行するか、募集開始ボタンを押してください。", ephemeral=True)
             return
         self.flow = active_recruit_flows[interaction.user.id]
+        touch_wizard_flow(interaction.user.id)
 
         self.flow.title = self.title_input.value
 
         try:
-            await interaction.response.send_message("タイトルを受け付けました。", ephemeral=True)
+            with trace_span("interaction.send_message"):
+                await interaction.response.send_message("タイトルを受け付けました。", ephemeral=True)
         except discord.errors.InteractionResponded:
             logging.info("Interaction already responded to in TitleModal on_submit.")
         except Exception as e:
-            logging.error(f"モーダル応答メッセージ送信中にエラー: {e}")
+            logging.error("モーダル応答メッセージ送信中にエラー: %s", e)
 
         try:
-            await self.original_interaction.edit_original_response(
-                content=f"タイトル入力が完了しました！ (`{self.flow.title}`)\n"
-                        f"募集を作成しています...\n"
-                        f"このメッセージはしばらくすると消えます。",
-                view=None
-            )
-            logging.info(f"タイトル入力完了メッセージを更新しました: '{self.flow.title}'")
+            with trace_span("interaction.edit_original_response"):
+                await self.original_interaction.edit_original_response(
+                    content=f"タイトル入力が完了しました！ (`{self.flow.title}`)\n"
+                            f"募集を作成しています...\n"
+                            f"このメッセージはしばらくすると消えます。",
+                    view=None
+                )
+            logging.info("タイトル入力完了メッセージを更新しました: '%s'", self.flow.title)
         except discord.errors.NotFound:
             logging.warning("元のインタラクションメッセージが見つからず、タイトル入力完了メッセージを更新できませんでした。")
         except Exception as e:
-            logging.error(f"タイトル入力完了メッセージ更新中にエラー: {e}")
+            logging.error("タイトル入力完了メッセージ更新中にエラー: %s", e)
 
+        # 投稿の段階に進んだ募集フローは放置期限の対象から外す
+        wizard_scheduler.cancel(interaction.user.id)
         bot.loop.create_task(create_vc_and_post_embed(self.original_interaction, self.flow))
 
 
+@traced("create_vc_and_post_embed")
 async def create_vc_and_post_embed(interaction: discord.Interaction, flow: RecruitFlow):
     """VCを作成し、募集Embedを投稿する"""
+    if is_draining():
+        # 入力の途中で停止処理が始まった募集は投稿しない
+        active_recruit_flows.pop(interaction.user.id, None)
+        try:
+            await interaction.followup.send(DRAINING_MESSAGE, ephemeral=True)
+        except discord.errors.NotFound:
+            pass
+        return
     guild = interaction.guild
-    category = guild.get_channel(VC_CATEGORY_ID)
+    config = guild_configs.get(guild.id)
+    category = config.category if config else None
 
     if not category:
-        logging.error(f"VCカテゴリID {VC_CATEGORY_ID} が見つかりません。")
+        logging.error("ギルド %s のVCカテゴリが見つかりません。", guild.id, extra={"guild_id": guild.id})
         try:
             await interaction.followup.send("VCカテゴリが見つかりませんでした。ボットの設定を確認してください。", ephemeral=True)
         except discord.errors.NotFound:
@@ -275,14 +2678,26 @@ async def create_vc_and_post_embed(interaction: discord.Interaction, flow: Recru
     # === VC名の変更ここまで ===
 
     try:
-        vc_channel = await guild.create_voice_channel(
-            name=new_vc_name, # ここを修正
-            overwrites=overwrites,
-            category=category
-        )
-        logging.info(f"VC '{vc_channel.name}' (ID: {vc_channel.id}) を作成しました。")
+        # 待機VCがあれば名前と権限を付け替えて使い、無ければ新規作成する
+        vc_channel = await get_vc_pool(category.id).acquire(new_vc_name, overwrites) if VC_POOL_SIZE > 0 else None
+        if vc_channel:
+            logging.info("待機VC (ID: %s) を '%s' として使用します。", vc_channel.id, new_vc_name, extra={"vc_id": vc_channel.id})
+        else:
+            vc_channel = await rest_scheduler.submit(
+                f"guild_channels:{guild.id}",
+                lambda: guild.create_voice_channel(
+                    name=new_vc_name, # ここを修正
+                    overwrites=overwrites,
+                    category=category
+                ),
+                priority=PRIORITY_INTERACTIVE,
+                idempotent=False
+            )
+            logging.info("VC '%s' (ID: %s) を作成しました。", vc_channel.name, vc_channel.id, extra={"vc_id": vc_channel.id})
+            if VC_POOL_SIZE > 0:
+                get_vc_pool(category.id).lease_created(vc_channel.id)
     except Exception as e:
-        logging.error(f"VCの作成に失敗しました: {e}")
+        logging.error("VCの作成に失敗しました: %s", e)
         try:
             await interaction.followup.send("VCの作成中にエラーが発生しました。時間を置いて再度お試しください。", ephemeral=True)
         except discord.errors.NotFound:
@@ -291,383 +2706,914 @@ async def create_vc_and_post_embed(interaction: discord.Interaction, flow: Recru
             del active_recruit_flows[interaction.user.id]
         return
 
-    flow.vc_channel = vc_channel
-    flow.participants.append(interaction.user)
+    flow.guild_id = guild.id
+    flow.vc_channel_id = vc_channel.id
+    flow.add_participant(interaction.user.id)
 
-    # メンションするロール
-    mentions = [f"<@&{r}>" for r in flow.roles]
+    # メンションするロール (RANK_ROLE_MENTIONS が無効なら /募集通知 の登録者にだけ知らせる)
+    mentions = [f"<@&{r}>" for r in flow.roles] if RANK_ROLE_MENTIONS else []
 
     # 募集Embedの作成
-    embed = discord.Embed(
-        title=flow.title,
-        description=(
-            f"**モード：** {flow.mode}\n"
-            f"**募集人数：** あと{flow.people_to_recruit}人 (募集主を含め合計{flow.total_party_size}名)\n"
-            f"**対象ランク：** {', '.join(mentions)}\n"
-            f"**参加VC：** {vc_channel.mention}\n"
-        ),
-        color=discord.Color.green()
-    )
-    # 現在の参加者リストの表示
-    embed.add_field(
-        name=f"現在の参加者 ({len(flow.participants)}/{flow.total_party_size})",
-        value=interaction.user.mention,
-        inline=False
-    )
+    embed = build_recruit_embed(flow)
 
-    view = ParticipantView(flow)
+    view = build_recruit_post_view(interaction.user.id)
 
     # 募集内容を投稿するチャンネルを取得
-    recruit_post_channel = guild.get_channel(RECRUIT_POST_CHANNEL_ID)
-    if not recruit_post_channel or not isinstance(recruit_post_channel, discord.TextChannel):
-        logging.error(f"募集投稿チャンネルID {RECRUIT_POST_CHANNEL_ID} が見つからないか、テキストチャンネルではありません。")
+    recruit_post_channel = config.post_channel
+    if not recruit_post_channel:
+        logging.error("ギルド %s の募集投稿チャンネルが見つからないか、テキストチャンネルではありません。", guild.id, extra={"guild_id": guild.id})
         try:
             await interaction.followup.send("募集投稿チャンネルが見つかりませんでした。ボットの設定を確認してください。", ephemeral=True)
         except discord.errors.NotFound:
             logging.error("募集投稿チャンネル見つからないエラーメッセージを送信できませんでした (Webhook Unknown)。")
         if vc_channel:
             try:
-                await vc_channel.delete()
+                await release_or_delete_vc(vc_channel)
             except Exception as vc_delete_e:
-                logging.error(f"チャンネルエラー時のVC削除に失敗: {vc_delete_e}")
+                logging.error("チャンネルエラー時のVC削除に失敗: %s", vc_delete_e)
         if interaction.user.id in active_recruit_flows:
             del active_recruit_flows[interaction.user.id]
         return
 
     try:
         # Embedメッセージの送信は指定された募集投稿チャンネルへ
-        message = await recruit_post_channel.send(content=" ".join(mentions), embed=embed, view=view)
-        flow.message = message
-        logging.info(f"募集Embedメッセージ (ID: {message.id}) をチャンネル {recruit_post_channel.name} に送信しました。")
-        # 募集主に完了メッセージを送信
-        await interaction.followup.send(f"募集が作成され、{recruit_post_channel.mention} に投稿されました！", ephemeral=True)
-
-    except discord.errors.NotFound as e:
-        logging.error(f"募集Embedの送信に失敗しました: {e} (Webhook Unknown)。チャンネルIDが正しいか確認してください。")
-        if vc_channel:
-            try:
-                await vc_channel.edit(name=f"❌エラーVC-{interaction.user.display_name}") 
-                logging.info(f"エラーのためVC名を '{vc_channel.name}' に変更しました。")
-                await interaction.followup.send("募集メッセージの送信に失敗しました。VCは作成されましたが、手動でご確認ください。", ephemeral=True)
-            except Exception as vc_edit_e:
-                logging.error(f"VC名変更に失敗しました: {vc_edit_e}")
-        if interaction.user.id in active_recruit_flows:
-            del active_recruit_flows[interaction.user.id]
-        return
+        message = await rest_scheduler.submit(
+            f"messages:{recruit_post_channel.id}",
+            lambda: recruit_post_channel.send(content=" ".join(mentions), embed=embed, view=view),
+            priority=PRIORITY_INTERACTIVE,
+            idempotent=False
+        )
     except Exception as e:
-        logging.error(f"募集Embedの送信中に予期せぬエラー: {e}")
-        if vc_channel:
-            try:
-                await vc_channel.edit(name=f"❌エラーVC-{interaction.user.display_name}") 
-                logging.info(f"エラーのためVC名を '{vc_channel.name}' に変更しました。")
-                await interaction.followup.send("募集メッセージの送信中にエラーが発生しました。VCは作成されましたが、手動でご確認ください。", ephemeral=True)
-            except Exception as vc_edit_e:
-                logging.error(f"VC名変更に失敗しました: {vc_edit_e}")
-        if interaction.user.id in active_recruit_flows:
-            del active_recruit_flows[interaction.user.id]
+        # 投稿できなかった募集はどこにも登録していないので、VCを返却してフローを破棄するだけでよい
+        if isinstance(e, discord.errors.NotFound):
+            logging.error("募集Embedの送信に失敗しました: %s (Webhook Unknown)。チャンネルIDが正しいか確認してください。", e, extra={"guild_id": guild.id})
+        else:
+            logging.error("募集Embedの送信中に予期せぬエラー: %s", e, extra={"guild_id": guild.id})
+        try:
+            await release_or_delete_vc(vc_channel)
+        except Exception as vc_delete_e:
+            logging.error("募集Embedの送信エラー時のVC返却に失敗: %s", vc_delete_e, extra={"vc_id": vc_channel.id})
+        active_recruit_flows.pop(interaction.user.id, None)
+        try:
+            await interaction.followup.send("募集メッセージの送信に失敗しました。時間を置いて再度お試しください。", ephemeral=True)
+        except discord.HTTPException:
+            logging.error("募集Embedの送信エラーを募集主に通知できませんでした。")
         return
 
-    flow.vc_check_task = bot.loop.create_task(monitor_vc_for_empty(flow))
-    logging.info(f"VC監視タスクをVC ID {flow.vc_channel.id} に対して起動しました。")
+    flow.message_channel_id = message.channel.id
+    flow.message_id = message.id
+    recruit_store.save_flow(interaction.user.id, flow)
+    recruit_index.add(interaction.user.id, flow)
+    recruits_created_total.inc()
+    recruit_journal.record(JOURNAL_CREATE, interaction.user.id, flow)
+    notification_fanout.publish(interaction.user.id, flow)
+    track_recruit_vc(vc_channel, interaction.user.id)
+    logging.info("募集Embedメッセージ (ID: %s) をチャンネル %s に送信しました。", message.id, recruit_post_channel.name, extra={"recruiter_id": interaction.user.id, "vc_id": vc_channel.id})
+
+    # 募集は投稿済みで有効なので、完了メッセージが送れなくても募集はそのまま残す
+    try:
+        await interaction.followup.send(f"募集が作成され、{recruit_post_channel.mention} に投稿されました！", ephemeral=True)
+    except discord.HTTPException as e:
+        logging.error("募集作成の完了メッセージを送信できませんでした: %s", e, extra={"recruiter_id": interaction.user.id})
 
 
-class ParticipantView(View):
-    """参加ボタン、離脱ボタン、募集停止ボタンを含むView"""
-    def __init__(self, flow: RecruitFlow):
-        super().__init__(timeout=None)
-        self.flow = flow
+def build_recruit_embed(flow: RecruitFlow) -> discord.Embed:
+    """募集フローの現在の状態から募集Embedを組み立てる"""
+    remaining_slots = max(0, flow.total_party_size - flow.participant_count)
+
+    embed = discord.Embed(
+        title=flow.title,
+        description=(
+            f"**モード：** {flow.mode}\n"
+            f"**募集人数：** あと{remaining_slots}人 (募集主を含め合計{flow.total_party_size}名)\n"
+            f"**対象ランク：** {', '.join([f'<@&{r}>' for r in flow.roles])}\n"
+            f"**参加VC：** {f'<#{flow.vc_channel_id}>' if flow.vc_channel_id else 'なし'}\n"
+        ),
+        color=discord.Color.green()
+    )
+    # 現在の参加者リストの表示
+    embed.add_field(
+        name=f"現在の参加者 ({flow.participant_count}/{flow.total_party_size})",
+        value="\n".join([f"<@{user_id}>" for user_id in flow.participant_ids]) or "現在参加者はいません。",
+        inline=False
+    )
+    return embed
 
-    async def update_embed(self):
-        """Embedの参加者情報を更新するヘルパー関数"""
-        if not self.flow.message:
-            logging.warning("募集メッセージが見つからないためEmbedを更新できません。")
-            return
 
-        if self.flow.participants and self.flow.participants[0].id in active_recruit_flows:
-            self.flow = active_recruit_flows[self.flow.participants[0].id]
+class CoalescingEmbedUpdater:
+    """
+    メッセージごとに編集要求をまとめ、最新の状態だけを interval 秒に1回まで反映するアップデータ。
+    要求元は request() が返すFutureを待つことで、自分の変更が反映されたことを確認できる。
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        # キー: メッセージID, 値: [最新の描画関数, 反映待ちのFutureリスト]
+        self._pending = {}
+        self._tasks = {}
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def request(self, message_id: int, render) -> asyncio.Future:
+        """
+        render は最新の状態でメッセージを編集するコルーチン関数。
+        同じメッセージへの未反映の要求があれば、それとまとめて1回の編集にする。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = self._pending.setdefault(message_id, [None, []])
+        entry[0] = render
+        entry[1].append(future)
+        if message_id not in self._tasks:
+            self._tasks[message_id] = loop.create_task(self._flush_loop(message_id))
+        return future
+
+    def discard(self, message_id: int):
+        """
+        メッセージへの未反映の要求と編集タスクを取り消す (募集終了時に、終了表示を古い描画で上書きしないため)。
+        取り消した要求を待っている呼び出し元には反映済みとして完了を通知する。
+        """
+        entry = self._pending.pop(message_id, None)
+        if entry is not None:
+            for waiter in entry[1]:
+                if not waiter.done():
+                    waiter.set_result(None)
+        task = self._tasks.pop(message_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _flush_loop(self, message_id: int):
+        last_edit = 0.0
+        try:
+            while True:
+                wait = last_edit + self.interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                entry = self._pending.pop(message_id, None)
+                if entry is None:
+                    break  # 直前の編集から interval 秒の間に新しい要求が無ければ終了
+                render, waiters = entry
+
+                try:
+                    await render()
+                except asyncio.CancelledError:
+                    # discard() で取り消された編集を待っている呼び出し元も待たせたままにしない
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+                    raise
+                except discord.RateLimited as e:
+                    # レート制限中は要求を戻し、後から来た要求とまとめて再送する
+                    logging.warning("募集Embed (ID: %s) の編集がレート制限されました。%.1f秒後に再送します。", message_id, e.retry_after)
+                    pending = self._pending.setdefault(message_id, [render, []])
+                    pending[1][:0] = waiters
+                    last_edit = time.monotonic() + e.retry_after - self.interval
+                    continue
+                except Exception as e:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                else:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+                last_edit = time.monotonic()
+        finally:
+            self._tasks.pop(message_id, None)
+
+
+# 募集Embedの編集をまとめるアップデータ
+embed_updater = CoalescingEmbedUpdater(EMBED_UPDATE_INTERVAL)
+
+
+class VcPermissionBatcher:
+    """
+    VCごとに権限の変更を window 秒だけ溜め、現在の権限と統合した overwrites で channel.edit を1回だけ呼ぶ。
+    まとめた書き込みに失敗した場合は、対象ごとの set_permissions に切り替えて1件ずつ反映する。
+    update() が返すFutureは書き込みが確定してから完了する (取り消された場合は False)。
+    """
+    def __init__(self, window: float):
+        self.window = window
+        # キー: VC ID, 値: {対象ID: [対象, PermissionOverwrite, 待っているFutureのリスト]}
+        self._pending = {}
+        self._channels = {}
+        # キー: VC ID, 値: {対象ID: (対象, PermissionOverwrite)}
+        # 書き込み済みだが、ゲートウェイ経由でキャッシュに反映される前かもしれない権限
+        self._written = {}
+        self._tasks = {}
+
+    def update(self, channel: discord.VoiceChannel, target, overwrite: discord.PermissionOverwrite) -> asyncio.Future:
+        """target の権限を overwrite に変更する。同じ対象への未反映の変更は新しいものに置き換わる"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(channel.id, {})
+        entry = pending.get(target.id)
+        if entry is None:
+            pending[target.id] = [target, overwrite, [future]]
         else:
-            logging.warning("募集フローが見つからないためEmbedを更新できません。")
+            entry[1] = overwrite
+            entry[2].append(future)
+        self._channels[channel.id] = channel
+        task = self._tasks.get(channel.id)
+        if task is None or task.done():
+            self._tasks[channel.id] = loop.create_task(self._flush_loop(channel.id))
+        return future
+
+    def forget(self, vc_id: int):
+        """募集が終わったVCの未反映の変更を取り消し、記録を消す (プールに戻したVCに権限が残らないようにする)"""
+        task = self._tasks.pop(vc_id, None)
+        if task is not None:
+            task.cancel()
+        for _, _, futures in self._pending.pop(vc_id, {}).values():
+            self._resolve(futures, False)
+        self._channels.pop(vc_id, None)
+        self._written.pop(vc_id, None)
+
+    @staticmethod
+    def _resolve(futures: list, result=None, error: Exception = None):
+        for future in futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _flush_loop(self, vc_id: int):
+        while self._pending.get(vc_id):
+            await asyncio.sleep(self.window)
+            batch = self._pending.pop(vc_id, {})
+            channel = self._channels.get(vc_id)
+            if batch and channel is not None:
+                try:
+                    await self._write(channel, batch)
+                except asyncio.CancelledError:
+                    # forget() で取り消された書き込みを待っている呼び出し元には False を返す
+                    for _, _, futures in batch.values():
+                        self._resolve(futures, False)
+                    raise
+        self._channels.pop(vc_id, None)
+
+    async def _write(self, channel: discord.VoiceChannel, batch: dict):
+        overwrites = {target.id: (target, overwrite) for target, overwrite in channel.overwrites.items()}
+        overwrites.update(self._written.get(channel.id, {}))
+        for target_id, (target, overwrite, _) in batch.items():
+            overwrites[target_id] = (target, overwrite)
+        merged = dict(overwrites.values())
+        try:
+            await rest_scheduler.submit(f"channel:{channel.id}", lambda: channel.edit(overwrites=merged), priority=PRIORITY_INTERACTIVE)
+        except Exception as e:
+            logging.warning("VC (ID: %s) の権限 %s件のまとめた書き込みに失敗しました。1件ずつ書き込みます: %s", channel.id, len(batch), e)
+            vc_permission_writes_total.inc("batch_failed")
+            await asyncio.gather(*(self._write_one(channel, target_id, *entry) for target_id, entry in batch.items()))
             return
 
-        embed = self.flow.message.embeds[0]
+        vc_permission_writes_total.inc("batch")
+        written = self._written.setdefault(channel.id, {})
+        for target_id, (target, overwrite, futures) in batch.items():
+            written[target_id] = (target, overwrite)
+            self._resolve(futures, True)
 
-        current_participants_text = "\n".join([member.mention for member in self.flow.participants])
-        if not current_participants_text:
-            current_participants_text = "現在参加者はいません。"
+    async def _write_one(self, channel: discord.VoiceChannel, target_id: int, target, overwrite, futures: list):
+        try:
+            await rest_scheduler.submit(f"channel:{channel.id}", lambda: channel.set_permissions(target, overwrite=overwrite), priority=PRIORITY_INTERACTIVE)
+        except Exception as e:
+            vc_permission_writes_total.inc("single_failed")
+            self._resolve(futures, error=e)
+            return
+        vc_permission_writes_total.inc("single")
+        self._written.setdefault(channel.id, {})[target_id] = (target, overwrite)
+        self._resolve(futures, True)
 
-        embed.set_field_at(
-            index=0, 
-            name=f"現在の参加者 ({len(self.flow.participants)}/{self.flow.total_party_size})",
-            value=current_participants_text,
-            inline=False
-        )
 
-        remaining_slots = self.flow.total_party_size - len(self.flow.participants)
-        remaining_slots = max(0, remaining_slots) 
+# 募集VCの権限の変更をまとめる
+vc_permission_batcher = VcPermissionBatcher(VC_PERMISSION_BATCH_WINDOW)
 
-        embed.description = (
-            f"**モード：** {self.flow.mode}\n"
-            f"**募集人数：** あと{remaining_slots}人 (募集主を含め合計{self.flow.total_party_size}名)\n"
-            f"**対象ランク：：** {', '.join([f'<@&{r}>' for r in self.flow.roles])}\n"
-            f"**参加VC：：** {self.flow.vc_channel.mention}\n"
-        )
 
-        if len(self.flow.participants) >= self.flow.total_party_size:
-            # 参加ボタンを無効化
-            for item in self.children:
-                if isinstance(item, Button) and item.custom_id == "join_button":
-                    item.disabled = True
-                    break
-            logging.info(f"募集が満員になりました。参加ボタンを無効化。")
-        else:
-              # 参加ボタンを有効化
-            for item in self.children:
-                if isinstance(item, Button) and item.custom_id == "join_button":
-                    item.disabled = False
-                    break
+# 募集メッセージのボタン (custom_id の action, ラベル, スタイル)
+RECRUIT_POST_BUTTONS = (
+    ("join", "✅ 参加する", discord.ButtonStyle.primary),
+    ("leave", "❌ 離脱する", discord.ButtonStyle.danger),
+    ("stop", "🚫 募集停止", discord.ButtonStyle.red),
+)
 
-        await self.flow.message.edit(embed=embed, view=self)
 
+def build_recruit_post_view(recruiter_id: int, is_full: bool = False) -> View:
+    """
+    募集メッセージの参加・離脱・募集停止ボタンのViewを組み立てる (満員なら参加ボタンを無効化)。
+    ボタンは custom_id に募集主のIDを持つ DynamicItem なので、投稿後にViewを保持・再登録する必要はない。
+    """
+    view = View(timeout=None)
+    for action, label, style in RECRUIT_POST_BUTTONS:
+        view.add_item(RecruitPostButton(action, recruiter_id, disabled=(action == "join" and is_full)))
+    return view
 
-    @discord.ui.button(label="✅ 参加する", style=discord.ButtonStyle.primary, custom_id="join_button")
-    async def join(self, interaction: discord.Interaction, button: Button):
-        recruiter_id = self.flow.participants[0].id if self.flow.participants else None
 
-        if recruiter_id and recruiter_id in active_recruit_flows:
-            self.flow = active_recruit_flows[recruiter_id]
-        else:
-            await interaction.response.send_message("この募集はすでに終了したか、募集主が募集中ではありません。", ephemeral=True)
-            return
+@traced("update_embed")
+async def update_recruit_embed(flow: RecruitFlow):
+    """
+    Embedの参加者情報を更新するヘルパー関数。
+    短時間に重なった更新は embed_updater でまとめられ、最新の状態だけが1回の編集で反映される。
+    """
+    if not flow.message_id:
+        logging.warning("募集メッセージが見つからないためEmbedを更新できません。")
+        return
+    if flow.recruiter_id not in active_recruit_flows:
+        logging.warning("募集フローが見つからないためEmbedを更新できません。")
+        return
 
-        if interaction.user == self.flow.participants[0]:
-            await interaction.response.send_message("あなたは募集主です。参加ボタンを押す必要はありません。", ephemeral=True)
-            return
+    try:
+        await embed_updater.request(flow.message_id, functools.partial(render_recruit_message, flow))
+    except Exception as e:
+        logging.error("募集Embedの更新に失敗しました (メッセージID: %s): %s", flow.message_id, e, extra={"guild_id": flow.guild_id})
 
-        if interaction.user in self.flow.participants:
-            await interaction.response.send_message("すでに募集に参加しています。", ephemeral=True)
-            return
 
-        if len(self.flow.participants) >= self.flow.total_party_size:
-            await interaction.response.send_message("募集人数の上限に達しています。", ephemeral=True)
-            await self.update_embed() 
-            return
+async def render_recruit_message(flow: RecruitFlow):
+    """現在の募集フローの状態でEmbedとボタンを描画し、メッセージを編集する"""
+    message = flow.message
+    if not message:
+        return
+
+    is_full = flow.participant_count >= flow.total_party_size
+    if is_full:
+        logging.info("募集が満員になりました。参加ボタンを無効化。", extra={"recruiter_id": flow.recruiter_id})
+
+    embed = build_recruit_embed(flow)
+    view = build_recruit_post_view(flow.recruiter_id, is_full)
+    await rest_scheduler.submit(f"messages:{message.channel.id}", lambda: message.edit(embed=embed, view=view))
 
-        self.flow.participants.append(interaction.user)
-        logging.info(f"{interaction.user.display_name} が募集に参加しました。")
 
+class RecruitPostButton(discord.ui.DynamicItem[Button], template=r"recruit:(?P<action>join|leave|stop):(?P<recruiter_id>[0-9]+)"):
+    """
+    募集メッセージの参加・離脱・募集停止ボタン。
+    custom_id の募集主のIDから募集フローを直接引くため、メッセージごとのViewを持たず、再起動後もそのまま動作する。
+    """
+    def __init__(self, action: str, recruiter_id: int, disabled: bool = False):
+        label, style = next((label, style) for name, label, style in RECRUIT_POST_BUTTONS if name == action)
+        super().__init__(Button(label=label, style=style, custom_id=f"recruit:{action}:{recruiter_id}", disabled=disabled))
+        self.action = action
+        self.recruiter_id = recruiter_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(match["action"], int(match["recruiter_id"]))
+
+    async def callback(self, interaction: discord.Interaction):
+        log_token = bind_log_context(recruiter_id=self.recruiter_id)
         try:
-            vc_channel_check = bot.get_channel(self.flow.vc_channel.id)
-            if vc_channel_check:
-                await vc_channel_check.set_permissions(
-                    interaction.user,
-                    connect=True,
-                    view_channel=True,
-                    speak=True
-                )
-                logging.info(f"{interaction.user.display_name} にVC権限を付与しました。")
+            if self.action == "join":
+                await recruit_join(interaction, self.recruiter_id)
+            elif self.action == "leave":
+                await recruit_leave(interaction, self.recruiter_id)
             else:
-                logging.warning(f"VC ID {self.flow.vc_channel.id} が見つからないためVC権限を付与できませんでした。")
-                await interaction.response.send_message("VCが見つからないため、VC権限の付与に失敗しました。手動でVCに入ってください。", ephemeral=True)
-                await self.update_embed()
-                return
-        except Exception as e:
-            logging.error(f"VC権限付与に失敗しました: {e}")
-            await interaction.response.send_message("VC権限の付与中にエラーが発生しました。手動でVCに入ってください。", ephemeral=True)
+                await recruit_stop(interaction, self.recruiter_id)
+        finally:
+            log_context.reset(log_token)
 
-        await self.update_embed()
-        await interaction.response.send_message("募集に参加しました！", ephemeral=True)
 
-    @discord.ui.button(label="❌ 離脱する", style=discord.ButtonStyle.danger, custom_id="leave_button")
-    async def leave(self, interaction: discord.Interaction, button: Button):
-        recruiter_id = self.flow.participants[0].id if self.flow.participants else None
+class LegacyRecruitPostButton(discord.ui.DynamicItem[Button], template=r"(?P<action>join|leave|stop_recruit)_button"):
+    """
+    custom_id に募集主のIDを持たない旧形式のボタン (この形式に切り替える前に投稿された募集) を受け付ける。
+    募集主はメッセージIDから探す。
+    """
+    def __init__(self, item: Button, action: str):
+        super().__init__(item)
+        self.action = action
 
-        if recruiter_id and recruiter_id in active_recruit_flows:
-            self.flow = active_recruit_flows[recruiter_id]
-        else:
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(item, match["action"])
+
+    async def callback(self, interaction: discord.Interaction):
+        message_id = interaction.message.id if interaction.message else None
+        recruiter_id = next((recruiter_id for recruiter_id, flow in active_recruit_flows.items() if flow.message_id == message_id), None)
+        if recruiter_id is None:
             await interaction.response.send_message("この募集はすでに終了したか、募集主が募集中ではありません。", ephemeral=True)
             return
+        await RecruitPostButton("stop" if self.action == "stop_recruit" else self.action, recruiter_id).callback(interaction)
+
+
+@instrument_interaction("join")
+async def recruit_join(interaction: discord.Interaction, recruiter_id: int):
+    """参加ボタン"""
+    flow = await get_recruit_flow(recruiter_id)
+    if not flow:
+        await interaction.response.send_message("この募集はすでに終了したか、募集主が募集中ではありません。", ephemeral=True)
+        return
+
+    # 参加の可否が決まったらすぐに応答し、VC権限の付与とEmbedの更新は後から反映する
+    # 付与の失敗の通知はフォローアップで送るため、最初の応答を送り終えるまで待たせる (先に送るとフォローアップが失敗する)
+    responded = asyncio.Event()
+
+    async def notify(text: str):
+        await responded.wait()
+        await interaction.followup.send(text, ephemeral=True)
+
+    message = await join_recruit(recruiter_id, interaction.user, notify=notify)
+    try:
+        with trace_span("interaction.send_message"):
+            await interaction.response.send_message(message, ephemeral=True)
+    finally:
+        responded.set()
+
+
+@instrument_interaction("leave")
+async def recruit_leave(interaction: discord.Interaction, recruiter_id: int):
+    """離脱ボタン"""
+    flow = await get_recruit_flow(recruiter_id)
+    if not flow:
+        await interaction.response.send_message("この募集はすでに終了したか、募集主が募集中ではありません。", ephemeral=True)
+        return
+
+    if not flow.has_participant(interaction.user.id):
+        await interaction.response.send_message("募集に参加していません。", ephemeral=True)
+        return
+
+    if interaction.user.id == recruiter_id:
+        await interaction.response.send_message("募集主は募集を離脱できません。募集を停止するには「🚫 募集停止」ボタンを押すか、VCから退出してください。", ephemeral=True)
+        return
+
+    flow.remove_participant(interaction.user.id)
+    if recruiter_id in join_admissions:
+        join_admissions[recruiter_id].discard(interaction.user.id)
+    recruit_store.save_flow(recruiter_id, flow)
+    recruit_index.update(recruiter_id, flow)
+    recruit_journal.record(JOURNAL_LEAVE, recruiter_id, flow)
+    logging.info("%s が募集から離脱しました。", interaction.user.display_name, extra={"recruiter_id": recruiter_id})
+
+    # 離脱はメモリ上で確定しているので先に応答し、VC権限の剥奪とEmbedの更新は後から反映する
+    with trace_span("interaction.send_message"):
+        await interaction.response.send_message("募集から離脱しました。", ephemeral=True)
+    bot.loop.create_task(apply_leave_effects(interaction, recruiter_id, flow))
+
+
+async def apply_leave_effects(interaction: discord.Interaction, recruiter_id: int, flow: RecruitFlow):
+    """離脱した参加者のVC権限の剥奪と、募集Embedの更新を並行して反映する"""
+    await asyncio.gather(revoke_leaver_permissions(interaction, recruiter_id, flow), update_recruit_embed(flow))
+
+
+async def revoke_leaver_permissions(interaction: discord.Interaction, recruiter_id: int, flow: RecruitFlow):
+    member = interaction.user
+    try:
+        vc_channel_check = flow.vc_channel
+        if vc_channel_check:
+            await vc_permission_batcher.update(vc_channel_check, member, discord.PermissionOverwrite(connect=False, view_channel=False, speak=False))
+            logging.info("%s からVC権限を剥奪しました。", member.display_name, extra={"recruiter_id": recruiter_id, "vc_id": flow.vc_channel_id})
+        else:
+            logging.warning("VC ID %s が見つからないためVC権限を剥奪できませんでした。", flow.vc_channel_id, extra={"recruiter_id": recruiter_id})
+    except Exception as e:
+        logging.error("VC権限剥奪に失敗しました: %s", e, extra={"recruiter_id": recruiter_id, "vc_id": flow.vc_channel_id})
+        try:
+            if interaction.response.is_done():
+                await interaction.followup.send("VC権限の剥奪中にエラーが発生しました。", ephemeral=True)
+            else:
+                await interaction.response.send_message("VC権限の剥奪中にエラーが発生しました。", ephemeral=True)
+        except discord.HTTPException as notify_e:
+            logging.error("VC権限剥奪のエラーを通知できませんでした: %s", notify_e)
+
+
+@instrument_interaction("stop_recruit")
+async def recruit_stop(interaction: discord.Interaction, recruiter_id: int):
+    """募集停止ボタン"""
+    if not await get_recruit_flow(recruiter_id):
+        await interaction.response.send_message("この募集はすでに終了しているか、募集主が募集中ではありません。", ephemeral=True)
+        return
+
+    # 募集主のみが停止できる
+    if interaction.user.id != recruiter_id:
+        await interaction.response.send_message("募集を停止できるのは募集主のみです。", ephemeral=True)
+        return
+
+    with trace_span("interaction.send_message"):
+        await interaction.response.send_message("募集を停止しています...", ephemeral=True)
+    logging.info("募集主 %s が募集停止ボタンを押しました。", interaction.user.display_name, extra={"recruiter_id": interaction.user.id})
+
+    await end_recruit_flow(interaction.user.id) # ヘルパー関数を呼び出す
+    await interaction.followup.send("募集を停止し、関連リソースを削除しました。", ephemeral=True)
 
-        if interaction.user not in self.flow.participants:
-            await interaction.response.send_message("募集に参加していません。", ephemeral=True)
+
+class JoinAdmission:
+    """
+    募集1件分の参加受付キュー。参加要求は到着順にキューへ積み、1つのタスクが順番に取り出して
+    メモリ上の参加者リストだけで可否を決める (参加者は募集人数までなので判定は定数時間)。
+    判定と同時に参加者へ追加して結果を返すため、同時に何百回押されても募集人数を超えない。
+    VC権限の付与とEmbedの更新は判定から切り離し、受け付けた分をまとめて後から反映する。
+    """
+    def __init__(self, recruiter_id: int):
+        self.recruiter_id = recruiter_id
+        self._requests = asyncio.Queue()
+        # キー: メンバーID, 値: (discord.Member, 失敗時の通知関数)  VC権限の付与待ち
+        self._grants = {}
+        self._refresh = False
+        self._decider = None
+        self._effects = None
+
+    def submit(self, member: discord.Member, notify=None) -> asyncio.Future:
+        """参加要求をキューに積み、(参加できたか, 本人に伝えるメッセージ) を返すFutureを返す"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._requests.put_nowait((member, notify, future))
+        if self._decider is None or self._decider.done():
+            self._decider = loop.create_task(self._decide_pending())
+        return future
+
+    def discard(self, member_id: int):
+        """離脱したメンバーのVC権限の付与待ちを取り消す"""
+        self._grants.pop(member_id, None)
+
+    async def _decide_pending(self):
+        while not self._requests.empty():
+            member, notify, future = self._requests.get_nowait()
+            result = self._decide(member, notify)
+            if not future.done():
+                future.set_result(result)
+        if self._grants or self._refresh:
+            if self._effects is None or self._effects.done():
+                self._effects = asyncio.get_running_loop().create_task(self._apply_effects())
+
+    def _decide(self, member: discord.Member, notify) -> tuple:
+        flow = active_recruit_flows.get(self.recruiter_id)
+        if flow is None or flow.message_id is None:
+            return False, "この募集はすでに終了したか、募集主が募集中ではありません。"
+        if member.id == self.recruiter_id:
+            return False, "あなたは募集主です。参加ボタンを押す必要はありません。"
+        if flow.has_participant(member.id):
+            return False, "すでに募集に参加しています。"
+        if flow.participant_count >= flow.total_party_size:
+            self._refresh = True  # 参加ボタンが古い表示のまま押されている可能性があるので描画し直す
+            return False, "募集人数の上限に達しています。"
+
+        flow.add_participant(member.id)
+        recruit_store.save_flow(self.recruiter_id, flow)
+        recruit_index.update(self.recruiter_id, flow)
+        recruit_journal.record(JOURNAL_JOIN, self.recruiter_id, flow)
+        if flow.participant_count >= flow.total_party_size:
+            recruit_journal.record(JOURNAL_FULL, self.recruiter_id, flow)
+        self._grants[member.id] = (member, notify)
+        self._refresh = True
+        logging.info("%s が募集に参加しました。", member.display_name, extra={"recruiter_id": self.recruiter_id, "user_id": member.id})
+        return True, "募集に参加しました！VC権限を付与しています。付与が完了したらお知らせします。"
+
+    async def _apply_effects(self):
+        """受け付けた参加者へのVC権限の付与とEmbedの更新を、溜まった分ずつまとめて反映する"""
+        while self._grants or self._refresh:
+            grants, self._grants = self._grants, {}
+            self._refresh = False
+            flow = active_recruit_flows.get(self.recruiter_id)
+            if flow is None:
+                return
+            vc_channel = flow.vc_channel
+            effects = [self._grant(flow, vc_channel, member, notify) for member, notify in grants.values()]
+            if flow.message_id:
+                effects.append(update_recruit_embed(flow))
+            await asyncio.gather(*effects)
+
+    async def _grant(self, flow: RecruitFlow, vc_channel, member: discord.Member, notify):
+        if not flow.has_participant(member.id):
+            return  # 付与する前に離脱した
+        if not vc_channel:
+            logging.warning("VC ID %s が見つからないためVC権限を付与できませんでした。", flow.vc_channel_id, extra={"vc_id": flow.vc_channel_id})
+            await self._notify(notify, "VCが見つからないため、VC権限の付与に失敗しました。手動でVCに入ってください。")
             return
+        try:
+            applied = await vc_permission_batcher.update(vc_channel, member, discord.PermissionOverwrite(connect=True, view_channel=True, speak=True))
+        except Exception as e:
+            logging.error("VC権限付与に失敗しました: %s", e, extra={"recruiter_id": self.recruiter_id, "user_id": member.id, "vc_id": flow.vc_channel_id})
+            await self._notify(notify, "VC権限の付与中にエラーが発生しました。手動でVCに入ってください。")
+            return
+        if applied and flow.has_participant(member.id):
+            logging.info("%s にVC権限を付与しました。", member.display_name, extra={"recruiter_id": self.recruiter_id, "user_id": member.id, "vc_id": vc_channel.id})
+            await self._notify(notify, f"VC権限を付与しました。{vc_channel.mention} に接続できます。")
 
-        if interaction.user == self.flow.participants[0]:
-            await interaction.response.send_message("募集主は募集を離脱できません。募集を停止するには「🚫 募集停止」ボタンを押すか、VCから退出してください。", ephemeral=True)
+    @staticmethod
+    async def _notify(notify, message: str):
+        if notify is None:
             return
+        try:
+            await notify(message)
+        except Exception as e:
+            logging.error("参加者への通知に失敗しました: %s", e)
+
+
+# 募集ごとの参加受付キュー
+# キー: 募集主のユーザーID
+# 値: JoinAdmission インスタンス
+join_admissions = {}
+
+
+def get_join_admission(recruiter_id: int) -> JoinAdmission:
+    if recruiter_id not in join_admissions:
+        join_admissions[recruiter_id] = JoinAdmission(recruiter_id)
+    return join_admissions[recruiter_id]
+
+
+@traced("join_recruit")
+async def join_recruit(recruiter_id: int, member: discord.Member, notify=None) -> str:
+    """
+    メンバーを募集に参加させる共通の参加処理。参加ボタンとマッチングの両方から使う。
+    参加の可否が決まった時点で本人に伝える結果のメッセージを返し、VC権限の付与とEmbedの更新はその後に行われる。
+    付与に失敗した場合は notify (メッセージを受け取るコルーチン関数) で本人に伝える。
+    シャード構成で募集がこのプロセスの管理下に無い (担当外のギルドの募集) 場合は、古い参加者リストで判定しないよう参加を断る。
+    Discordはギルドのインタラクションをそのギルドを担当するシャードに届けるため、通常はシャードの割り当てが変わった直後にしか起きない。
+    """
+    if IS_SHARDED and recruiter_id not in active_recruit_flows:
+        logging.warning("担当外のギルドの募集への参加を断りました。", extra={"recruiter_id": recruiter_id, "user_id": member.id})
+        return "この募集は別のプロセスが担当しているため、ここでは参加を受け付けられません。しばらくしてからもう一度お試しください。"
+    _, message = await get_join_admission(recruiter_id).submit(member, notify)
+    return message
+
+
+def build_ended_embed(flow: RecruitFlow) -> discord.Embed:
+    """募集フローの最後の状態から「終了」表示のEmbedを組み立てる"""
+    embed = build_recruit_embed(flow)
+    embed.title = f"[終了] {embed.title}"
+    embed.color = discord.Color.dark_grey()
+    embed.description += "\n\n**この募集は終了しました。**"
+    return embed
+
+
+async def release_recruit_vc(vc_channel_id: int):
+    """終了処理の手順: 募集VCを待機プールに返却するか削除する"""
+    vc_channel = bot.get_channel(vc_channel_id)
+    if vc_channel:
+        await release_or_delete_vc(vc_channel)
+        return
+    # 既に削除されていたVCは、貸し出し元のプールの管理からも外す
+    for pool in vc_pools.values():
+        pool.forget(vc_channel_id)
+
 
-        self.flow.participants.remove(interaction.user)
-        logging.info(f"{interaction.user.display_name} が募集から離脱しました。")
+async def mark_recruit_ended(message: discord.PartialMessage, embed: discord.Embed):
+    """終了処理の手順: 募集メッセージを「終了」表示に編集し、ボタンを外す"""
+    try:
+        await rest_scheduler.submit(
+            f"messages:{message.channel.id}",
+            lambda: message.edit(embed=embed, view=None),
+            priority=PRIORITY_BACKGROUND
+        )
+    except discord.NotFound:
+        logging.warning("募集メッセージ ID %s が見つかりませんでした。", message.id)
+
+
+@traced("end_recruit_flow")
+async def end_recruit_flow(recruiter_id: int):
+    """
+    募集フローを終了させ、関連リソース（VC、メッセージ、タスク）をクリーンアップするヘルパー関数。
+    メモリ上の状態は先に同期的に片付け、VCの返却とメッセージの終了表示は並行して行う。
+    メッセージはキャッシュ済みのIDから組み立てた部分メッセージで編集するため、取得し直さない。
+    """
+    flow_to_end = active_recruit_flows.pop(recruiter_id, None)
+    if flow_to_end is None:
+        return
+
+    recruits_ended_total.inc()
+    if flow_to_end.message_id:
+        recruit_journal.record(JOURNAL_END, recruiter_id, flow_to_end)
+    wizard_scheduler.cancel(recruiter_id)
+    recruit_index.remove(recruiter_id)
+    join_admissions.pop(recruiter_id, None)
+    recruit_store.delete_flow(recruiter_id)
+    logging.info("募集主 %s のアクティブ募集をactive_recruit_flowsから削除しました。", recruiter_id, extra={"recruiter_id": recruiter_id, "guild_id": flow_to_end.guild_id})
+
+    # 後片付けの手順 (手順名, コルーチン)
+    steps = []
+    vc_channel_id = flow_to_end.vc_channel_id
+    if vc_channel_id:
+        untrack_recruit_vc(vc_channel_id)
+        vc_permission_batcher.forget(vc_channel_id)
+        logging.info("VC ID %s の空室監視を解除しました。", vc_channel_id, extra={"recruiter_id": recruiter_id, "vc_id": vc_channel_id})
+        steps.append(("vc", release_recruit_vc(vc_channel_id)))
+
+    message = flow_to_end.message
+    if flow_to_end.message_id:
+        embed_updater.discard(flow_to_end.message_id)
+        if message:
+            steps.append(("message", mark_recruit_ended(message, build_ended_embed(flow_to_end))))
+    flow_to_end.vc_channel_id = None
+    flow_to_end.message_id = None
+
+    if not steps:
+        return
+    results = await asyncio.gather(*(step for _, step in steps), return_exceptions=True)
+    for (name, _), result in zip(steps, results):
+        if isinstance(result, BaseException):
+            recruit_teardown_failures_total.inc(name)
+            logging.error("募集フロー終了中にエラーが発生しました（ID: %s, 手順: %s）: %s", recruiter_id, name, result, extra={"recruiter_id": recruiter_id})
+
+
+class DeadlineScheduler:
+    """
+    キーごとの期限を1つのヒープで管理し、期限を迎えたキーのコールバックを1つのタスクから発火させるスケジューラ。
+    期限の再設定・取り消しはヒープに積み直すだけで、古い要素は取り出し時に読み捨てる。
+    """
+    def __init__(self, name, callback):
+        self.name = name
+        self._callback = callback
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._firing = set()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, delay: float):
+        """key の期限を delay 秒後に設定する (既存の期限は上書き)"""
+        deadline = time.monotonic() + delay
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        if self._heap[0][0] == deadline:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        """key の期限を取り消す"""
+        if self._deadlines.pop(key, None) is not None and len(self._heap) > 2 * len(self._deadlines) + 64:
+            # 読み捨て待ちの要素が溜まりすぎたらヒープを作り直す
+            self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+            heapq.heapify(self._heap)
+
+    def start(self):
+        """スケジューラのタスクを起動する (起動済みなら何もしない)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logging.info("期限スケジューラ '%s' を起動しました。", self.name)
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    async def stop(self):
+        """スケジューラのタスクを停止する"""
+        if self.is_running():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            logging.info("期限スケジューラ '%s' を停止しました。", self.name)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) != deadline:
+                    continue
+                del self._deadlines[key]
+                task = asyncio.get_running_loop().create_task(self._fire(key))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, key):
+        try:
+            await self._callback(key)
+        except Exception as e:
+            logging.error("期限スケジューラ '%s' のコールバック実行中にエラー (キー: %s): %s", self.name, key, e)
+
+
+async def on_empty_vc_deadline(vc_id: int):
+    """VCが猶予時間を超えて空のままだった場合に募集を終了するコールバック"""
+    recruiter_id = vc_recruiters.get(vc_id)
+    if recruiter_id is None or vc_occupancy.get(vc_id):
+        return
+
+    if recruiter_id in active_recruit_flows:
+        logging.info("VC (ID: %s) が%s秒間空のままのため募集を終了します。", vc_id, EMPTY_VC_GRACE_PERIOD, extra={"vc_id": vc_id})
+        recruit_journal.record(JOURNAL_EMPTY_VC, recruiter_id, active_recruit_flows[recruiter_id])
+        await end_recruit_flow(recruiter_id)
+        return
 
+    # 募集フローが既に無い孤立VCはプールに返却するか削除する
+    untrack_recruit_vc(vc_id)
+    channel = bot.get_channel(vc_id)
+    if channel:
         try:
-            vc_channel_check = bot.get_channel(self.flow.vc_channel.id)
-            if vc_channel_check:
-                await vc_channel_check.set_permissions(
-                    interaction.user,
-                    connect=False,
-                    view_channel=False,
-                    speak=False
-                )
-                logging.info(f"{interaction.user.display_name} からVC権限を剥奪しました。")
-            else:
-                logging.warning(f"VC ID {self.flow.vc_channel.id} が見つからないためVC権限を剥奪できませんでした。")
+            await release_or_delete_vc(channel)
         except Exception as e:
-            logging.error(f"VC権限剥奪に失敗しました: {e}")
-            await interaction.response.send_message("VC権限の剥奪中にエラーが発生しました。", ephemeral=True)
-
-        await self.update_embed()
-        await interaction.response.send_message("募集から離脱しました。", ephemeral=True)
+            logging.error("孤立VC削除中にエラー: %s", e)
 
-    @discord.ui.button(label="🚫 募集停止", style=discord.ButtonStyle.red, custom_id="stop_recruit_button")
-    async def stop_recruit(self, interaction: discord.Interaction, button: Button):
-        recruiter_id = self.flow.participants[0].id if self.flow.participants else None
 
-        if not recruiter_id or recruiter_id not in active_recruit_flows:
-            await interaction.response.send_message("この募集はすでに終了しているか、募集主が募集中ではありません。", ephemeral=True)
-            return
+# 空になった募集VCの終了期限を管理するスケジューラ
+empty_vc_scheduler = DeadlineScheduler("empty_vc", on_empty_vc_deadline)
 
-        # 募集主のみが停止できる
-        if interaction.user.id != recruiter_id:
-            await interaction.response.send_message("募集を停止できるのは募集主のみです。", ephemeral=True)
-            return
 
-        await interaction.response.send_message("募集を停止しています...", ephemeral=True)
-        logging.info(f"募集主 {interaction.user.display_name} が募集停止ボタンを押しました。")
+async def on_wizard_deadline(recruiter_id: int):
+    """入力途中のまま WIZARD_IDLE_TTL 秒操作されなかった募集フローを破棄するコールバック"""
+    flow = active_recruit_flows.get(recruiter_id)
+    if flow is None or flow.message_id is not None:
+        return  # キャンセル済み、または投稿済み
+    del active_recruit_flows[recruiter_id]
+    wizard_evictions_total.inc()
+    logging.info("募集主 %s の募集フローが%s秒間入力されなかったため破棄しました。", recruiter_id, WIZARD_IDLE_TTL, extra={"recruiter_id": recruiter_id})
 
-        await end_recruit_flow(interaction.user.id) # ヘルパー関数を呼び出す
-        await interaction.followup.send("募集を停止し、関連リソースを削除しました。", ephemeral=True)
 
+# 入力途中の募集フローの放置期限を管理するスケジューラ
+wizard_scheduler = DeadlineScheduler("wizard", on_wizard_deadline)
 
-async def end_recruit_flow(recruiter_id: int):
-    """募集フローを終了させ、関連リソース（VC、メッセージ、タスク）をクリーンアップするヘルパー関数"""
-    if recruiter_id not in active_recruit_flows:
-        return 
 
-    flow_to_end = active_recruit_flows[recruiter_id]
+def touch_wizard_flow(recruiter_id: int):
+    """入力途中の募集フローの放置期限を延ばす (入力の各段階で呼ぶ)"""
+    wizard_scheduler.schedule(recruiter_id, WIZARD_IDLE_TTL)
 
-    try:
-        if flow_to_end.vc_check_task and not flow_to_end.vc_check_task.done():
-            flow_to_end.vc_check_task.cancel()
-            try:
-                await flow_to_end.vc_check_task
-            except asyncio.CancelledError:
-                pass
-            logging.info(f"VC監視タスク for VC ID {flow_to_end.vc_channel.id if flow_to_end.vc_channel else 'N/A'} を停止しました。")
 
-        if flow_to_end.vc_channel:
-            vc_channel_to_delete = bot.get_channel(flow_to_end.vc_channel.id)
-            if vc_channel_to_delete:
-                await vc_channel_to_delete.delete()
-                logging.info(f"VC {vc_channel_to_delete.name} (ID: {vc_channel_to_delete.id}) を削除しました。")
-            flow_to_end.vc_channel = None
+def set_vc_occupancy(vc_id: int, count: int):
+    """VCの在室人数を更新し、空なら終了期限を設定、誰かいれば期限を取り消す"""
+    count = max(0, count)
+    vc_occupancy[vc_id] = count
+    if count > 0:
+        empty_vc_scheduler.cancel(vc_id)
+    elif vc_id not in empty_vc_scheduler:
+        empty_vc_scheduler.schedule(vc_id, EMPTY_VC_GRACE_PERIOD)
+        logging.info("VC (ID: %s) が空です。%s秒後に募集を終了します。", vc_id, EMPTY_VC_GRACE_PERIOD, extra={"recruiter_id": vc_recruiters.get(vc_id), "vc_id": vc_id, "rate_limit": True})
 
-        if flow_to_end.message:
-            try:
-                message_to_edit = await flow_to_end.message.channel.fetch_message(flow_to_end.message.id)
-                embed = message_to_edit.embeds[0]
-                embed.title = f"[終了] {embed.title}"
-                embed.color = discord.Color.dark_grey()
-                embed.description += "\n\n**この募集は終了しました。**"
-                await message_to_edit.edit(embed=embed, view=None)
-            except discord.NotFound:
-                logging.warning(f"募集メッセージ ID {flow_to_end.message.id} が見つかりませんでした。")
-                pass
-            flow_to_end.message = None
 
-        del active_recruit_flows[recruiter_id]
-        logging.info(f"募集主 {recruiter_id} のアクティブ募集をactive_recruit_flowsから削除しました。")
+def track_recruit_vc(vc_channel: discord.VoiceChannel, recruiter_id: int):
+    """募集VCを空室監視の対象に登録する"""
+    vc_recruiters[vc_channel.id] = recruiter_id
+    set_vc_occupancy(vc_channel.id, len(vc_channel.voice_states))
 
-    except Exception as e:
-        logging.error(f"募集フロー終了中にエラーが発生しました（ID: {recruiter_id}）: {e}")
-        if recruiter_id in active_recruit_flows:
-            del active_recruit_flows[recruiter_id]
 
+def untrack_recruit_vc(vc_id: int):
+    """募集VCを空室監視の対象から外す"""
+    vc_recruiters.pop(vc_id, None)
+    vc_occupancy.pop(vc_id, None)
+    empty_vc_scheduler.cancel(vc_id)
 
-async def monitor_vc_for_empty(flow: RecruitFlow):
-    """特定のVCが空になったら削除するコルーチン"""
-    try:
-        while True:
-            channel = bot.get_channel(flow.vc_channel.id) if flow.vc_channel else None
-
-            if not channel:
-                logging.info(f"VC {flow.vc_channel.id if flow.vc_channel else 'N/A'} が見つかりません。監視を停止します。")
-                break
-
-            if not channel.members:
-                logging.info(f"VC {channel.name} (ID: {channel.id}) が空です。300秒後に再確認します。")
-                await asyncio.sleep(300)
-
-                channel = bot.get_channel(flow.vc_channel.id) if flow.vc_channel else None
-                if not channel or not channel.members:
-                    logging.info(f"VC {flow.vc_channel.name} (ID: {flow.vc_channel.id}) が引き続き空のため削除します。")
-
-                    if flow.participants and flow.participants[0].id in active_recruit_flows:
-                        await end_recruit_flow(flow.participants[0].id)
-                    else:
-                        try:
-                            await channel.delete()
-                            logging.info(f"孤立VC {channel.name} (ID: {channel.id}) を削除しました。")
-                        except Exception as e:
-                            logging.error(f"孤立VC削除中にエラー: {e}")
-
-                        if flow.message:
-                            try:
-                                message_to_edit = await flow.message.channel.fetch_message(flow.message.id)
-                                embed = message_to_edit.embeds[0]
-                                embed.title = f"[終了] {embed.title}"
-                                embed.color = discord.Color.red()
-                                embed.description += "\n\n**この募集はVCが空になったため終了しました。**"
-                                await message_to_edit.edit(embed=embed, view=None)
-                            except discord.NotFound:
-                                logging.warning(f"孤立募集メッセージ ID {flow.message.id} が見つかりませんでした。")
-                                pass
-                        break
 
-            await asyncio.sleep(30)
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    """募集VCへの入退室に合わせて在室人数を更新する"""
+    before_id = before.channel.id if before.channel else None
+    after_id = after.channel.id if after.channel else None
+    if before_id == after_id:
+        return  # ミュート切り替えなど、チャンネル移動を伴わない更新
 
-    except asyncio.CancelledError:
-        logging.info(f"VC監視タスク for VC {flow.vc_channel.name if flow.vc_channel else 'N/A'} (ID: {flow.vc_channel.id if flow.vc_channel else 'N/A'}) がキャンセルされました。")
-    except Exception as e:
-        logging.error(f"Error in monitor_vc_for_empty for VC {flow.vc_channel.id if flow.vc_channel else 'N/A'}: {e}")
+    if before_id in vc_recruiters:
+        set_vc_occupancy(before_id, vc_occupancy.get(before_id, 1) - 1)
+    if after_id in vc_recruiters:
+        set_vc_occupancy(after_id, vc_occupancy.get(after_id, 0) + 1)
 
 
 @bot.command()
 async def 募集開始(ctx):
     """募集フローを開始するための準備コマンド（募集開始ボタンを押すよう促す）"""
+    if is_draining():
+        await ctx.send(DRAINING_MESSAGE, ephemeral=True)
+        return
     if ctx.author.id in active_recruit_flows:
         await ctx.send("現在、あなたは募集フローを開始しています。前の募集を完了またはキャンセルしてください。", ephemeral=True)
         return
 
-    button_channel = bot.get_channel(RECRUIT_BUTTON_CHANNEL_ID)
-    if not button_channel:
-        await ctx.send(f"募集開始ボタンを設置するチャンネル (ID: {RECRUIT_BUTTON_CHANNEL_ID}) が見つかりません。ボットの設定を確認してください。", ephemeral=True)
+    config = guild_configs.get(ctx.guild.id) if ctx.guild else None
+    if not config:
+        await ctx.send("このサーバーの募集設定が見つかりません。ボットの設定を確認してください。", ephemeral=True)
         return
-    if not isinstance(button_channel, discord.TextChannel):
-        await ctx.send(f"募集開始ボタンを設置するチャンネル (ID: {RECRUIT_BUTTON_CHANNEL_ID}) はテキストチャンネルではありません。", ephemeral=True)
+    button_channel = config.button_channel
+    if not button_channel:
+        await ctx.send(f"募集開始ボタンを設置するチャンネル (ID: {config.recruit_button_channel_id}) が見つからないか、テキストチャンネルではありません。ボットの設定を確認してください。", ephemeral=True)
         return
 
     flow = RecruitFlow()
     active_recruit_flows[ctx.author.id] = flow
-    logging.info(f"募集主 {ctx.author.display_name} の新しい募集フロー (ID: {ctx.author.id}) をactive_recruit_flowsに登録しました。")
+    touch_wizard_flow(ctx.author.id)
+    logging.info("募集主 %s の新しい募集フロー (ID: %s) をactive_recruit_flowsに登録しました。", ctx.author.display_name, ctx.author.id)
 
     await ctx.send(f"募集を開始するには、{button_channel.mention} にある「📢 募集を開始」ボタンを押してください！", ephemeral=True)
 
 
 class RecruitButtonView(View):
-    """募集開始ボタンを含むView"""
+    """募集開始ボタンを含むView (永続View として登録し、メッセージを編集し直さなくてもボタンが動作し続ける)"""
     def __init__(self): 
-        super().__init__()
+        super().__init__(timeout=None)
 
     @discord.ui.button(label="📢 募集を開始", style=discord.ButtonStyle.success, custom_id="start_recruit_button")
+    @instrument_interaction("start_recruit")
     async def start(self, interaction: discord.Interaction, button: Button):
+        if is_draining():
+            await interaction.response.send_message(DRAINING_MESSAGE, ephemeral=True)
+            return
         if interaction.user.id in active_recruit_flows:
             await interaction.response.send_message("現在、あなたは募集フローを開始しています。前の募集を完了またはキャンセルしてください。", ephemeral=True)
             return
 
         flow = RecruitFlow()
         active_recruit_flows[interaction.user.id] = flow
-        logging.info(f"募集主 {interaction.user.display_name} の新しい募集フローをボタンから開始し、active_recruit_flowsに登録しました。")
+        touch_wizard_flow(interaction.user.id)
+        logging.info("募集主 %s の新しい募集フローをボタンから開始し、active_recruit_flowsに登録しました。", interaction.user.display_name)
 
-        await interaction.response.send_message("ゲームモードを選択してください：", view=ModeSelectView(flow), ephemeral=True)
+        await interaction.response.send_message("ゲームモードを選択してください：", view=build_wizard_view("mode", interaction.user.id), ephemeral=True)
 
 
 @bot.command()
@@ -678,7 +3624,7 @@ async def 募集キャンセル(ctx):
         return
 
     await ctx.send("進行中の募集をキャンセルしています...", ephemeral=True)
-    logging.info(f"募集主 {ctx.author.display_name} が募集キャンセルコマンドを実行しました。")
+    logging.info("募集主 %s が募集キャンセルコマンドを実行しました。", ctx.author.display_name)
 
     await end_recruit_flow(ctx.author.id) # ヘルパー関数を呼び出す
     await ctx.send("進行中の募集をキャンセルし、関連リソースを削除しました。", ephemeral=True)
@@ -694,16 +3640,542 @@ async def end_recruit(interaction: discord.Interaction):
         return
 
     await interaction.response.defer(ephemeral=True) 
-    logging.info(f"募集主 {interaction.user.display_name} がスラッシュコマンド /募集終了 を実行しました。")
+    logging.info("募集主 %s がスラッシュコマンド /募集終了 を実行しました。", interaction.user.display_name, extra={"recruiter_id": interaction.user.id})
 
     try:
         await end_recruit_flow(user_id)
         await interaction.followup.send("募集を終了し、関連リソースを削除しました。", ephemeral=True)
     except Exception as e:
-        logging.error(f"スラッシュコマンドでの募集終了中にエラーが発生しました（ユーザーID: {user_id}）: {e}")
+        logging.error("スラッシュコマンドでの募集終了中にエラーが発生しました（ユーザーID: %s）: %s", user_id, e, extra={"user_id": user_id})
         await interaction.followup.send("募集の終了中にエラーが発生しました。時間を置いて再度お試しください。", ephemeral=True)
 
 
+class MatchmakingQueue:
+    """
+    モードとランクを登録したプレイヤーを、空きのある募集に一括で割り当てるマッチングキュー。
+    マッチングは numpy で待機中のプレイヤーと募集中の全募集の適合度 (モード・ランク・空き枠) を一括で計算し、
+    登録の早いプレイヤーから順に、最もスコアの高い募集へ空き枠の範囲で割り当てる。
+    """
+    def __init__(self):
+        # キー: ユーザーID, 値: (ギルドID, モード番号, ランク番号, 登録時刻, discord.Interaction)
+        self._entries = {}
+        self.matched = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def add(self, interaction: discord.Interaction, mode: int, rank_index: int):
+        self._entries[interaction.user.id] = (interaction.guild.id, mode, rank_index, time.monotonic(), interaction)
+
+    def remove(self, user_id: int):
+        return self._entries.pop(user_id, None)
+
+    def pop_expired(self) -> list:
+        """MATCHMAKING_TIMEOUT を過ぎた登録を取り除いて返す"""
+        deadline = time.monotonic() - MATCHMAKING_TIMEOUT
+        expired = [user_id for user_id, entry in self._entries.items() if entry[3] < deadline]
+        return [self._entries.pop(user_id) for user_id in expired]
+
+    @staticmethod
+    def open_recruits():
+        """参加者を受け付けている募集を (募集主ID, フロー, ギルドID, モード番号, ランクのビットマスク, ランク指定の有無, 空き枠) の配列にする"""
+        recruiter_ids, flows, guild_ids, modes, masks, specific, free = [], [], [], [], [], [], []
+        for recruiter_id in recruit_index.with_free_slots():
+            flow = active_recruit_flows.get(recruiter_id)
+            if not flow or not flow.message_id or not flow.vc_channel_id or flow.mode not in MATCH_MODES:
+                continue
+            slots = flow.total_party_size - flow.participant_count
+            config = guild_configs.get(flow.guild_id)
+            if slots <= 0 or not config:
+                continue
+            mask = 0
+            everyone = False
+            for role_id in flow.roles:
+                index = config.rank_index.get(role_id)
+                if index == 0:
+                    mask = (1 << len(config.rank_role_ids)) - 1  # だれでもOK
+                    everyone = True
+                    break
+                if index is not None:
+                    mask |= 1 << index
+            recruiter_ids.append(recruiter_id)
+            flows.append(flow)
+            guild_ids.append(flow.guild_id)
+            modes.append(MATCH_MODES[flow.mode])
+            masks.append(mask)
+            specific.append(not everyone)
+            free.append(slots)
+        return (
+            recruiter_ids, flows,
+            np.array(guild_ids, dtype=np.int64), np.array(modes, dtype=np.int8),
+            np.array(masks, dtype=np.int64), np.array(specific, dtype=bool), np.array(free, dtype=np.int64),
+        )
+
+    @staticmethod
+    def assign(player_guilds, player_modes, player_ranks, player_order,
+               recruit_guilds, recruit_modes, recruit_masks, recruit_specific, recruit_free, excluded=None) -> np.ndarray:
+        """
+        プレイヤーごとに割り当てる募集の位置を返す (割り当てなしは -1)。
+        excluded 以外の引数は numpy 配列で、player_order は登録の早い順の順位。
+        excluded はプレイヤーの位置から、そのプレイヤーを割り当てない募集の位置の集合への辞書 (自分の募集・参加済みの募集)。
+        ギルド・モード・ランクが同じプレイヤーは条件が同じなので1つのグループにまとめ、
+        「グループ × 募集」のスコア行列を一度に計算してから、グループごとに空き枠を先着順に配る。
+        除外のあるプレイヤーがいるグループだけは1人ずつ配り、除外された枠は次のプレイヤーに回す。
+        """
+        excluded = excluded or {}
+        keys = np.stack([player_guilds, player_modes.astype(np.int64), player_ranks.astype(np.int64)], axis=1)
+        group_keys, group_of_player = np.unique(keys, axis=0, return_inverse=True)
+        group_of_player = group_of_player.reshape(-1)
+        group_bits = np.left_shift(np.int64(1), group_keys[:, 2])
+
+        valid = (
+            (group_keys[:, 0][:, None] == recruit_guilds[None, :])
+            & (group_keys[:, 1][:, None] == recruit_modes[None, :])
+            & ((group_bits[:, None] & recruit_masks[None, :]) != 0)
+        )
+        # 空き枠が少ない (早く埋まる) 募集と、ランクを絞っている募集を優先する
+        score = np.where(valid, (100 - recruit_free * 10 + np.where(recruit_specific, 5, 0))[None, :], -1)
+        recruit_preference = np.argsort(-score, axis=1, kind="stable")
+
+        # プレイヤーをグループごと・登録の早い順に並べる
+        players = np.lexsort((player_order, group_of_player))
+        group_start = np.searchsorted(group_of_player[players], np.arange(len(group_keys)))
+        group_end = np.r_[group_start[1:], len(players)]
+        # 一番早く登録したプレイヤーがいるグループから空き枠を配る
+        group_first = player_order[players[group_start]]
+
+        assigned = np.full(len(player_guilds), -1, dtype=np.int64)
+        free = recruit_free.copy()
+        for group in np.argsort(group_first, kind="stable"):
+            members = players[group_start[group]:group_end[group]]
+            targets = recruit_preference[group][:valid[group].sum()]
+            targets = targets[free[targets] > 0]
+            if not len(targets):
+                continue
+            if not any(int(member) in excluded for member in members):
+                slots = np.repeat(targets, free[targets])[:len(members)]
+                assigned[members[:len(slots)]] = slots
+                free -= np.bincount(slots, minlength=len(free))
+                continue
+            for member in members:
+                skip = excluded.get(int(member), ())
+                for target in targets:
+                    if free[target] > 0 and int(target) not in skip:
+                        assigned[member] = target
+                        free[target] -= 1
+                        break
+        return assigned
+
+    def run_pass(self) -> list:
+        """1回分のマッチングを行い、割り当てた (エントリ, 募集主ID, フロー) のリストを返す"""
+        if not self._entries:
+            return []
+        recruiter_ids, flows, recruit_guilds, recruit_modes, recruit_masks, recruit_specific, recruit_free = self.open_recruits()
+        if not flows:
+            return []
+
+        user_ids = list(self._entries.keys())
+        entries = list(self._entries.values())
+        player_guilds = np.fromiter((entry[0] for entry in entries), dtype=np.int64, count=len(entries))
+        player_modes = np.fromiter((entry[1] for entry in entries), dtype=np.int8, count=len(entries))
+        player_ranks = np.fromiter((entry[2] for entry in entries), dtype=np.int64, count=len(entries))
+        enqueued_at = np.fromiter((entry[3] for entry in entries), dtype=np.float64, count=len(entries))
+        player_order = np.argsort(np.argsort(enqueued_at, kind="stable"), kind="stable")
+
+        # 自分の募集と、すでに参加している募集には割り当てない
+        player_index = {user_id: i for i, user_id in enumerate(user_ids)}
+        excluded = {}
+        for position, (recruiter_id, flow) in enumerate(zip(recruiter_ids, flows)):
+            for member_id in (recruiter_id, *flow.participant_ids):
+                i = player_index.get(member_id)
+                if i is not None:
+                    excluded.setdefault(i, set()).add(position)
+
+        assigned = self.assign(
+            player_guilds, player_modes, player_ranks, player_order,
+            recruit_guilds, recruit_modes, recruit_masks, recruit_specific, recruit_free, excluded
+        )
+
+        matches = []
+        for i in np.flatnonzero(assigned >= 0):
+            target = assigned[i]
+            matches.append((self._entries.pop(user_ids[i]), recruiter_ids[target], flows[target]))
+        self.matched += len(matches)
+        return matches
+
+
+# マッチング待ちのプレイヤー
+matchmaking_queue = MatchmakingQueue()
+
+
+async def deliver_matches(recruiter_id: int, matches: list):
+    """同じ募集に割り当てたプレイヤーを、通常の参加処理で順番に参加させて結果を伝える"""
+    for entry, _, flow in matches:
+        interaction = entry[4]
+        if active_recruit_flows.get(recruiter_id) is not flow:
+            message = "マッチングした募集が終了していました。もう一度 /マッチング で登録してください。"
+        else:
+            result = await join_recruit(recruiter_id, interaction.user, notify=lambda text, interaction=interaction: interaction.followup.send(text, ephemeral=True))
+            message = f"マッチングしました！ 「{flow.title}」 (募集主: <@{recruiter_id}>)\n{result}"
+        try:
+            await interaction.followup.send(message, ephemeral=True)
+        except Exception as e:
+            logging.error("マッチング結果の通知に失敗しました (ユーザーID: %s): %s", interaction.user.id, e, extra={"user_id": interaction.user.id})
+
+
+@tasks.loop(seconds=MATCHMAKING_INTERVAL)
+async def run_matchmaking():
+    """マッチング待ちのプレイヤーを空きのある募集に一括で割り当てるタスク"""
+    for entry in matchmaking_queue.pop_expired():
+        try:
+            await entry[4].followup.send("条件に合う募集が見つからなかったため、マッチング待ちを終了しました。", ephemeral=True)
+        except Exception as e:
+            logging.error("マッチング期限切れの通知に失敗しました: %s", e)
+
+    started = time.perf_counter()
+    queued = len(matchmaking_queue)
+    matches = matchmaking_queue.run_pass()
+    if not matches:
+        return
+    logging.info("マッチング: 待機 %s人中 %s人を割り当てました (%.1fms)。", queued, len(matches), (time.perf_counter() - started) * 1000)
+
+    by_recruit = {}
+    for match in matches:
+        by_recruit.setdefault(match[1], []).append(match)
+    for recruiter_id, recruit_matches in by_recruit.items():
+        bot.loop.create_task(deliver_matches(recruiter_id, recruit_matches))
+
+
+async def rank_autocomplete(interaction: discord.Interaction, current: str):
+    config = guild_configs.get(interaction.guild.id) if interaction.guild else None
+    if not config:
+        return []
+    return [
+        app_commands.Choice(name=role.name, value=str(role.id))
+        for role in config.rank_roles if current in role.name
+    ][:25]
+
+
+@bot.tree.command(name="マッチング", description="モードとランクを登録して、条件に合う募集に自動で参加します。")
+@app_commands.describe(モード="プレイしたいゲームモード", ランク="あなたのランク")
+@app_commands.choices(モード=[
+    app_commands.Choice(name="コンペティティブ", value="コンペ"),
+    app_commands.Choice(name="アンレート", value="アンレート"),
+])
+@app_commands.autocomplete(ランク=rank_autocomplete)
+async def matchmaking(interaction: discord.Interaction, モード: app_commands.Choice[str], ランク: str):
+    """
+    スラッシュコマンド: マッチング待ちに登録する
+    """
+    config = guild_configs.get(interaction.guild.id) if interaction.guild else None
+    if not config:
+        await interaction.response.send_message("このサーバーの募集設定が見つかりません。", ephemeral=True)
+        return
+    if interaction.user.id in active_recruit_flows:
+        await interaction.response.send_message("募集主はマッチングを利用できません。", ephemeral=True)
+        return
+    rank_index = config.rank_index.get(int(ランク)) if ランク.isdigit() else None
+    if rank_index is None:
+        await interaction.response.send_message("ランクは候補の中から選んでください。", ephemeral=True)
+        return
+
+    matchmaking_queue.add(interaction, MATCH_MODES[モード.value], rank_index)
+    logging.info("%s がマッチング待ちに登録しました (モード: %s)。", interaction.user.display_name, モード.value)
+    await interaction.response.send_message(
+        f"マッチング待ちに登録しました。条件に合う募集が見つかると自動で参加します。(待機中: {len(matchmaking_queue)}人)",
+        ephemeral=True
+    )
+
+
+@bot.tree.command(name="マッチング取消", description="マッチング待ちを取り消します。")
+async def cancel_matchmaking(interaction: discord.Interaction):
+    """
+    スラッシュコマンド: マッチング待ちを取り消す
+    """
+    if matchmaking_queue.remove(interaction.user.id) is None:
+        await interaction.response.send_message("マッチング待ちに登録されていません。", ephemeral=True)
+        return
+    await interaction.response.send_message("マッチング待ちを取り消しました。", ephemeral=True)
+
+
+class RecruitListView(View):
+    """/募集一覧 の結果と「次のページ」ボタンを含むView"""
+    def __init__(self, guild_id: int, mode, rank_role_ids, min_slots: int):
+        super().__init__()
+        self.guild_id = guild_id
+        self.mode = mode
+        self.rank_role_ids = rank_role_ids
+        self.min_slots = min_slots
+        self.cursor = None
+
+    def build_page(self, before=None) -> discord.Embed:
+        started = time.perf_counter()
+        recruiter_ids, self.cursor = recruit_index.query(self.guild_id, self.mode, self.rank_role_ids, self.min_slots, before)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        embed = discord.Embed(title="募集一覧", color=discord.Color.green())
+        for recruiter_id in recruiter_ids:
+            flow = active_recruit_flows.get(recruiter_id)
+            if not flow or not flow.message_id:
+                continue
+            remaining = max(0, flow.total_party_size - flow.participant_count)
+            embed.add_field(
+                name=flow.title or "(タイトルなし)",
+                value=(
+                    f"**モード：** {flow.mode} / **あと{remaining}人** ({flow.participant_count}/{flow.total_party_size})\n"
+                    f"**対象ランク：** {', '.join([f'<@&{r}>' for r in flow.roles])}\n"
+                    f"{flow.jump_url}"
+                ),
+                inline=False
+            )
+        if not embed.fields:
+            embed.description = "条件に合う募集はありません。"
+        embed.set_footer(text=f"検索時間: {elapsed_ms:.2f}ms")
+        return embed
+
+    @discord.ui.button(label="次のページ ▶", style=discord.ButtonStyle.secondary)
+    @instrument_interaction("recruit_list_next")
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        if self.cursor is None:
+            await interaction.response.send_message("これ以上の募集はありません。", ephemeral=True)
+            return
+        embed = self.build_page(self.cursor)
+        button.disabled = self.cursor is None
+        await interaction.response.edit_message(embed=embed, view=self)
+
+
+@bot.tree.command(name="募集一覧", description="条件に合う参加受付中の募集を表示します。")
+@app_commands.describe(モード="ゲームモードで絞り込む", ランク="対象ランクで絞り込む", 空き枠="残り枠がこの数以上の募集だけを表示する")
+@app_commands.choices(モード=[
+    app_commands.Choice(name="コンペティティブ", value="コンペ"),
+    app_commands.Choice(name="アンレート", value="アンレート"),
+])
+@app_commands.autocomplete(ランク=rank_autocomplete)
+async def list_recruits(interaction: discord.Interaction, モード: app_commands.Choice[str] = None, ランク: str = None, 空き枠: app_commands.Range[int, 1, 4] = 1):
+    """
+    スラッシュコマンド: 参加受付中の募集をインデックスから検索して表示する
+    """
+    if not interaction.guild:
+        await interaction.response.send_message("サーバー内で実行してください。", ephemeral=True)
+        return
+
+    rank_role_ids = None
+    if ランク:
+        if not ランク.isdigit():
+            await interaction.response.send_message("ランクは候補の中から選んでください。", ephemeral=True)
+            return
+        rank_role_ids = {int(ランク)}
+        # 「だれでもOK」の募集も対象に含める
+        config = guild_configs.get(interaction.guild.id)
+        if config and config.rank_role_ids:
+            rank_role_ids.add(config.rank_role_ids[0])
+
+    view = RecruitListView(interaction.guild.id, モード.value if モード else None, rank_role_ids, 空き枠)
+    embed = view.build_page()
+    if view.cursor is None:
+        view.remove_item(view.next_page)
+    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+
+
+def compute_recruit_stats(records: np.ndarray, guild_id: int, since: float) -> dict:
+    """
+    ジャーナルのレコードから、作成された募集のモード・ランク・時間帯と、満員になった募集の満員までの時間を numpy で一括で取り出す。
+    満員のイベントは、募集主IDと時刻で並べたときの直前の同じ募集主の作成イベントに対応付ける。
+    """
+    in_range = (records["guild_id"] == guild_id) & (records["ts"] >= since)
+    event = records["event"]
+    # 満員までの時間は作成と満員のイベントだけで求まるため、それ以外の行は並べ替えない
+    rows = np.flatnonzero(in_range & ((event == JOURNAL_CREATE) | (event == JOURNAL_FULL)))
+    ts = records["ts"][rows]
+    recruiter = records["recruiter_id"][rows]
+    order = np.lexsort((ts, recruiter))
+    rows, ts, recruiter, event = rows[order], ts[order], recruiter[order], event[rows][order]
+
+    is_create = event == JOURNAL_CREATE
+    create_idx = np.maximum.accumulate(np.where(is_create, np.arange(len(rows)), -1)) if len(rows) else np.empty(0, dtype=np.int64)
+    belongs = create_idx >= 0
+    belongs[belongs] = recruiter[create_idx[belongs]] == recruiter[belongs]
+
+    # 募集ごとに最初の満員イベントまでの時間
+    full = belongs & ~is_create
+    filled_idx, first = np.unique(create_idx[full], return_index=True)
+    fill_seconds = ts[full][first] - ts[filled_idx]
+
+    created_rows = rows[is_create]
+    return {
+        "created_modes": records["mode"][created_rows],
+        "created_masks": records["rank_mask"][created_rows],
+        "created_hours": ((ts[is_create] + LOCAL_UTC_OFFSET_HOURS * 3600) // 3600 % 24).astype(np.int64),
+        "filled_modes": records["mode"][rows[filled_idx]],
+        "filled_masks": records["rank_mask"][rows[filled_idx]],
+        "fill_seconds": fill_seconds,
+        "events": int(np.count_nonzero(in_range)),
+    }
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}時間{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+
+def hourly_sparkline(counts: np.ndarray) -> str:
+    """24時間分の件数を、0時から順に8段階のブロック文字で表す"""
+    blocks = "▁▂▃▄▅▆▇█"
+    levels = np.ceil(counts / max(1, counts.max()) * (len(blocks) - 1)).astype(np.int64)
+    return "".join(blocks[level] for level in levels)
+
+
+@bot.tree.command(name="募集統計", description="募集が満員になるまでの時間や、募集が多い時間帯を表示します。")
+@app_commands.describe(期間="集計する日数", モード="ゲームモードで絞り込む", ランク="対象ランクで絞り込む")
+@app_commands.choices(モード=[
+    app_commands.Choice(name="コンペティティブ", value="コンペ"),
+    app_commands.Choice(name="アンレート", value="アンレート"),
+])
+@app_commands.autocomplete(ランク=rank_autocomplete)
+async def recruit_stats(interaction: discord.Interaction, 期間: app_commands.Range[int, 1, 365] = 30, モード: app_commands.Choice[str] = None, ランク: str = None):
+    """
+    スラッシュコマンド: 募集ジャーナルをメモリマップで読み込み、モード・ランクごとの満員までの時間と時間帯別の募集数を表示する
+    """
+    config = guild_configs.get(interaction.guild.id) if interaction.guild else None
+    if not config:
+        await interaction.response.send_message("このサーバーの募集設定が見つかりません。", ephemeral=True)
+        return
+    rank_index = None
+    if ランク:
+        rank_index = config.rank_index.get(int(ランク)) if ランク.isdigit() else None
+        if rank_index is None:
+            await interaction.response.send_message("ランクは候補の中から選んでください。", ephemeral=True)
+            return
+
+    await interaction.response.defer(ephemeral=True)
+    since = time.time() - 期間 * 86400
+    stats = await asyncio.to_thread(lambda: compute_recruit_stats(recruit_journal.load(), interaction.guild.id, since))
+
+    mode_names = {number: name for name, number in MATCH_MODES.items()}
+    rank_names = {config.rank_index[role.id]: role.name for role in config.rank_roles if role.id in config.rank_index}
+    modes = [MATCH_MODES[モード.value]] if モード else sorted(mode_names)
+    ranks = [rank_index] if rank_index is not None else sorted(rank_names)
+
+    embed = discord.Embed(
+        title=f"募集統計 (過去{期間}日)",
+        description=f"作成された募集: {len(stats['created_modes'])}件 / 満員になった募集: {len(stats['fill_seconds'])}件",
+        color=discord.Color.blue()
+    )
+    rank_filter = np.uint32(1 << rank_index) if rank_index is not None else None
+    for mode in modes:
+        lines = []
+        for rank in ranks:
+            bit = np.uint32(1 << rank)
+            created = int(np.count_nonzero((stats["created_modes"] == mode) & (stats["created_masks"] & bit != 0)))
+            if created == 0:
+                continue
+            fill = stats["fill_seconds"][(stats["filled_modes"] == mode) & (stats["filled_masks"] & bit != 0)]
+            if len(fill):
+                p50, p90 = np.percentile(fill, [50, 90])
+                lines.append(f"**{rank_names.get(rank, rank)}**: {created}件, 満員 {len(fill)}件 (中央値 {format_duration(p50)} / 90% {format_duration(p90)})")
+            else:
+                lines.append(f"**{rank_names.get(rank, rank)}**: {created}件, 満員 0件")
+        created = stats["created_modes"] == mode
+        if rank_filter is not None:
+            created &= stats["created_masks"] & rank_filter != 0
+        hourly = np.bincount(stats["created_hours"][created], minlength=24)
+        if hourly.any():
+            peak = int(hourly.argmax())
+            lines.append(f"時間帯 (0時→23時): `{hourly_sparkline(hourly)}` ピーク {peak}時台 ({int(hourly[peak])}件)")
+        embed.add_field(name=mode_names.get(mode, str(mode)), value="\n".join(lines) or "データがありません。", inline=False)
+    embed.set_footer(text=f"集計したイベント: {stats['events']}件")
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+@bot.tree.command(name="募集通知", description="条件に合う募集が投稿されたときにDMかスレッドで知らせます。")
+@app_commands.describe(
+    モード="通知するゲームモード (省略するとすべて)",
+    ランク="通知する対象ランク (省略するとすべて。「だれでもOK」の募集はいつも通知します)",
+    通知方法="DMで受け取るか、募集メッセージのスレッドでメンションを受け取るか",
+    通知しない開始="この時刻から通知しない (0〜23時)",
+    通知しない終了="この時刻まで通知しない (0〜23時)",
+)
+@app_commands.choices(
+    モード=[
+        app_commands.Choice(name="コンペティティブ", value="コンペ"),
+        app_commands.Choice(name="アンレート", value="アンレート"),
+    ],
+    通知方法=[
+        app_commands.Choice(name="DM", value="dm"),
+        app_commands.Choice(name="スレッド", value="thread"),
+    ],
+)
+@app_commands.autocomplete(ランク=rank_autocomplete)
+async def subscribe_recruits(
+    interaction: discord.Interaction,
+    モード: app_commands.Choice[str] = None,
+    ランク: str = None,
+    通知方法: app_commands.Choice[str] = None,
+    通知しない開始: app_commands.Range[int, 0, 23] = None,
+    通知しない終了: app_commands.Range[int, 0, 23] = None,
+):
+    """
+    スラッシュコマンド: 募集通知を登録する (登録済みなら条件を置き換える)
+    """
+    config = guild_configs.get(interaction.guild.id) if interaction.guild else None
+    if not config:
+        await interaction.response.send_message("このサーバーの募集設定が見つかりません。", ephemeral=True)
+        return
+    rank_mask = 0
+    if ランク:
+        rank_index = config.rank_index.get(int(ランク)) if ランク.isdigit() else None
+        if rank_index is None or rank_index >= 32:
+            await interaction.response.send_message("ランクは候補の中から選んでください。", ephemeral=True)
+            return
+        rank_mask = 1 << rank_index
+    if (通知しない開始 is None) != (通知しない終了 is None):
+        await interaction.response.send_message("通知しない時間帯は開始と終了の両方を指定してください。", ephemeral=True)
+        return
+
+    subscription = Subscription(
+        interaction.guild.id,
+        interaction.user.id,
+        1 << MATCH_MODES[モード.value] if モード else 0,
+        rank_mask,
+        通知方法.value if 通知方法 else "dm",
+        通知しない開始,
+        通知しない終了,
+    )
+    subscription_index.put(subscription)
+    recruit_store.save_subscription(subscription)
+    logging.info("ユーザー %s (ID: %s) が募集通知を登録しました。", interaction.user.display_name, interaction.user.id, extra={"user_id": interaction.user.id})
+
+    rank_name = next((role.name for role in config.rank_roles if ランク and role.id == int(ランク)), "すべて")
+    lines = [
+        f"モード: {モード.name if モード else 'すべて'}",
+        f"ランク: {rank_name}",
+        f"通知方法: {通知方法.name if 通知方法 else 'DM'}",
+    ]
+    if 通知しない開始 is not None:
+        lines.append(f"通知しない時間帯: {通知しない開始}時〜{通知しない終了}時")
+    await interaction.response.send_message("募集通知を登録しました。\n" + "\n".join(lines), ephemeral=True)
+
+
+@bot.tree.command(name="募集通知解除", description="募集通知の登録を解除します。")
+async def unsubscribe_recruits(interaction: discord.Interaction):
+    """
+    スラッシュコマンド: 募集通知の登録を解除する
+    """
+    if not interaction.guild or subscription_index.remove(interaction.guild.id, interaction.user.id) is None:
+        await interaction.response.send_message("募集通知は登録されていません。", ephemeral=True)
+        return
+    recruit_store.delete_subscription(interaction.guild.id, interaction.user.id)
+    logging.info("ユーザー %s (ID: %s) が募集通知を解除しました。", interaction.user.display_name, interaction.user.id, extra={"user_id": interaction.user.id})
+    await interaction.response.send_message("募集通知の登録を解除しました。", ephemeral=True)
+
+
 @bot.command()
 @commands.is_owner()
 async def 募集強制終了(ctx, user_id: int):
@@ -721,107 +4193,562 @@ async def 募集強制終了(ctx, user_id: int):
         return
 
     await ctx.send(f"ユーザー {target_user.display_name} (ID: {user_id}) の募集フローを強制終了します。", ephemeral=True)
-    logging.warning(f"管理者 {ctx.author.display_name} がユーザー {target_user.display_name} (ID: {user_id}) の募集フローを強制終了しました。")
+    logging.warning("管理者 %s がユーザー %s (ID: %s) の募集フローを強制終了しました。", ctx.author.display_name, target_user.display_name, user_id, extra={"user_id": user_id})
 
     await end_recruit_flow(user_id) # ヘルパー関数を呼び出す
     await ctx.send(f"ユーザー {target_user.display_name} の募集フローを強制終了し、関連リソースを削除しました。", ephemeral=True)
 
 
-@bot.command()
-@commands.is_owner()
-async def 停止(ctx):
-    """ボットをオフラインにするコマンド"""
-    logging.info(f"{ctx.author.display_name} がボット停止コマンドを実行しました。")
-    await ctx.send("🔴 Botをオフラインにします。")
+# 停止処理 (ドレイン) の状態。None なら稼働中、停止処理中はそのタスク
+drain_task = None
 
-    # 全てのアクティブな募集フローを終了させる
-    for recruiter_id in list(active_recruit_flows.keys()): 
-        await end_recruit_flow(recruiter_id)
-    logging.info("全ての募集フローとVC監視タスクを停止しました。")
+# 新しい募集を受け付けないときの返答
+DRAINING_MESSAGE = "Botは停止処理中のため、新しい募集は受け付けていません。しばらくしてから再度お試しください。"
 
-    # 新しく追加するステータス更新タスクも停止
-    if hasattr(bot, 'status_update_task') and bot.status_update_task.is_running():
-        bot.status_update_task.cancel()
-        try:
-            await bot.status_update_task
-        except asyncio.CancelledError:
-            pass
-        logging.info("ステータス更新タスクを停止しました。")
 
-    if bot.start_button_task.is_running():
-        bot.start_button_task.cancel()
+def is_draining() -> bool:
+    return drain_task is not None
+
+
+async def drain_recruit_flows(report=None):
+    """
+    全ての募集を DRAIN_CONCURRENCY 件ずつ並行して終了させる (DRAIN_HANDOFF の場合は終了させずに引き継ぐ)。
+    DRAIN_DEADLINE 秒を過ぎたら打ち切り、(終了させた数, 全体の数) を返す。
+    report が指定されていれば、DRAIN_PROGRESS_INTERVAL 秒ごとに進捗の文字列を渡して呼び出す。
+    """
+    recruiter_ids = list(active_recruit_flows.keys())
+    total = len(recruiter_ids)
+    if DRAIN_HANDOFF:
+        # 保存済みの状態を次のプロセスが restore_recruit_state で復元する
+        logging.info("募集 %s 件を終了させずに次のプロセスへ引き継ぎます。", total)
+        return 0, total
+
+    semaphore = asyncio.Semaphore(DRAIN_CONCURRENCY)
+    done = 0
+
+    async def end_one(recruiter_id: int):
+        nonlocal done
+        flow = active_recruit_flows.get(recruiter_id)
+        vc_channel_id = flow.vc_channel_id if flow else None
+        message_id = flow.message_id if flow else None
         try:
-            await bot.start_button_task
+            async with semaphore:
+                await end_recruit_flow(recruiter_id)
         except asyncio.CancelledError:
-            pass
-        logging.info("募集開始ボタン更新タスクを停止しました。")
+            # 期限で打ち切った募集は保存し直し、次回起動時に復元または片付けられるようにする
+            if flow is not None and flow.message_id is None and message_id:
+                flow.vc_channel_id, flow.message_id = vc_channel_id, message_id
+                recruit_store.save_flow(recruiter_id, flow)
+            raise
+        except Exception as e:
+            logging.error("停止処理中の募集終了に失敗しました（ID: %s）: %s", recruiter_id, e, extra={"recruiter_id": recruiter_id})
+        done += 1
 
+    async def report_progress():
+        while True:
+            await asyncio.sleep(DRAIN_PROGRESS_INTERVAL)
+            logging.info("停止処理: 募集 %s/%s 件を終了しました。", done, total)
+            if report:
+                try:
+                    await report(f"🟠 停止処理中: 募集 {done}/{total} 件を終了しました。")
+                except Exception as e:
+                    logging.warning("停止処理の進捗を報告できませんでした: %s", e)
+
+    tasks = [asyncio.create_task(end_one(recruiter_id)) for recruiter_id in recruiter_ids]
+    progress_task = asyncio.create_task(report_progress())
+    try:
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=DRAIN_DEADLINE)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logging.warning("停止処理の期限 (%s秒) を過ぎたため、募集 %s 件の終了を打ち切りました。", DRAIN_DEADLINE, len(pending))
+    finally:
+        progress_task.cancel()
+    return done, total
+
+
+async def shutdown_bot(reason: str, report=None):
+    """
+    ドレインモードに入ってボットを停止する。
+    新しい募集の受付と定期タスクを止め、募集状態を保存してから募集を並行して終了させ、最後にボットを閉じる。
+    停止コマンドと SIGTERM のどちらから呼ばれても、停止処理は1回だけ行う。
+    """
+    global drain_task
+    if drain_task is not None:
+        await asyncio.shield(drain_task)
+        return
+    drain_task = asyncio.current_task()
+    started = time.monotonic()
+    logging.info("停止処理を開始しました (理由: %s)。新しい募集の受付を停止します。", reason)
+
+    # 新しい募集の入口になる定期タスクを先に止める
+    run_matchmaking.cancel()
+    for name in ('start_button_task', 'status_update_task'):
+        task = getattr(bot, name, None)
+        if task is not None and task.is_running():
+            task.cancel()
+    logging.info("マッチング・募集開始ボタン更新・ステータス更新タスクを停止しました。")
+    # 終了していく募集の通知を送らないよう、配信も止める
+    await notification_fanout.close()
+
+    # 途中で打ち切られても次回起動時に復元・片付けできるよう、先に現在の状態を書き込む
+    await recruit_store.flush()
+
+    ended, total = await drain_recruit_flows(report)
+    logging.info("停止処理: 募集 %s/%s 件を終了しました (%.1f秒)。", ended, total, time.monotonic() - started)
+    if report:
+        try:
+            if DRAIN_HANDOFF:
+                await report(f"🔴 募集 {total} 件を次のプロセスに引き継ぎ、Botをオフラインにします。")
+            else:
+                await report(f"🔴 募集 {ended}/{total} 件を終了しました。Botをオフラインにします。")
+        except Exception as e:
+            logging.warning("停止処理の完了を報告できませんでした: %s", e)
+
+    await empty_vc_scheduler.stop()
+    await wizard_scheduler.stop()
+    for pool in vc_pools.values():
+        await pool.stop()
+    await rest_scheduler.stop()
+    await release_leases()
+    await recruit_store.close()
+    await recruit_journal.close()
+    await stop_ops_server()
     await bot.close()
 
+
+def handle_sigterm():
+    """SIGTERM を受けたら停止コマンドと同じ停止処理を始める"""
+    if is_draining():
+        return
+    logging.info("SIGTERM を受信しました。")
+    asyncio.get_running_loop().create_task(shutdown_bot("SIGTERM"))
+
+
+@bot.command()
+@commands.is_owner()
+async def 停止(ctx):
+    """ボットをオフラインにするコマンド (新しい募集の受付を止め、進行中の募集を並行して終了させてから停止する)"""
+    logging.info("%s がボット停止コマンドを実行しました。", ctx.author.display_name)
+    if is_draining():
+        await ctx.send("停止処理は既に進行中です。")
+        return
+    progress = await ctx.send(f"🟠 停止処理を開始しました。募集 {len(active_recruit_flows)} 件を終了しています...")
+    await shutdown_bot(f"{ctx.author.display_name} の停止コマンド", report=lambda text: progress.edit(content=text))
+
+@bot.command()
+@commands.is_owner()
+async def コマンド同期(ctx):
+    """管理者用: スラッシュコマンドの定義が変わっていなくても強制的に同期し直すコマンド"""
+    await sync_command_tree(force=True)
+    await ctx.send("スラッシュコマンドを同期しました。")
+
+
 @bot.command()
 async def ping(ctx):
     """ボットの応答を確認するコマンド"""
     await ctx.send(f"🏓 Pong! Bot Latency: {round(bot.latency * 1000)}ms")
 
 
+@bot.command()
+@commands.is_owner()
+async def 設定リロード(ctx):
+    """管理者用: ギルドごとの設定ファイルを再起動せずに読み直すコマンド"""
+    try:
+        guild_configs.load()
+    except Exception as e:
+        logging.error("ギルド設定の再読み込み中にエラーが発生しました: %s", e)
+        await ctx.send(f"設定の読み込みに失敗しました: {e}")
+        return
+
+    if VC_POOL_SIZE > 0:
+        for config in guild_configs.all():
+            if config.category:
+                get_vc_pool(config.category.id).start(config.category)
+    logging.info("%s がギルド設定を再読み込みしました。", ctx.author.display_name)
+    await ctx.send(f"ギルド設定 {len(guild_configs)} 件を読み込みました。")
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    """新しく参加したギルドの設定を解決する"""
+    try:
+        guild_configs.resolve_guild(guild)
+    except Exception as e:
+        logging.error("ギルド %s の設定の解決中にエラーが発生しました: %s", guild.id, e, extra={"guild_id": guild.id})
+
+
+@bot.command()
+@commands.is_owner()
+async def REST状況(ctx):
+    """管理者用: RESTスケジューラのキューの深さ・待ち時間・回路の状態を表示するコマンド"""
+    stats = rest_scheduler.stats()
+    names = {PRIORITY_INTERACTIVE: "対話", PRIORITY_NORMAL: "通常", PRIORITY_BACKGROUND: "後処理"}
+    lines = [f"完了: {stats['completed']} / 失敗: {stats['failed']} / リトライ: {stats['retried']}"]
+    for priority, name in names.items():
+        wait = stats["waits"][priority]
+        lines.append(
+            f"[{name}] 待機中: {stats['queued'][priority]}件 / 平均待ち: {wait['avg'] * 1000:.0f}ms"
+            f" / 最大待ち: {wait['max'] * 1000:.0f}ms / 直近中央値: {wait['p50_recent'] * 1000:.0f}ms"
+        )
+    lines.append(f"開いている回路: {', '.join(stats['open_circuits']) or 'なし'}")
+    await ctx.send("\n".join(lines))
+
+
 @tasks.loop(minutes=10)
 async def update_bot_status():
     """ボットのステータスを定期的に更新し、Replitの活性状態を保つタスク"""
+    # 同じシャードを担当するプロセスが重複している間 (ローリング再起動中など) は、リースを持つプロセスだけが更新する
+    if not await acquire_lease(f"bot_status:{','.join(map(str, sorted(getattr(bot, 'shard_ids', None) or [])))}"):
+        return
     try:
         current_time = datetime.now().strftime("%H:%M")
         await bot.change_presence(activity=discord.Game(name=f"稼働中 | {current_time}"))
-        logging.info(f"Botステータスを更新しました: '稼働中 | {current_time}'")
+        logging.info("Botステータスを更新しました: '稼働中 | %s'", current_time, extra={"rate_limit": True})
     except Exception as e:
-        logging.error(f"Botステータス更新中にエラーが発生しました: {e}")
+        logging.error("Botステータス更新中にエラーが発生しました: %s", e)
 
 
-@tasks.loop(seconds=START_BUTTON_UPDATE_INTERVAL)
-async def manage_start_button_message():
-    """
-    募集開始ボタンのメッセージを、指定されたチャンネルに常に存在するように管理するタスク。
-    メッセージが削除された場合は再投稿し、存在する場合は編集のみを行う。
-    """
-    logging.info("募集開始ボタンのメッセージ管理タスクを実行中...")
+def start_button_signature(content: str, buttons) -> str:
+    """募集開始ボタンのメッセージの本文とボタンからハッシュを計算する"""
+    payload = [content] + [
+        [button.custom_id, button.label, int(button.style.value), bool(button.disabled)]
+        for button in buttons
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()
 
-    channel = bot.get_channel(RECRUIT_BUTTON_CHANNEL_ID)
-    if not channel or not isinstance(channel, discord.TextChannel):
-        logging.error(f"募集開始ボタンチャンネル (ID: {RECRUIT_BUTTON_CHANNEL_ID}) が見つからないか、テキストチャンネルではありません。")
-        return
 
+async def ensure_start_button(channel: discord.TextChannel, verify: bool = False):
+    """
+    募集開始ボタンのメッセージがチャンネルに存在し、最新の内容であることを保証する。
+    内容のハッシュが前回反映したものと同じなら何もしない。verify=True の場合はメッセージの実体をキャッシュ
+    (無ければ fetch_message) で確認し、内容が変わっているときだけ編集する。
+    """
+    view = RecruitButtonView()
+    expected = start_button_signature(START_BUTTON_CONTENT, view.children)
     message_id = start_button_message_info.get(channel.id)
-    view = RecruitButtonView() 
 
     if message_id:
+        current = start_button_hashes.get(channel.id)
+        if verify or current is None:
+            message = discord.utils.get(bot.cached_messages, id=message_id)
+            if message is None:
+                try:
+                    message = await rest_scheduler.submit(f"messages:{channel.id}", lambda: channel.fetch_message(message_id), priority=PRIORITY_BACKGROUND)
+                except discord.NotFound:
+                    logging.warning("募集開始メッセージ (ID: %s) がチャンネル %s から見つかりません。再投稿します。", message_id, channel.name)
+                    message_id = None
+            if message is not None:
+                current = start_button_signature(message.content, [item for row in message.components for item in row.children])
+
+        if message_id and current == expected:
+            start_button_hashes[channel.id] = current
+            return
+
+        if message_id:
+            try:
+                partial_message = channel.get_partial_message(message_id)
+                await rest_scheduler.submit(
+                    f"messages:{channel.id}",
+                    lambda: partial_message.edit(content=START_BUTTON_CONTENT, view=view),
+                    priority=PRIORITY_BACKGROUND
+                )
+                start_button_hashes[channel.id] = expected
+                logging.info("既存の募集開始メッセージ (ID: %s) を更新しました。", message_id, extra={"rate_limit": True})
+                return
+            except discord.NotFound:
+                logging.warning("募集開始メッセージ (ID: %s) がチャンネル %s から見つかりません。再投稿します。", message_id, channel.name)
+
+    new_message = await rest_scheduler.submit(f"messages:{channel.id}", lambda: channel.send(START_BUTTON_CONTENT, view=view), priority=PRIORITY_BACKGROUND, idempotent=False)
+    start_button_message_info[channel.id] = new_message.id
+    start_button_hashes[channel.id] = expected
+    recruit_store.save_start_button(channel.id, new_message.id)
+    logging.info("募集開始メッセージを新規送信しました。(ID: %s)", new_message.id)
+
+
+def schedule_start_button_repost(channel_id: int):
+    """削除された募集開始ボタンを少し待ってから再投稿する (連続した削除は1回の再投稿にまとめる)"""
+    task = start_button_repost_tasks.get(channel_id)
+    if task and not task.done():
+        return
+
+    async def repost():
+        await asyncio.sleep(START_BUTTON_REPOST_DELAY)
+        channel = bot.get_channel(channel_id)
+        if not channel or not isinstance(channel, discord.TextChannel):
+            return
+        if not await acquire_lease(f"start_button:{channel_id}"):
+            return  # 別のプロセスが管理している
         try:
-            message_to_edit = await channel.fetch_message(message_id)
-            await message_to_edit.edit(content="募集を開始するには以下のボタンを押してください：", view=view)
-            logging.info(f"既存の募集開始メッセージ (ID: {message_id}) を更新しました。")
-        except discord.NotFound:
-            logging.warning(f"募集開始メッセージ (ID: {message_id}) がチャンネル {channel.name} から見つかりません。再投稿します。")
-            new_message = await channel.send("募集を開始するには以下のボタンを押してください：", view=view)
-            start_button_message_info[channel.id] = new_message.id
-            logging.info(f"募集開始メッセージを新規送信しました。(ID: {new_message.id})")
+            await ensure_start_button(channel)
         except Exception as e:
-            logging.error(f"既存の募集開始メッセージ更新中に予期せぬエラー: {e}")
-            try:
-                new_message = await channel.send("募集を開始するには以下のボタンを押してください：", view=view)
-                start_button_message_info[channel.id] = new_message.id
-                logging.info(f"募集開始メッセージを新規送信しました。(ID: {new_message.id}) (エラー回復)")
-            except Exception as e_resend:
-                logging.error(f"募集開始メッセージ再送信中にエラー: {e_resend}")
-    else:
+            logging.error("募集開始メッセージの再投稿中にエラー: %s", e)
+
+    start_button_repost_tasks[channel_id] = bot.loop.create_task(repost())
+
+
+def on_start_button_deleted(channel_id: int, message_ids):
+    if start_button_message_info.get(channel_id) not in message_ids:
+        return
+    logging.warning("募集開始メッセージ (ID: %s) が削除されました。再投稿します。", start_button_message_info[channel_id])
+    del start_button_message_info[channel_id]
+    start_button_hashes.pop(channel_id, None)
+    schedule_start_button_repost(channel_id)
+
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    on_start_button_deleted(payload.channel_id, {payload.message_id})
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    on_start_button_deleted(payload.channel_id, payload.message_ids)
+
+
+@tasks.loop(seconds=START_BUTTON_FALLBACK_INTERVAL)
+async def manage_start_button_message():
+    """
+    募集開始ボタンのメッセージを、指定されたチャンネルに常に存在するように管理するタスク。
+    通常は削除イベントから再投稿するため、このタスクは削除イベントを取りこぼした場合のフォールバックとして実体を確認し、
+    内容が変わっている場合だけ編集、消えている場合は再投稿する。
+    """
+    logging.info("募集開始ボタンのメッセージ確認タスクを実行中...")
+
+    for config in guild_configs.all():
+        channel = config.button_channel
+        if not channel:
+            continue
+
+        # 複数プロセスで動かしている場合は、リースを持つプロセスだけがボタンを管理する
+        if not await acquire_lease(f"start_button:{channel.id}"):
+            continue
+
         try:
-            new_message = await channel.send("募集を開始するには以下のボタンを押してください：", view=view)
-            start_button_message_info[channel.id] = new_message.id
-            logging.info(f"募集開始メッセージを新規送信しました。(ID: {new_message.id})")
+            await ensure_start_button(channel, verify=True)
         except Exception as e:
-            logging.error(f"募集開始メッセージの初回送信中にエラー: {e}")
+            logging.error("募集開始メッセージ (チャンネルID: %s) の確認中に予期せぬエラー: %s", channel.id, e)
+
+
+# --- 運用向けHTTPサーバー ---
+
+register_metric(Gauge("valorant_active_recruits", "募集中の募集の数", lambda: len(recruit_index)))
+register_metric(Gauge("valorant_recruit_flows", "進行中の募集フロー (作成途中を含む) の数", lambda: len(active_recruit_flows)))
+register_metric(Gauge("valorant_empty_vc_deadlines", "空室VCの終了待ち期限の数", lambda: len(empty_vc_scheduler)))
+register_metric(Gauge("valorant_member_lru_size", "メンバー解決用LRUに保持しているメンバーの数", lambda: len(member_resolver)))
+register_metric(Gauge("valorant_journal_records", "このプロセスが募集ジャーナルに記録したイベントの数", lambda: recruit_journal.records))
+register_metric(Gauge("valorant_subscriptions", "募集通知の登録の数", lambda: len(subscription_index)))
+register_metric(Gauge("valorant_notification_queue_depth", "配信待ちの募集通知の数", lambda: notification_fanout.queue_depth()))
+register_metric(Gauge("valorant_wizard_deadlines", "入力途中の募集フローの放置期限の数", lambda: len(wizard_scheduler)))
+register_metric(Gauge("valorant_rest_queue_depth", "RESTスケジューラのキューに積まれたジョブの数", lambda: {(priority,): count for priority, count in rest_scheduler.stats()["queued"].items()}, ("priority",)))
+register_metric(Gauge("valorant_embed_updates_pending", "反映待ちの募集Embed編集の数", lambda: embed_updater.pending_count()))
+register_metric(Gauge("valorant_state_writes_pending", "書き込み待ちの募集状態の数", lambda: recruit_store.pending_count()))
+register_metric(Gauge("valorant_matchmaking_queue", "マッチング待ちのプレイヤーの数", lambda: len(matchmaking_queue)))
+register_metric(Gauge("valorant_draining", "停止処理中なら1", lambda: int(is_draining())))
+register_metric(Gauge("valorant_log_queue_depth", "書き出し待ちのログの数", lambda: log_pipeline.queue.qsize()))
+register_metric(Gauge("valorant_log_records_dropped_total", "出力せずに捨てたログの数", lambda: {(reason,): count for reason, count in log_pipeline.dropped.items()}, ("reason",), metric_type="counter"))
+register_metric(Gauge("valorant_gateway_latency_seconds", "ゲートウェイのレイテンシ", lambda: bot.latency if bot.latency == bot.latency else -1))
+
+
+def background_task_states() -> dict:
+    """常駐タスクごとの稼働状況を返す"""
+    return {
+        "rest_scheduler": rest_scheduler.is_running(),
+        "state_store": recruit_store.is_running(),
+        "empty_vc_scheduler": empty_vc_scheduler.is_running(),
+        "wizard_scheduler": wizard_scheduler.is_running(),
+        "notification_fanout": notification_fanout.is_running(),
+        "matchmaking": run_matchmaking.is_running(),
+        "start_button": hasattr(bot, 'start_button_task') and bot.start_button_task.is_running(),
+        "status_update": hasattr(bot, 'status_update_task') and bot.status_update_task.is_running(),
+    }
+
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    """プロセスが応答できるかだけを返す (liveness)"""
+    return web.Response(text="ok")
+
+
+async def handle_readyz(request: web.Request) -> web.Response:
+    """ゲートウェイに接続済みで、常駐タスクがすべて動いているかを返す (readiness)"""
+    latency = bot.latency
+    tasks = background_task_states()
+    checks = {
+        "gateway": bot.is_ready() and not bot.is_closed(),
+        "latency": latency == latency and latency < READY_MAX_LATENCY,  # 未計測の間は NaN
+        "background_tasks": all(tasks.values()),
+        "accepting": not is_draining(),
+    }
+    body = {
+        "ready": all(checks.values()),
+        "checks": checks,
+        "latency": latency if latency == latency else None,
+        "tasks": tasks,
+    }
+    return web.json_response(body, status=200 if body["ready"] else 503)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Prometheus形式のメトリクスを返す"""
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def handle_traces(request: web.Request) -> web.Response:
+    """リングバッファに残っている最近のスパンを返す (?trace_id= で1件のトレースに絞り込む)"""
+    trace_id = request.query.get("trace_id")
+    limit = int(request.query.get("limit", "200"))
+    return web.json_response(tracer.recent(trace_id, limit))
+
+
+async def start_ops_server():
+    """Botと同じイベントループ上で運用向けHTTPサーバーを起動する"""
+    app = web.Application()
+    app.router.add_get("/healthz", handle_healthz)
+    app.router.add_get("/readyz", handle_readyz)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/traces", handle_traces)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = OPS_HTTP_PORT + (int(CLUSTER_ID) if CLUSTER_ID is not None else 0)
+    site = web.TCPSite(runner, OPS_HTTP_HOST, port)
+    await site.start()
+    bot.ops_runner = runner
+    logging.info("運用向けHTTPサーバーを %s:%s で起動しました。", OPS_HTTP_HOST, port)
+
+
+async def stop_ops_server():
+    if hasattr(bot, 'ops_runner'):
+        await bot.ops_runner.cleanup()
+        del bot.ops_runner
+
+
+@bot.event
+async def setup_hook():
+    # 募集メッセージと募集入力のコンポーネントは custom_id から状態を復元するため、クラスだけを登録する
+    bot.add_dynamic_items(RecruitPostButton, LegacyRecruitPostButton, WizardSelect, WizardTitleButton)
+    try:
+        await start_ops_server()
+    except OSError as e:
+        logging.error("運用向けHTTPサーバーの起動に失敗しました: %s", e)
+    try:
+        bot.loop.add_signal_handler(signal.SIGTERM, handle_sigterm)
+    except (NotImplementedError, RuntimeError):
+        logging.warning("このプラットフォームでは SIGTERM による停止処理を登録できません。")
+
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    # スラッシュコマンドはインタラクションの作成時刻から完了までを処理時間として記録する
+    elapsed = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    interaction_seconds.observe(elapsed, f"/{command.qualified_name}")
+    interactions_total.inc(f"/{command.qualified_name}", "ok")
+
+
+def log_startup_report():
+    """起動にかかった時間・メモリ使用量・キャッシュ済みメンバー数をメンバーキャッシュのモードと合わせて記録する"""
+    # ru_maxrss は Linux では KiB 単位
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    cached_members = sum(len(guild.members) for guild in bot.guilds)
+    logging.info(
+        "起動レポート: メンバーキャッシュ=%s, 起動時間=%.1f秒, 最大RSS=%s, キャッシュ済みメンバー=%s人 (%sギルド)",
+        "lean" if LEAN_MEMBER_CACHE else "full",
+        time.monotonic() - PROCESS_STARTED_AT,
+        f"{max_rss:.1f}MiB" if max_rss is not None else "不明",
+        cached_members,
+        len(bot.guilds),
+    )
+
+
+def command_tree_fingerprint(guild=None) -> str:
+    """同期対象のスラッシュコマンドの定義 (名前・説明・引数など) から安定したハッシュを計算する"""
+    payload = sorted(
+        (command.to_dict(bot.tree) for command in bot.tree.get_commands(guild=guild)),
+        key=lambda command: (command.get("type", 1), command["name"])
+    )
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def load_command_sync_state() -> dict:
+    try:
+        with open(COMMAND_SYNC_STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning("スラッシュコマンドの同期状態を読み込めませんでした: %s", e)
+        return {}
+
+
+def save_command_sync_state(state: dict):
+    """同期状態を一時ファイルに書いてから置き換える (書き込み途中で止まっても壊れないように)"""
+    tmp_path = f"{COMMAND_SYNC_STATE_PATH}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, COMMAND_SYNC_STATE_PATH)
+    except OSError as e:
+        logging.warning("スラッシュコマンドの同期状態を保存できませんでした: %s", e)
+
+
+async def sync_command_tree(force: bool = False):
+    """
+    スラッシュコマンドの定義が前回の同期から変わっている場合だけ同期する。
+    DEV_GUILD_ID が指定されていれば、グローバルコマンドをそのギルドにコピーしてギルドだけに同期する。
+    シャード構成では、リースを取得した1プロセスだけが同期する。
+    """
+    if not await acquire_lease("command_sync"):
+        return
+    guild = discord.Object(id=DEV_GUILD_ID) if DEV_GUILD_ID else None
+    if guild:
+        bot.tree.copy_global_to(guild=guild)
+    fingerprint = command_tree_fingerprint(guild)
+    key = f"{bot.application_id}:{DEV_GUILD_ID or 'global'}"
+    state = load_command_sync_state()
+    if not force and state.get(key) == fingerprint:
+        logging.info("スラッシュコマンドの定義に変更が無いため、同期を省略しました (%s)。", key)
+        return
+
+    try:
+        synced = await bot.tree.sync(guild=guild)
+    except Exception as e:
+        logging.error("スラッシュコマンドの同期中にエラーが発生しました: %s", e)
+        return
+    logging.info("スラッシュコマンド %s 件を同期しました (%s)。", len(synced), key)
+    for command in synced:
+        logging.info(" - / %s", command.name)
+    state[key] = fingerprint
+    save_command_sync_state(state)
 
 
 @bot.event
 async def on_ready():
-    logging.info(f'Logged in as {bot.user} (ID: {bot.user.id})')
-    logging.info(f'Guilds: {len(bot.guilds)}')
+    logging.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
+    logging.info("Guilds: %s", len(bot.guilds))
+
+    # ギルドごとの設定を読み込み、チャンネルとロールを解決する
+    try:
+        guild_configs.load()
+    except Exception as e:
+        logging.error("ギルド設定の読み込み中にエラーが発生しました: %s", e)
+
+    # 保存されていた募集状態を復元し、定期的な書き込みを開始する (初回の接続時のみ)
+    if not hasattr(bot, 'recruit_state_restored'):
+        bot.recruit_state_restored = True
+        bot.add_view(RecruitButtonView())  # 募集開始ボタンを永続Viewとして登録
+        try:
+            await restore_recruit_state()
+        except Exception as e:
+            logging.error("募集状態の復元中にエラーが発生しました: %s", e)
+        try:
+            await restore_subscriptions()
+        except Exception as e:
+            logging.error("募集通知の登録の読み込み中にエラーが発生しました: %s", e)
+        log_startup_report()
+    recruit_store.start()
+    # RESTスケジューラと通知の配信ワーカーは最初のジョブを待たずに起動しておく (/readyz で稼働中と判定されるように)
+    rest_scheduler.start()
+    notification_fanout.start()
 
     # 募集開始ボタン管理タスクを開始
     if not hasattr(bot, 'start_button_task') or not bot.start_button_task.is_running():
@@ -829,20 +4756,63 @@ async def on_ready():
         bot.start_button_task.start()
         logging.info("募集開始ボタン管理タスクを開始しました。")
 
+    # 待機VCプールを開始
+    if VC_POOL_SIZE > 0:
+        for config in guild_configs.all():
+            if config.category:
+                get_vc_pool(config.category.id).start(config.category)
+
+    # 空室VCの期限スケジューラを開始し、再接続中に取りこぼした入退室を反映する
+    empty_vc_scheduler.start()
+    wizard_scheduler.start()
+    for vc_id in list(vc_recruiters.keys()):
+        vc_channel = bot.get_channel(vc_id)
+        if vc_channel:
+            set_vc_occupancy(vc_id, len(vc_channel.voice_states))
+
+    # マッチングタスクを開始
+    if not run_matchmaking.is_running():
+        run_matchmaking.start()
+        logging.info("マッチングタスクを開始しました。")
+
     # ステータス更新タスクを開始
     if not hasattr(bot, 'status_update_task') or not bot.status_update_task.is_running():
         bot.status_update_task = update_bot_status
         bot.status_update_task.start()
         logging.info("ステータス更新タスクを開始しました。")
 
-    # スラッシュコマンドを同期する
-    try:
-        synced = await bot.tree.sync() 
-        logging.info(f"スラッシュコマンド {len(synced)} 件を同期しました。")
-        for command in synced:
-            logging.info(f" - / {command.name}")
-    except Exception as e:
-        logging.error(f"スラッシュコマンドの同期中にエラーが発生しました: {e}")
+    # スラッシュコマンドを同期する (再接続のたびに on_ready が呼ばれるため、プロセスごとに1回だけ。定義が変わっていなければ同期しない)
+    if not hasattr(bot, 'command_sync_task'):
+        bot.command_sync_task = bot.loop.create_task(sync_command_tree())
 
-bot.run(os.environ['DISCORD_BOT_TOKEN'])
+def run_cluster_launcher():
+    """
+    シャードを CLUSTER_COUNT 個のプロセスに分けて起動し、すべてのプロセスが終了するまで待つ。
+    各プロセスには SHARD_IDS と CLUSTER_ID を環境変数で渡し、募集状態は共有バックエンドで共有する。
+    """
+    shard_count = SHARD_COUNT or CLUSTER_COUNT
+    processes = []
+    for cluster_id in range(CLUSTER_COUNT):
+        shard_ids = [shard_id for shard_id in range(shard_count) if shard_id % CLUSTER_COUNT == cluster_id]
+        if not shard_ids:
+            continue
+        env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=",".join(map(str, shard_ids)), CLUSTER_ID=str(cluster_id))
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+        logging.info("クラスタ %s (シャード %s) を起動しました。", cluster_id, shard_ids)
+
+    def forward_signal(signum, frame):
+        for process in processes:
+            process.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+    sys.exit(max(process.wait() for process in processes))
+
+
+if __name__ == "__main__":
+    if CLUSTER_COUNT > 1 and CLUSTER_ID is None:
+        run_cluster_launcher()
+    else:
+        # discord.py 既定の同期的な出力ハンドラーは付けず、ログは log_pipeline で書き出す
+        bot.run(os.environ['DISCORD_BOT_TOKEN'], log_handler=None)
 